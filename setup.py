@@ -22,9 +22,10 @@ setup(
     author_email = 'zang@virginia.edu',
     license = 'MIT',
     packages=find_packages(),
-    scripts=['bin/sicer','bin/sicer_df', 'bin/recognicer', 'bin/recognicer_df'],
+    scripts=['bin/sicer','bin/sicer_df', 'bin/recognicer', 'bin/recognicer_df', 'bin/sicer_sweep'],
     setup_requires=['numpy','scipy>=1.0.0'],
     install_requires=['numpy','scipy>=1.0.0'],
+    extras_require={'parquet': ['pyarrow']},
     keywords = ['ChIP-Seq','SICER'],
     classifiers=["Programming Language :: Python :: 3",
         "Environment :: Other Environment",
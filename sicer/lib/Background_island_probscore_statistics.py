@@ -16,6 +16,8 @@
 
 from math import *
 
+import numpy as np
+
 
 class Background_island_probscore_statistics:
     #  External genomeLength and gapSize are in units of bps
@@ -90,6 +92,7 @@ class Background_island_probscore_statistics:
         #           self.island_expectation[scaled_score] = prob*self.genome_length;
         # initial condition
         self.island_expectation[0] = self.boundary_contribution * self.genome_length / self.gap_contribution;
+        self.island_expectation = np.array(self.island_expectation, dtype=np.float64);
 
         self.root = self.find_asymptotics_exponent();
         # print "Exponent for Asymptotics: ", self.root;
@@ -164,32 +167,33 @@ class Background_island_probscore_statistics:
     def background_island_expectation(self, scaled_score):
         current_max_scaled_score = len(self.island_expectation) - 1
         if scaled_score > current_max_scaled_score:
-            # index is the scaled_score
-            for index in range(current_max_scaled_score + 1, scaled_score + 1):
-                temp = 0.0
-                # i is the number of tags in the added window
-                i = self.min_tags_in_window
-                while (int(round(index - self.window_score[i] / self.bin_size)) >= 0):
-                    # while ( (index - self.window_scaled_score[i])>=0):
-                    temp += self.poisson_value[i] * self.island_expectation[
-                        int(round(index - self.window_score[i] / self.bin_size))]
-                    # temp += self.poisson_value[i]* self.island_expectation[index - self.window_scaled_score[i]];
-                    i += 1
+            # A bin only depends on bins at least the lowest window score below it. Bins closer together
+            # than that are independent, so a block of them is computed at once, up to 1/bin_size bins.
+            lowest_scaled_score = min(self.window_score[self.min_tags_in_window:]) / self.bin_size
+            block_size = max(1, min(int(1 / self.bin_size), int(lowest_scaled_score)))
+            for block_start in range(current_max_scaled_score + 1, scaled_score + 1, block_size):
+                # index is the scaled_score
+                index = np.arange(block_start, min(block_start + block_size, scaled_score + 1))
+                temp = np.zeros(len(index), dtype=np.float64)
+                # i is the number of tags in the added window. Windows are added while they fit in the score
+                # of the bin, in order of i, so that every bin is summed in the same order as one at a time.
+                fits = np.ones(len(index), dtype=bool)
+                for i in range(self.min_tags_in_window, self.max_index):
+                    previous_index = np.rint(index - self.window_score[i] / self.bin_size).astype(np.int64)
+                    fits &= previous_index >= 0
+                    if not fits.any():
+                        break
+                    temp[fits] += self.poisson_value[i] * self.island_expectation[previous_index[fits]]
                 temp *= self.gap_contribution
-                self.island_expectation.append(temp)
-                # print index, temp, self.island_expectation[index];
+                self.island_expectation = np.concatenate((self.island_expectation, temp))
         return self.island_expectation[scaled_score]
 
     def generate_cumulative_dist(self, outfile=""):
         """
         Generate cumulative distribution: a list of tuples (bins, hist).
         """
-        self.cumulative = [0] * len(self.island_expectation)
-        partial_sum = 0.0
-        for index in range(1, len(self.island_expectation) + 1):
-            complimentary = len(self.island_expectation) - index
-            partial_sum += self.island_expectation[complimentary]  # The end is outside of the index
-            self.cumulative[complimentary] = partial_sum
+        # Running sum from the end, np.cumsum adds in order
+        self.cumulative = np.cumsum(self.island_expectation[::-1])[::-1]
 
         if outfile != "":
             fixpoint = int(len(self.island_expectation) / 2)
@@ -216,6 +220,10 @@ class Background_island_probscore_statistics:
         current_expectation = self.island_expectation[-1]
         assert (current_expectation == self.island_expectation[current_scaled_score]);
         interval = int(1 / self.bin_size)
+        # partial_cumu is the sum of the last interval - 1 bins. Every round adds interval bins, so the bins of a
+        # sum are all new and each bin is summed once. A running total over all the bins would give these sums
+        # as differences of totals many orders of magnitude larger, which loses them to rounding, so the bins
+        # are summed in order, like the first versions did.
         if len(self.island_expectation) > interval:
             partial_cumu = sum(self.island_expectation[-interval: -1])
         else:
@@ -231,10 +239,8 @@ class Background_island_probscore_statistics:
             # print  index*self.bin_size, self.island_expectation[index];
 
         self.generate_cumulative_dist()
-        for index in range(len(self.cumulative)):
-            if self.cumulative[index] <= e_value_threshold:
-                score_threshold = index * self.bin_size
-                break
+        index = int(np.flatnonzero(self.cumulative <= e_value_threshold)[0])
+        score_threshold = index * self.bin_size
         return score_threshold
 
     def func(self, x):
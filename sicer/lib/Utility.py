@@ -185,3 +185,14 @@ def extract_two_columns(gene_file, c1, c2, outfile):
         ofile.write(outline);
     ofile.close();
     file.close();
+
+def bed_file_name(file_name):
+    """
+    Returns the name under which the reads of an input file are processed:
+    the reads of x.bam and x.bed.gz are named after x.bed, as if the file had been converted to BED.
+    """
+    if file_name.lower().endswith('.gz'):
+        return file_name[:-3];
+    if file_name.lower().endswith('.bam'):
+        return file_name[:-4] + '.bed';
+    return file_name;
@@ -15,15 +15,24 @@
 
 
 import bisect
+from functools import partial
 
+import numpy as np
 
-def tag_position(line, fragment_size):
+from sicer.lib import island_store
+from sicer.lib import read_store
+from sicer.lib import scheduler
+from sicer.lib import shared_arrays
+
+
+def tag_position(read, fragment_size):
+    """read: a read in the format of sicer.lib.read_store"""
     shift = int(round(fragment_size / 2))
-    strand = line[5]
-    if strand == '+':
-        return int(line[1]) + shift
-    elif strand == '-':
-        return int(line[2]) - 1 - shift
+    strand = read['strand']
+    if strand == read_store.PLUS:
+        return int(read['start']) + shift
+    elif strand == read_store.MINUS:
+        return int(read['end']) - 1 - shift
 
 
 def find_readcount_on_islands(island_start_list, island_end_list, tag_position):
@@ -38,3 +47,98 @@ def find_readcount_on_islands(island_start_list, island_end_list, tag_position):
         return index - 1;
     else:
         return -1;
+
+
+def tag_positions(reads, fragment_size):
+    """
+    reads: an array of reads in the format of sicer.lib.read_store
+    Returns the positions of the reads, as tag_position, and a boolean array that is False
+    for reads on neither strand, which have no position.
+    """
+    shift = int(round(fragment_size / 2))
+    plus = reads['strand'] == read_store.PLUS
+    has_position = plus | (reads['strand'] == read_store.MINUS)
+    positions = np.where(plus, reads['start'].astype(np.int64) + shift, reads['end'].astype(np.int64) - 1 - shift)
+    return (positions, has_position)
+
+
+def find_islands_of_positions(island_starts, island_ends, positions):
+    """
+    Same as find_readcount_on_islands, for an array of tag positions.
+    island_starts and island_ends must be sorted. Islands are non-overlapping!
+    Returns the array of the indices of the islands on which the tags land, or -1.
+    """
+    index = np.searchsorted(island_starts, positions, side='right')
+    on_island = index - np.searchsorted(island_ends, positions, side='left') == 1
+    return np.where(on_island, index - 1, -1)
+
+
+def find_readcount_of_islands(island_starts, island_ends, reads, fragment_size):
+    """
+    Counts the reads that land on each island (see find_islands_of_positions).
+    Returns the array of read counts of the islands.
+    """
+    (positions, has_position) = tag_positions(reads, fragment_size)
+    island_index = find_islands_of_positions(island_starts, island_ends, positions[has_position])
+    return np.bincount(island_index[island_index >= 0], minlength=len(island_starts))
+
+
+def window_tag_counts(reads, fragment_size, window_size):
+    """
+    Counts the tags of the reads (see tag_positions) in each window of window_size, including the tags outside
+    of the chromosome, which are not clipped as in the graph files.
+    Returns the windows with tags (sicer.lib.island_store.window_dtype), sorted by start.
+    """
+    (positions, has_position) = tag_positions(reads, fragment_size)
+    (window_index, counts) = np.unique(positions[has_position] // window_size, return_counts=True)
+    windows = np.empty(len(window_index), dtype=island_store.window_dtype)
+    windows['start'] = window_index * window_size
+    windows['end'] = windows['start'] + window_size - 1
+    windows['count'] = counts
+    return windows
+
+
+def find_readcount_of_islands_from_windows(island_starts, island_ends, windows):
+    """
+    Same as find_readcount_of_islands, from the tag counts of the windows of the reads (see window_tag_counts).
+    The islands must begin and end on the borders of the windows, as the islands made of windows do.
+    """
+    cumulative_counts = np.concatenate(([0], np.cumsum(windows['count'], dtype=np.int64)))
+    first_window = np.searchsorted(windows['start'], island_starts, side='left')
+    end_window = np.searchsorted(windows['start'], island_ends, side='right')
+    return cumulative_counts[end_window] - cumulative_counts[first_window]
+
+
+def count_reads_in_range(fragment_size, file_pairs, pair_index, read_range):
+    """Function for handling multiprocessing. Counts a range of the reads of a pair of files on its islands."""
+    (island_file, read_file) = file_pairs[pair_index]
+    islands = island_store.load(island_file)
+    reads = np.load(read_file, mmap_mode='r')[read_range[0]:read_range[1]]
+    return shared_arrays.share(find_readcount_of_islands(islands['start'], islands['end'], reads, fragment_size))
+
+
+def readcounts_of_islands(pool, cpu, fragment_size, file_pairs):
+    """
+    file_pairs: (island file, read file) pairs, e.g. the islands and reads of each chromosome
+    Counts the reads of each pair on its islands in the processes of the pool. The reads of large chromosomes
+    are split into ranges counted by separate processes, and the counts of the ranges are added up.
+    Returns the array of read counts of the islands of each pair.
+    """
+    read_counts = [len(np.load(read_file, mmap_mode='r')) for (island_file, read_file) in file_pairs]
+    reads_per_part = scheduler.part_size(sum(read_counts), cpu, scheduler.min_reads_per_part)
+    list_of_parts = []
+    for (pair_index, read_count) in enumerate(read_counts):
+        for read_range in scheduler.split_range(read_count, reads_per_part):
+            list_of_parts.append((pair_index, read_range))
+    part_counts = scheduler.starmap_by_cost(pool, partial(count_reads_in_range, fragment_size, file_pairs),
+                                            list_of_parts, [read_range[1] - read_range[0]
+                                                            for (pair_index, read_range) in list_of_parts])
+
+    island_readcounts = [None] * len(file_pairs)
+    with shared_arrays.SharedArrays() as received:
+        for ((pair_index, read_range), counts) in zip(list_of_parts, part_counts):
+            if island_readcounts[pair_index] is None:
+                island_readcounts[pair_index] = np.array(received.receive(counts))
+            else:
+                island_readcounts[pair_index] += received.receive(counts)
+    return island_readcounts
@@ -0,0 +1,264 @@
+# Author: Jin Yong Yoo
+
+"""
+Reading BAM files without external tools.
+
+Alignments are converted to reads the way "bedtools bamtobed" converts them,
+so that a BAM file gives the same results as the BED file made from it:
+unmapped alignments are skipped, a read covers the reference bases of its
+CIGAR operations (M, D, N, = and X), its name is the query name followed by
+/1 or /2 for paired reads, its score is the mapping quality and its strand
+comes from the reverse complement flag.
+
+When the BAM file has a BAI index, the reads of each chromosome can be read
+on their own (see reference_ranges).
+"""
+
+import os
+import struct
+
+import numpy as np
+
+from sicer.lib import bed_reader
+from sicer.lib import bgzf
+from sicer.lib import read_store
+
+bam_magic = b'BAM\x01'
+bai_magic = b'BAI\x01'
+
+# Bin of the index holding the range of virtual offsets of a reference's alignments
+pseudo_bin = 37450
+
+# Fixed-size part of an alignment record, including its block_size field
+record_header_size = 36
+
+# Flags
+flag_paired = 0x1
+flag_unmapped = 0x4
+flag_reverse = 0x10
+flag_first_mate = 0x40
+flag_second_mate = 0x80
+
+# Bit mask of the CIGAR operations that consume the reference: M, D, N, = and X
+reference_ops_mask = (1 << 0) | (1 << 2) | (1 << 3) | (1 << 7) | (1 << 8)
+
+int32_struct = struct.Struct('<i')
+
+
+def is_bam(path_to_file):
+    """Returns True if the file is a BAM file"""
+    if not bgzf.is_bgzf(path_to_file):
+        return False
+    with open(path_to_file, 'rb') as infile:
+        for (offset, compressed_data) in bgzf.iter_blocks(infile):
+            return bgzf.inflate(compressed_data)[:4] == bam_magic
+    return False
+
+
+def parse_header(data):
+    """
+    Parses the header at the beginning of the decompressed data of a BAM file.
+    Returns (reference names, header length), or None if data does not hold the complete header.
+    """
+    if len(data) < 12:
+        return None
+    if data[:4] != bam_magic:
+        raise ValueError("Not a BAM file")
+    text_length = int32_struct.unpack_from(data, 4)[0]
+    offset = 8 + text_length
+    if len(data) < offset + 4:
+        return None
+    num_references = int32_struct.unpack_from(data, offset)[0]
+    offset += 4
+    references = []
+    for i in range(num_references):
+        if len(data) < offset + 4:
+            return None
+        name_length = int32_struct.unpack_from(data, offset)[0]
+        if len(data) < offset + 8 + name_length:
+            return None
+        references.append(data[offset + 4:offset + 3 + name_length].decode())  # without the NUL terminator
+        offset += 8 + name_length  # l_name, name and l_ref
+    return (references, offset)
+
+
+def read_references(path_to_file):
+    """Returns the names of the references (chromosomes) in the header of the BAM file"""
+    data = b''
+    with open(path_to_file, 'rb') as infile:
+        for (offset, compressed_data) in bgzf.iter_blocks(infile):
+            data += bgzf.inflate(compressed_data)
+            header = parse_header(data)
+            if header is not None:
+                return header[0]
+    raise ValueError("Truncated BAM header")
+
+
+def find_index(path_to_file):
+    """Returns the path of the BAI index of the BAM file (x.bam.bai or x.bai), or None if there is none"""
+    for index_file in (path_to_file + '.bai', os.path.splitext(path_to_file)[0] + '.bai'):
+        if os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(path_to_file):
+            return index_file
+    return None
+
+
+def reference_ranges(index_file):
+    """
+    Reads a BAI index. Returns one (start, end) range of virtual offsets per reference that covers
+    every alignment of the reference, or None for references without alignments.
+    """
+    with open(index_file, 'rb') as infile:
+        data = infile.read()
+    if data[:4] != bai_magic:
+        raise ValueError("Not a BAI index")
+    num_references = int32_struct.unpack_from(data, 4)[0]
+    offset = 8
+    ranges = []
+    for i in range(num_references):
+        num_bins = int32_struct.unpack_from(data, offset)[0]
+        offset += 4
+        starts = []
+        ends = []
+        pseudo_bin_range = None
+        for j in range(num_bins):
+            (bin_number, num_chunks) = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            chunks = np.frombuffer(data, dtype='<u8', count=2 * num_chunks, offset=offset)
+            offset += 16 * num_chunks
+            if bin_number == pseudo_bin:
+                # The first "chunk" of the pseudo-bin is the range of the reference, the second holds read counts
+                pseudo_bin_range = (int(chunks[0]), int(chunks[1]))
+            elif num_chunks > 0:
+                starts.append(int(chunks[0::2].min()))
+                ends.append(int(chunks[1::2].max()))
+        num_intervals = int32_struct.unpack_from(data, offset)[0]
+        offset += 4 + 8 * num_intervals
+        if pseudo_bin_range is not None:
+            ranges.append(pseudo_bin_range)
+        elif starts:
+            ranges.append((min(starts), max(ends)))
+        else:
+            ranges.append(None)
+    return ranges
+
+
+def gather_integers(buf, offsets, dtype):
+    """Returns the little-endian integers of the given dtype found at the given offsets of buf"""
+    dtype = np.dtype(dtype).newbyteorder('<')
+    index = offsets[:, np.newaxis] + np.arange(dtype.itemsize)
+    return np.ascontiguousarray(buf[index]).view(dtype).ravel()
+
+
+def parse_records(data, reference_chroms, keep_columns=False):
+    """
+    Parses the alignment records at the beginning of data. A record cut off at the end of data is left unparsed.
+    reference_chroms: chromosome of each reference id, or None for references that are not of interest.
+
+    Returns (reads, consumed), where reads is a dictionary of chrom -> array of read_store.read_dtype
+    in the order of the file and consumed is the number of bytes of data that were parsed.
+    If keep_columns is True, the arrays also hold the name and score columns (read_store.bed_columns_dtype).
+    """
+    # Records have variable length, so finding where they start is sequential
+    record_offsets = []
+    offset = 0
+    data_length = len(data)
+    unpack_from = int32_struct.unpack_from
+    while offset + 4 <= data_length:
+        block_size = unpack_from(data, offset)[0]
+        if block_size < record_header_size - 4:
+            raise ValueError("Malformed BAM record")
+        if offset + 4 + block_size > data_length:
+            break
+        record_offsets.append(offset)
+        offset += 4 + block_size
+    consumed = offset
+    if not record_offsets:
+        return ({}, consumed)
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    record_offsets = np.array(record_offsets, dtype=np.int64)
+    reference_ids = gather_integers(buf, record_offsets + 4, np.int32)
+    positions = gather_integers(buf, record_offsets + 8, np.int32)
+    name_lengths = buf[record_offsets + 12].astype(np.int64)
+    mapping_qualities = buf[record_offsets + 13]
+    num_cigar_ops = gather_integers(buf, record_offsets + 16, np.uint16).astype(np.int64)
+    flags = gather_integers(buf, record_offsets + 18, np.uint16)
+
+    # Reference ids out of range (-1 for reads without a reference) point to the extra last entry
+    in_chroms = np.array([chrom is not None for chrom in reference_chroms] + [False], dtype=bool)
+    known_ids = np.where((reference_ids >= 0) & (reference_ids < len(reference_chroms)), reference_ids,
+                         len(reference_chroms))
+    selected = np.flatnonzero(((flags & flag_unmapped) == 0) & in_chroms[known_ids])
+    if len(selected) == 0:
+        return ({}, consumed)
+    record_offsets = record_offsets[selected]
+    reference_ids = reference_ids[selected]
+    positions = positions[selected]
+    name_lengths = name_lengths[selected]
+    mapping_qualities = mapping_qualities[selected]
+    num_cigar_ops = num_cigar_ops[selected]
+    flags = flags[selected]
+
+    # Length of each read on the reference, from the operations of its CIGAR string
+    name_starts = record_offsets + record_header_size
+    cigar_starts = name_starts + name_lengths
+    op_records = np.repeat(np.arange(len(selected)), num_cigar_ops)
+    op_index = np.arange(len(op_records)) - np.repeat(np.cumsum(num_cigar_ops) - num_cigar_ops, num_cigar_ops)
+    ops = gather_integers(buf, cigar_starts[op_records] + 4 * op_index, np.uint32).astype(np.int64)
+    consumes_reference = ((reference_ops_mask >> (ops & 0xf)) & 1).astype(bool)
+    reference_lengths = np.bincount(op_records, weights=np.where(consumes_reference, ops >> 4, 0),
+                                    minlength=len(selected)).astype(np.int64)
+
+    if keep_columns:
+        names = bed_reader.gather_fields(buf, name_starts, name_starts + name_lengths - 1,
+                                         max(int(name_lengths.max()) - 1, 1))
+        paired = (flags & flag_paired) != 0
+        mate_suffix = np.full(len(selected), b'', dtype='S2')
+        mate_suffix[paired & ((flags & flag_first_mate) != 0)] = b'/1'
+        mate_suffix[paired & ((flags & flag_first_mate) == 0) & ((flags & flag_second_mate) != 0)] = b'/2'
+        names = np.char.add(names, mate_suffix)
+        scores = mapping_qualities.astype('S3')
+        dtype = read_store.bed_columns_dtype(names.itemsize, scores.itemsize)
+    else:
+        dtype = read_store.read_dtype
+    all_reads = np.empty(len(selected), dtype=dtype)
+    all_reads['start'] = positions
+    all_reads['end'] = positions + reference_lengths
+    all_reads['strand'] = np.where((flags & flag_reverse) != 0, read_store.MINUS, read_store.PLUS)
+    if keep_columns:
+        all_reads['name'] = names
+        all_reads['score'] = scores
+
+    # Separate by chromosome, keeping the order of the file within each chromosome
+    order = np.argsort(reference_ids, kind='stable')
+    sorted_ids = reference_ids[order]
+    boundaries = np.flatnonzero(np.diff(sorted_ids)) + 1
+    reads = {}
+    for lo, hi in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(order)]))):
+        reads[reference_chroms[sorted_ids[lo]]] = all_reads[order[lo:hi]]
+
+    return (reads, consumed)
+
+
+def iter_reads(path_to_file, reference_chroms, keep_columns=False, start=None, end=None, threads=1):
+    """
+    Iterates over the reads of the BAM file, in batches of about bgzf.batch_size bytes of decompressed data.
+    Yields dictionaries of chrom -> reads (see parse_records).
+    Without start, the whole file is read. Otherwise start and end are the virtual offsets
+    of a range of alignments, for example from reference_ranges.
+    """
+    header_parsed = start is not None
+    data = b''
+    for piece in bgzf.read_range(path_to_file, start or 0, end, threads):
+        data += piece
+        if not header_parsed:
+            header = parse_header(data)
+            if header is None:
+                continue
+            data = data[header[1]:]
+            header_parsed = True
+        (reads, consumed) = parse_records(data, reference_chroms, keep_columns)
+        data = data[consumed:]
+        yield reads
+    if data or not header_parsed:
+        raise ValueError("Truncated BAM file")
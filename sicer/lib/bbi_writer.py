@@ -0,0 +1,336 @@
+# Author: Jin Yong Yoo
+
+"""
+Writing of indexed binary tracks without external tools: bigWig files of signal and bigBed files of regions.
+
+Both are BBI files (version 4 of the format of the UCSC genome browser). The items of each
+chromosome are written in zlib compressed blocks, found through an R-tree index of the blocks.
+Zoom levels summarize the items in bins of increasing size, so that a browser can show a whole
+chromosome without reading every item.
+
+Items are given one chromosome at a time, in the order of the chromosome IDs (see
+BBIWriter.chroms), with intervals sorted by start. Positions are 0-based and ends are exclusive.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+bigwig_magic = 0x888FFC26
+bigbed_magic = 0x8789F2EB
+chrom_tree_magic = 0x78CA8C91
+index_magic = 0x2468ACE0
+bbi_version = 4
+
+# Number of children of each node of the R-tree index
+index_block_size = 256
+
+# Zoom levels are zoom_increment times coarser than the previous one, and stop when they do not
+# halve the number of summaries
+max_zoom_levels = 10
+zoom_increment = 4
+
+header_format = '<IHHQQQHHQQIQ'
+zoom_header_format = '<IIQQ'
+total_summary_format = '<Qdddd'
+chrom_tree_header_format = '<IIIIQQ'
+index_header_format = '<IIQIIIIQII'
+node_header_format = '<BBH'
+leaf_item_format = '<IIIIQQ'
+branch_item_format = '<IIIIQ'
+section_header_format = '<IIIIIBBH'
+
+bedgraph_section_type = 1
+
+bedgraph_item_dtype = np.dtype([('start', '<u4'), ('end', '<u4'), ('value', '<f4')])
+
+summary_dtype = np.dtype([('chrom_id', '<u4'), ('start', '<u4'), ('end', '<u4'), ('valid_count', '<u4'),
+                          ('min', '<f4'), ('max', '<f4'), ('sum', '<f4'), ('sum_squares', '<f4')])
+
+
+def summarize(chrom_id, starts, ends, values, reduction):
+    """
+    Returns the summaries of the intervals of a chromosome in bins of reduction bases. Intervals crossing
+    the border of bins are split between them.
+    """
+    piece_counts = (ends - 1) // reduction - starts // reduction + 1
+    item = np.repeat(np.arange(len(starts)), piece_counts)
+    first_pieces = np.cumsum(piece_counts) - piece_counts
+    piece_bin = starts[item] // reduction + np.arange(len(item)) - first_pieces[item]
+    piece_start = np.maximum(starts[item], piece_bin * reduction)
+    piece_end = np.minimum(ends[item], (piece_bin + 1) * reduction)
+    covered = piece_end - piece_start
+    piece_values = values[item]
+    return combine_summaries(chrom_id, piece_bin, piece_start, piece_end, covered, piece_values, piece_values,
+                             piece_values * covered, piece_values * piece_values * covered)
+
+
+def combine_summaries(chrom_id, bins, starts, ends, valid_count, min_values, max_values, sums, sum_squares):
+    """Returns one summary per bin from the parts of the bins, which are sorted by start"""
+    bin_starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    summaries = np.empty(len(bin_starts), dtype=summary_dtype)
+    if len(bin_starts) > 0:
+        summaries['chrom_id'] = chrom_id
+        summaries['start'] = np.minimum.reduceat(starts, bin_starts)
+        summaries['end'] = np.maximum.reduceat(ends, bin_starts)
+        summaries['valid_count'] = np.add.reduceat(valid_count, bin_starts)
+        summaries['min'] = np.minimum.reduceat(min_values, bin_starts)
+        summaries['max'] = np.maximum.reduceat(max_values, bin_starts)
+        summaries['sum'] = np.add.reduceat(sums, bin_starts)
+        summaries['sum_squares'] = np.add.reduceat(sum_squares, bin_starts)
+    return summaries
+
+
+def coarsen(chrom_id, summaries, reduction):
+    """Returns the summaries merged in bins of reduction bases, a multiple of the bins of the summaries"""
+    return combine_summaries(chrom_id, summaries['start'] // reduction, summaries['start'],
+                             summaries['end'], summaries['valid_count'].astype(np.int64), summaries['min'],
+                             summaries['max'], summaries['sum'].astype(np.float64),
+                             summaries['sum_squares'].astype(np.float64))
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def index_bytes(entries, items_per_slot, index_offset, end_file_offset):
+    """
+    Returns the R-tree index of the blocks of a file, to be written at index_offset.
+    entries: (start chrom ID, start, end chrom ID, end, file offset, size) of each block, in file order
+    """
+    leaf_size = struct.calcsize(node_header_format) + index_block_size * struct.calcsize(leaf_item_format)
+    branch_size = struct.calcsize(node_header_format) + index_block_size * struct.calcsize(branch_item_format)
+
+    # Bounds of each node of each level, from the leaves to the root
+    levels = [[(entry[0:2], entry[2:4]) for entry in entries]]
+    while len(levels) == 1 or len(levels[-1]) > 1:
+        levels.append([(node[0][0], max(bound[1] for bound in node)) for node in chunks(levels[-1], index_block_size)]
+                      or [((0, 0), (0, 0))])
+    levels.reverse()  # levels[-1] are the entries, levels[-2] the leaves
+
+    level_offsets = [index_offset + struct.calcsize(index_header_format)]
+    for level in levels[:-2]:
+        level_offsets.append(level_offsets[-1] + len(level) * branch_size)
+
+    (start, end) = levels[0][0]
+    data = bytearray(struct.pack(index_header_format, index_magic, index_block_size, len(entries), start[0], start[1],
+                                 end[0], end[1], end_file_offset, items_per_slot, 0))
+    for level_number in range(len(levels) - 1):
+        is_leaf = level_number == len(levels) - 2
+        children = levels[level_number + 1]
+        child_size = leaf_size if level_number + 1 == len(levels) - 2 else branch_size
+        for node_number in range(len(levels[level_number])):
+            node_children = list(range(node_number * index_block_size,
+                                       min((node_number + 1) * index_block_size, len(children))))
+            data += struct.pack(node_header_format, 1 if is_leaf else 0, 0, len(node_children))
+            for child in node_children:
+                if is_leaf:
+                    data += struct.pack(leaf_item_format, *entries[child])
+                else:
+                    ((start_chrom, start_base), (end_chrom, end_base)) = children[child]
+                    data += struct.pack(branch_item_format, start_chrom, start_base, end_chrom, end_base,
+                                        level_offsets[level_number + 1] + child * child_size)
+            item_format = leaf_item_format if is_leaf else branch_item_format
+            data += bytes((index_block_size - len(node_children)) * struct.calcsize(item_format))
+    return bytes(data)
+
+
+class BBIWriter:
+    """
+    Common part of the bigWig and bigBed writers: chromosome tree, index, zoom levels and summary of the file.
+    """
+
+    def __init__(self, file_path, chrom_sizes, zoom_reduction, magic, items_per_block, field_count=0,
+                 defined_field_count=0, auto_sql=None):
+        """
+        chrom_sizes: length of each chromosome that may have items
+        zoom_reduction: size of the bins of the first zoom level, in bases
+        """
+        self.chroms = sorted(chrom_sizes)
+        self.chrom_ids = {chrom: chrom_id for (chrom_id, chrom) in enumerate(self.chroms)}
+        self.chrom_sizes = chrom_sizes
+        self.magic = magic
+        self.items_per_block = items_per_block
+        self.field_count = field_count
+        self.defined_field_count = defined_field_count
+        self.zoom_reductions = [zoom_reduction * zoom_increment ** level for level in range(max_zoom_levels)]
+        self.zoom_summaries = [[] for reduction in self.zoom_reductions]
+        self.index_entries = []
+        self.item_count = 0
+        self.last_chrom_id = -1
+        self.uncompressed_buffer_size = 0
+        self.bases_covered = 0
+        self.min_value = np.inf
+        self.max_value = -np.inf
+        self.sum_data = 0.0
+        self.sum_squares = 0.0
+
+        self.outfile = open(file_path, 'wb')
+        self.outfile.write(bytes(struct.calcsize(header_format) + max_zoom_levels * struct.calcsize(zoom_header_format)))
+        self.auto_sql_offset = 0
+        if auto_sql is not None:
+            self.auto_sql_offset = self.outfile.tell()
+            self.outfile.write(auto_sql.encode() + b'\0')
+        self.total_summary_offset = self.outfile.tell()
+        self.outfile.write(bytes(struct.calcsize(total_summary_format)))
+        self.chrom_tree_offset = self.outfile.tell()
+        self.write_chrom_tree()
+        self.data_offset = self.outfile.tell()
+        self.outfile.write(bytes(8))  # count of the data, known at the end
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.outfile.close()
+
+    def write_chrom_tree(self):
+        """Writes the B+ tree of the chromosome names, in a single leaf"""
+        key_size = max([len(chrom.encode()) for chrom in self.chroms] + [1])
+        block_size = max(len(self.chroms), 1)
+        data = bytearray(struct.pack(chrom_tree_header_format, chrom_tree_magic, block_size, key_size, 8,
+                                     len(self.chroms), 0))
+        data += struct.pack(node_header_format, 1, 0, len(self.chroms))
+        for chrom in self.chroms:
+            data += chrom.encode().ljust(key_size, b'\0')
+            data += struct.pack('<II', self.chrom_ids[chrom], self.chrom_sizes[chrom])
+        data += bytes((block_size - len(self.chroms)) * (key_size + 8))
+        self.outfile.write(data)
+
+    def write_block(self, chrom_id, start, end, block, entries):
+        """Compresses and writes a block of items, with its entry in the index"""
+        self.uncompressed_buffer_size = max(self.uncompressed_buffer_size, len(block))
+        compressed_block = zlib.compress(block)
+        entries.append((chrom_id, start, chrom_id, end, self.outfile.tell(), len(compressed_block)))
+        self.outfile.write(compressed_block)
+
+    def add_chromosome(self, chrom, starts, ends, values):
+        """
+        Clips the intervals of a chromosome to its length and adds them to the summaries.
+        Returns the chromosome ID, the mask of the intervals left after clipping and the clipped intervals.
+        """
+        chrom_id = self.chrom_ids[chrom]
+        if chrom_id <= self.last_chrom_id:
+            raise ValueError("Chromosomes must be added in the order of BBIWriter.chroms: " + chrom)
+        self.last_chrom_id = chrom_id
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.minimum(np.asarray(ends, dtype=np.int64), self.chrom_sizes[chrom])
+        values = np.asarray(values, dtype=np.float64)
+        kept = starts < ends
+        (starts, ends, values) = (starts[kept], ends[kept], values[kept])
+        if len(starts) > 0:
+            lengths = ends - starts
+            self.bases_covered += int(lengths.sum())
+            self.min_value = min(self.min_value, float(values.min()))
+            self.max_value = max(self.max_value, float(values.max()))
+            self.sum_data += float((values * lengths).sum())
+            self.sum_squares += float((values * values * lengths).sum())
+            summaries = summarize(chrom_id, starts, ends, values, self.zoom_reductions[0])
+            self.zoom_summaries[0].append(summaries)
+            for level in range(1, max_zoom_levels):
+                summaries = coarsen(chrom_id, summaries, self.zoom_reductions[level])
+                self.zoom_summaries[level].append(summaries)
+        self.item_count += len(starts)
+        return (chrom_id, kept, starts, ends, values)
+
+    def data_count(self):
+        """Count written at the start of the data: the number of blocks for bigWig and of items for bigBed"""
+        return self.item_count
+
+    def write_zoom_levels(self):
+        """Writes the data and index of the zoom levels that halve the number of items. Returns their headers"""
+        zoom_headers = []
+        previous_count = self.item_count
+        for level in range(max_zoom_levels):
+            summaries = self.zoom_summaries[level]
+            summary_count = sum(len(chrom_summaries) for chrom_summaries in summaries)
+            if summary_count == 0 or summary_count * 2 > previous_count:
+                break
+            previous_count = summary_count
+            zoom_data_offset = self.outfile.tell()
+            self.outfile.write(struct.pack('<I', summary_count))
+            entries = []
+            for chrom_summaries in summaries:
+                for block in chunks(chrom_summaries, self.items_per_block):
+                    self.write_block(int(block['chrom_id'][0]), int(block['start'][0]), int(block['end'].max()),
+                                     block.tobytes(), entries)
+            zoom_index_offset = self.outfile.tell()
+            self.outfile.write(index_bytes(entries, self.items_per_block, zoom_index_offset, zoom_index_offset))
+            zoom_headers.append((self.zoom_reductions[level], 0, zoom_data_offset, zoom_index_offset))
+        return zoom_headers
+
+    def close(self):
+        index_offset = self.outfile.tell()
+        self.outfile.write(index_bytes(self.index_entries, self.items_per_block, index_offset, index_offset))
+        zoom_headers = self.write_zoom_levels()
+
+        self.outfile.seek(0)
+        self.outfile.write(struct.pack(header_format, self.magic, bbi_version, len(zoom_headers),
+                                       self.chrom_tree_offset, self.data_offset, index_offset, self.field_count,
+                                       self.defined_field_count, self.auto_sql_offset, self.total_summary_offset,
+                                       self.uncompressed_buffer_size, 0))
+        for zoom_header in zoom_headers:
+            self.outfile.write(struct.pack(zoom_header_format, *zoom_header))
+        self.outfile.seek(self.total_summary_offset)
+        if self.bases_covered == 0:
+            (self.min_value, self.max_value) = (0.0, 0.0)
+        self.outfile.write(struct.pack(total_summary_format, self.bases_covered, self.min_value, self.max_value,
+                                       self.sum_data, self.sum_squares))
+        self.outfile.seek(self.data_offset)
+        self.outfile.write(struct.pack('<Q', self.data_count()))
+        self.outfile.close()
+
+
+class BigWigWriter(BBIWriter):
+    """Writer of bigWig files, with the values of intervals of each chromosome"""
+
+    def __init__(self, file_path, chrom_sizes, zoom_reduction):
+        super().__init__(file_path, chrom_sizes, zoom_reduction, bigwig_magic, 1024)
+        self.section_count = 0
+
+    def add_intervals(self, chrom, starts, ends, values):
+        (chrom_id, kept, starts, ends, values) = self.add_chromosome(chrom, starts, ends, values)
+        items = np.empty(len(starts), dtype=bedgraph_item_dtype)
+        items['start'] = starts
+        items['end'] = ends
+        items['value'] = values
+        for section in chunks(items, self.items_per_block):
+            section_start = int(section['start'][0])
+            section_end = int(section['end'].max())
+            header = struct.pack(section_header_format, chrom_id, section_start, section_end, 0, 0,
+                                 bedgraph_section_type, 0, len(section))
+            self.write_block(chrom_id, section_start, section_end, header + section.tobytes(), self.index_entries)
+            self.section_count += 1
+
+    def data_count(self):
+        return self.section_count
+
+
+class BigBedWriter(BBIWriter):
+    """
+    Writer of bigBed files, with the intervals of each chromosome and the text of their other fields.
+    Zoom levels summarize how many bases are covered by intervals.
+    """
+
+    def __init__(self, file_path, chrom_sizes, zoom_reduction, field_count=3, auto_sql=None):
+        super().__init__(file_path, chrom_sizes, zoom_reduction, bigbed_magic, 512, field_count, 3, auto_sql)
+
+    def add_intervals(self, chrom, starts, ends, rest=None):
+        """rest: the other fields of each interval, separated by tabs"""
+        (chrom_id, kept, starts, ends, values) = self.add_chromosome(chrom, starts, ends, np.ones(len(starts)))
+        if rest is not None:
+            rest = [text for (text, keep) in zip(rest, kept.tolist()) if keep]
+        item_starts = starts.tolist()
+        item_ends = ends.tolist()
+        for block_start in range(0, len(item_starts), self.items_per_block):
+            block = bytearray()
+            block_end = min(block_start + self.items_per_block, len(item_starts))
+            for i in range(block_start, block_end):
+                block += struct.pack('<III', chrom_id, item_starts[i], item_ends[i])
+                block += (rest[i].encode() if rest is not None else b'') + b'\0'
+            self.write_block(chrom_id, item_starts[block_start], max(item_ends[block_start:block_end]), bytes(block),
+                             self.index_entries)
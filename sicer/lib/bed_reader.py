@@ -0,0 +1,231 @@
+# Author: Jin Yong Yoo
+
+"""
+Reading BED files in a single pass.
+
+The file is divided into byte ranges ("chunks") that can be parsed
+independently by parallel processes. A chunk owns every line that starts
+inside its byte range, so that each line of the file is read exactly once
+no matter where the range boundaries fall.
+
+Lines are parsed with numpy operations on the raw bytes of a chunk and the
+reads are returned in the compact format of sicer.lib.read_store.
+
+Compressed BED files are read the same way. Chunks of a BGZF file (made by
+bgzip) are ranges of its blocks, which are decompressed by the process that
+parses them. A plain gzip file can only be decompressed from the start, so it
+is read sequentially in pieces of whole lines.
+"""
+
+import gzip
+import os
+
+import numpy as np
+
+from sicer.lib import bgzf
+from sicer.lib import read_store
+
+# Size of the byte ranges handed to each parsing process
+chunk_size = 64 * 1024 * 1024
+
+# Size of the compressed byte ranges of a BGZF file. BED text compresses about four-fold.
+bgzf_chunk_size = chunk_size // 4
+
+# Longest coordinate accepted in a BED file, in characters (int32 with sign)
+max_coord_length = 11
+
+
+def split_into_chunks(path_to_file, min_chunks=1):
+    """
+    Returns a list of (start, end) byte ranges covering the file. At least min_chunks ranges
+    are made so that every process has work, and no range is bigger than chunk_size.
+    """
+    file_size = os.path.getsize(path_to_file)
+    num_chunks = max(min_chunks, -(-file_size // chunk_size), 1)
+    bounds = [file_size * i // num_chunks for i in range(num_chunks + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(num_chunks)]
+
+
+def read_chunk(path_to_file, start, end):
+    """
+    Returns the lines that start within the byte range [start, end) as one bytes object.
+    A line that starts before 'end' but finishes after it is read in full.
+    """
+    with open(path_to_file, 'rb') as infile:
+        if start > 0:
+            infile.seek(start - 1)
+            # The line running through 'start' belongs to the previous chunk
+            if infile.read(1) != b'\n':
+                infile.readline()
+        begin = infile.tell()
+        if begin >= end:
+            return b''
+        data = infile.read(end - begin)
+        if data and not data.endswith(b'\n'):
+            data += infile.readline()
+    return data
+
+
+def is_gzip(path_to_file):
+    """Returns True if the file is gzip compressed (including BGZF)"""
+    with open(path_to_file, 'rb') as infile:
+        return infile.read(2) == b'\x1f\x8b'
+
+
+def split_into_bgzf_chunks(path_to_file, min_chunks=1):
+    """
+    Returns a list of (start, end) byte ranges covering a BGZF file, like split_into_chunks.
+    Range boundaries fall on block boundaries.
+    """
+    (offsets, file_size) = bgzf.block_offsets(path_to_file)
+    num_chunks = min(max(min_chunks, -(-file_size // bgzf_chunk_size)), len(offsets))
+    bounds = [offsets[len(offsets) * i // num_chunks] for i in range(num_chunks)] + [file_size]
+    return [(bounds[i], bounds[i + 1]) for i in range(num_chunks)]
+
+
+def read_bgzf_chunk(path_to_file, start, end):
+    """
+    Returns the decompressed lines of a range of blocks of a BGZF file.
+    A range owns the lines that start after its first decompressed byte, up to and including its last
+    decompressed byte plus one. This way a range does not need the data of the range before it
+    to know where its first line starts.
+    """
+    with open(path_to_file, 'rb') as infile:
+        data = bgzf.inflate_blocks([block for (offset, block) in bgzf.iter_blocks(infile, start, end)])
+        if start > 0:
+            first_newline = data.find(b'\n')
+            if first_newline < 0:
+                return b''
+            data = data[first_newline + 1:]
+        # Finish the line running through the end of the range
+        for (offset, block) in bgzf.iter_blocks(infile, end):
+            block_data = bgzf.inflate(block)
+            newline = block_data.find(b'\n')
+            if newline >= 0:
+                data += block_data[:newline + 1]
+                break
+            data += block_data
+    return data
+
+
+def iter_gzip_pieces(path_to_file):
+    """Decompresses a gzip file from the start and iterates over pieces of about chunk_size bytes of whole lines."""
+    with gzip.open(path_to_file, 'rb') as infile:
+        while True:
+            data = infile.read(chunk_size)
+            if not data:
+                return
+            if not data.endswith(b'\n'):
+                data += infile.readline()
+            yield data
+
+
+def gather_fields(buf, starts, ends, width):
+    """
+    Returns the byte strings buf[starts[i]:ends[i]] as an array of dtype 'S<width>'.
+    Fields longer than width are truncated.
+    """
+    index = starts[:, np.newaxis] + np.arange(width)
+    inside = index < ends[:, np.newaxis]
+    chars = np.where(inside, buf[np.minimum(index, len(buf) - 1)], 0).astype(np.uint8)
+    return np.ascontiguousarray(chars).view('S' + str(width)).ravel()
+
+
+def parse_integers(buf, starts, ends):
+    """
+    Parses the decimal integers buf[starts[i]:ends[i]].
+    Returns (values, valid) where valid is False for fields that are not integers.
+    """
+    width = max_coord_length
+    negative = buf[np.minimum(starts, len(buf) - 1)] == ord('-')
+    digit_starts = starts + negative
+    lengths = ends - digit_starts
+    valid = (lengths > 0) & (lengths <= width)
+    # Right-align the digits of each field
+    index = ends[:, np.newaxis] - width + np.arange(width)
+    inside = index >= digit_starts[:, np.newaxis]
+    digits = buf[np.clip(index, 0, len(buf) - 1)].astype(np.int64) - ord('0')
+    valid &= np.all(~inside | ((digits >= 0) & (digits <= 9)), axis=1)
+    digits[~inside] = 0
+    values = digits.dot(10 ** np.arange(width - 1, -1, -1, dtype=np.int64))
+    values[negative] *= -1
+    valid &= (values >= np.iinfo(np.int32).min) & (values <= np.iinfo(np.int32).max)
+    return (values, valid)
+
+
+def parse_lines(data, chroms, keep_columns=False):
+    """
+    Parses the BED lines in data and separates the reads by chromosome.
+    Lines of chromosomes not in chroms (including track and comment lines) are skipped.
+
+    Returns (reads, malformed), where reads is a dictionary of chrom -> array of read_store.read_dtype
+    in the order the reads appear in data, and malformed is True if a line of one of
+    the chromosomes does not have the six fields SICER requires.
+    If keep_columns is True, the arrays also hold the name and score columns (read_store.bed_columns_dtype).
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if len(buf) == 0:
+        return ({}, False)
+
+    line_ends = np.flatnonzero(buf == ord('\n'))
+    if buf[-1] != ord('\n'):
+        line_ends = np.append(line_ends, len(buf))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    # Windows line endings
+    carriage_return = (line_ends > line_starts) & (buf[np.maximum(line_ends - 1, 0)] == ord('\r'))
+    line_ends = line_ends - carriage_return
+
+    # Position of the tabs ending each of the first five fields (or the end of the line)
+    tabs = np.flatnonzero(buf == ord('\t'))
+    first_tab = np.searchsorted(tabs, line_starts)
+    field_ends = []
+    for i in range(5):
+        tab_index = first_tab + i
+        tab = tabs[np.minimum(tab_index, len(tabs) - 1)] if len(tabs) > 0 else line_ends
+        field_ends.append(np.where((tab_index < len(tabs)) & (tab < line_ends), tab, line_ends))
+
+    # Identify the chromosome of every line. One extra character makes longer names distinct.
+    chrom_names = np.array(sorted(chroms), dtype='S')
+    chrom_field = gather_fields(buf, line_starts, field_ends[0], chrom_names.itemsize + 1)
+    chrom_index = np.minimum(np.searchsorted(chrom_names, chrom_field), len(chrom_names) - 1)
+    selected = np.flatnonzero(chrom_names[chrom_index] == chrom_field)
+    if len(selected) == 0:
+        return ({}, False)
+    chrom_index = chrom_index[selected]
+    line_starts = line_starts[selected]
+    line_ends = line_ends[selected]
+    field_ends = [field_end[selected] for field_end in field_ends]
+
+    # Six fields need five tabs
+    if np.any(field_ends[4] >= line_ends):
+        return ({}, True)
+
+    (starts, valid_starts) = parse_integers(buf, field_ends[0] + 1, field_ends[1])
+    (ends, valid_ends) = parse_integers(buf, field_ends[1] + 1, field_ends[2])
+    if not (np.all(valid_starts) and np.all(valid_ends)):
+        return ({}, True)
+    strand_field = gather_fields(buf, field_ends[4] + 1, line_ends, 1)
+
+    if keep_columns:
+        name_starts, name_ends = field_ends[2] + 1, field_ends[3]
+        score_starts, score_ends = field_ends[3] + 1, field_ends[4]
+        dtype = read_store.bed_columns_dtype(np.max(name_ends - name_starts), np.max(score_ends - score_starts))
+    else:
+        dtype = read_store.read_dtype
+    all_reads = np.empty(len(selected), dtype=dtype)
+    all_reads['start'] = starts
+    all_reads['end'] = ends
+    all_reads['strand'] = read_store.strand_codes(strand_field)
+    if keep_columns:
+        all_reads['name'] = gather_fields(buf, name_starts, name_ends, dtype['name'].itemsize)
+        all_reads['score'] = gather_fields(buf, score_starts, score_ends, dtype['score'].itemsize)
+
+    # Separate by chromosome, keeping the order of the file within each chromosome
+    order = np.argsort(chrom_index, kind='stable')
+    boundaries = np.searchsorted(chrom_index[order], np.arange(len(chrom_names) + 1))
+    reads = {}
+    for i, chrom in enumerate(chrom_names):
+        if boundaries[i + 1] > boundaries[i]:
+            reads[chrom.decode()] = all_reads[order[boundaries[i]:boundaries[i + 1]]]
+
+    return (reads, False)
@@ -0,0 +1,133 @@
+# Author: Jin Yong Yoo
+
+"""
+Reading BGZF files, the blocked gzip format used by BAM files and bgzip.
+
+A BGZF file is a series of gzip members ("blocks") of at most 64 KB of data each.
+Every block can be decompressed on its own, so a file can be read from any
+block and blocks can be decompressed in parallel. Positions in a BGZF file
+are given as virtual offsets: (offset of the block in the file << 16) | offset within the block.
+"""
+
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the fixed part of a block header, up to and including XLEN
+header_size = 12
+header_struct = struct.Struct('<4BI2BH')
+
+# Amount of decompressed data handled at a time by read_range
+batch_size = 64 * 1024 * 1024
+
+
+def is_bgzf(path_to_file):
+    """Returns True if the file starts with a BGZF block"""
+    with open(path_to_file, 'rb') as infile:
+        header = infile.read(header_size)
+        if len(header) < header_size:
+            return False
+        (id1, id2, cm, flg, mtime, xfl, os_code, xlen) = header_struct.unpack(header)
+        if id1 != 0x1f or id2 != 0x8b or cm != 8 or not (flg & 4):
+            return False
+        return find_block_size(infile.read(xlen)) is not None
+
+
+def find_block_size(extra):
+    """Returns BSIZE (total block size - 1) from the extra field of a gzip header, or None if it is not BGZF"""
+    i = 0
+    while i + 4 <= len(extra):
+        (si1, si2, slen) = struct.unpack_from('<2BH', extra, i)
+        if si1 == 66 and si2 == 67 and slen == 2:
+            return struct.unpack_from('<H', extra, i + 4)[0]
+        i += 4 + slen
+    return None
+
+
+def iter_blocks(infile, start=0, end=None):
+    """
+    Iterates over the blocks of an open BGZF file that start within the byte range [start, end).
+    Yields (block offset, compressed data). The compressed data is raw deflate data.
+    """
+    infile.seek(start)
+    offset = start
+    while end is None or offset < end:
+        header = infile.read(header_size)
+        if len(header) < header_size:
+            return
+        xlen = header_struct.unpack(header)[7]
+        extra = infile.read(xlen)
+        block_size = find_block_size(extra)
+        if block_size is None:
+            raise ValueError("Not a BGZF block at offset " + str(offset))
+        rest = infile.read(block_size + 1 - header_size - xlen)
+        yield (offset, rest[:-8])  # CRC32 and ISIZE follow the compressed data
+        offset += block_size + 1
+
+
+def block_offsets(path_to_file):
+    """Returns the offsets of every block in the file, and the size of the file. Only block headers are read."""
+    offsets = []
+    with open(path_to_file, 'rb') as infile:
+        offset = 0
+        while True:
+            infile.seek(offset)
+            header = infile.read(header_size)
+            if len(header) < header_size:
+                break
+            xlen = header_struct.unpack(header)[7]
+            block_size = find_block_size(infile.read(xlen))
+            if block_size is None:
+                raise ValueError("Not a BGZF block at offset " + str(offset))
+            offsets.append(offset)
+            offset += block_size + 1
+    return (offsets, offset)
+
+
+def inflate(compressed_data):
+    try:
+        return zlib.decompress(compressed_data, -15)
+    except zlib.error as error:
+        raise ValueError("Corrupted BGZF block: " + str(error))
+
+
+def inflate_blocks(blocks, threads=1):
+    """
+    Decompresses a list of blocks and returns the concatenated data.
+    zlib releases the GIL, so threads decompress blocks in parallel.
+    """
+    if threads > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return b''.join(executor.map(inflate, blocks))
+    return b''.join(inflate(block) for block in blocks)
+
+
+def read_range(path_to_file, start, end=None, threads=1):
+    """
+    Iterates over the decompressed data between the virtual offsets start and end (or the end of the file),
+    in pieces of about batch_size bytes.
+    """
+    start_block, start_within = start >> 16, start & 0xffff
+    if end is not None:
+        end_block, end_within = end >> 16, end & 0xffff
+    skip = start_within
+    with open(path_to_file, 'rb') as infile:
+        batch = []
+        for (offset, compressed_data) in iter_blocks(infile, start_block):
+            if end is not None and (offset > end_block or (offset == end_block and end_within == 0)):
+                break
+            if end is not None and offset == end_block:
+                # Only the beginning of the last block is in the range
+                if batch:
+                    yield inflate_blocks(batch, threads)[skip:]
+                    skip = 0
+                yield inflate(compressed_data)[skip:end_within]
+                return
+            batch.append(compressed_data)
+            # Blocks hold at most 64 KB of data
+            if len(batch) * 65536 >= batch_size:
+                yield inflate_blocks(batch, threads)[skip:]
+                skip = 0
+                batch = []
+        if batch:
+            yield inflate_blocks(batch, threads)[skip:]
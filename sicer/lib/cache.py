@@ -0,0 +1,96 @@
+# Author: Jin Yong Yoo
+
+"""
+Persistent cache of results that only depend on a few parameters of a run.
+
+Each entry is a small JSON file in the cache directory ($SICER_CACHE_DIR, or the user cache
+directory $XDG_CACHE_HOME/sicer or ~/.cache/sicer), named after a hash of the parameters it was
+computed from.
+When the entries take more than max_size bytes, the least recently used ones are removed.
+
+The cache is only a shortcut: when it cannot be read or written (for example
+a read-only home directory), results are computed as if it were empty.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+# Total size of the entries kept in the cache directory, in bytes
+max_size = 4 * 1024 * 1024
+
+# Changed whenever the way cached results are computed changes, so that older entries are not used
+cache_version = 1
+
+
+def cache_directory():
+    if os.environ.get('SICER_CACHE_DIR'):
+        return os.environ['SICER_CACHE_DIR']
+    base_directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_directory, 'sicer')
+
+
+def entry_path(kind, parameters):
+    key = json.dumps([kind, cache_version, parameters], sort_keys=True)
+    return os.path.join(cache_directory(), kind + '-' + hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+
+def get(kind, parameters):
+    """
+    Returns the value stored for the kind of result and its parameters (a dictionary), or None if there is none.
+    """
+    path = entry_path(kind, parameters)
+    try:
+        with open(path) as infile:
+            entry = json.load(infile)
+        os.utime(path)  # marks the entry as recently used
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get('parameters') != parameters:
+        return None
+    return entry.get('value')
+
+
+def put(kind, parameters, value):
+    """Stores a value (anything JSON can represent) for the kind of result and its parameters"""
+    directory = cache_directory()
+    temp_path = None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Written aside and renamed, so that runs sharing the cache never read a partial entry
+        (handle, temp_path) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as outfile:
+            json.dump({'parameters': parameters, 'value': value}, outfile)
+        os.replace(temp_path, entry_path(kind, parameters))
+        temp_path = None
+        evict(directory)
+    except (OSError, TypeError, ValueError):  # values JSON cannot represent are not stored either
+        pass
+    finally:
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+def evict(directory):
+    """Removes the least recently used entries until the entries fit in max_size"""
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            try:
+                status = entry.stat()
+            except FileNotFoundError:  # removed by another run
+                continue
+            entries.append((status.st_mtime, status.st_size, entry.path))
+    total_size = sum(size for (mtime, size, path) in entries)
+    for (mtime, size, path) in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
@@ -0,0 +1,41 @@
+# Author: Jin Yong Yoo
+
+"""
+Multiple testing correction of the p-values of the islands of the whole genome,
+using the Benjamini-Hochberg procedure.
+
+The islands of each chromosome are tested by a separate process, so the
+p-values come as one array per chromosome. The correction is computed over
+all of them at once and handed back as one array per chromosome.
+"""
+
+import numpy as np
+import scipy.stats
+
+
+def benjamini_hochberg(pvalues):
+    """
+    Returns the array of the adjusted p-values: pvalue * number of p-values / rank of the p-value, capped at 1,
+    and the boolean array of the adjusted p-values that were capped.
+    Tied p-values get the average of their ranks.
+    """
+    ranks = scipy.stats.rankdata(pvalues)
+    adjusted_pvalues = pvalues * len(pvalues) / ranks
+    capped = adjusted_pvalues > 1
+    adjusted_pvalues[capped] = 1
+    return (adjusted_pvalues, capped)
+
+
+def genome_wide(pvalue_arrays):
+    """
+    pvalue_arrays: the arrays of p-values of each chromosome
+    Returns the arrays of adjusted p-values of each chromosome, corrected for the p-values of all chromosomes, and
+    the arrays of the adjusted p-values of each chromosome that were capped at 1.
+    """
+    offsets = np.cumsum([0] + [len(pvalues) for pvalues in pvalue_arrays])
+    all_pvalues = np.empty(offsets[-1], dtype=np.float64)
+    for i in range(len(pvalue_arrays)):
+        all_pvalues[offsets[i]:offsets[i + 1]] = pvalue_arrays[i]
+    (adjusted_pvalues, capped) = benjamini_hochberg(all_pvalues)
+    return ([adjusted_pvalues[offsets[i]:offsets[i + 1]] for i in range(len(pvalue_arrays))],
+            [capped[offsets[i]:offsets[i + 1]] for i in range(len(pvalue_arrays))])
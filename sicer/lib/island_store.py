@@ -0,0 +1,58 @@
+# Author: Jin Yong Yoo
+
+"""
+Typed representation of the windows and islands of one chromosome.
+
+Every stage of the pipeline saves its windows or islands as a structured
+numpy array with a fixed dtype per kind of file. Like the reads of
+sicer.lib.read_store, the chromosome is implied by the file the array is saved
+in. The files need no pickling and can be memory-mapped with load, so that a
+process reads only the columns it uses.
+
+Every dtype starts with the start and end fields, which is all that stages
+looking up islands need (see regions).
+"""
+
+import numpy as np
+
+# Windows of the summary graph (_graph.npy before islands are found, _filtered_graph.npy)
+window_dtype = np.dtype([('start', np.int32), ('end', np.int32), ('count', np.int32)])
+
+# Islands found by SICER, with their score
+island_dtype = np.dtype([('start', np.int32), ('end', np.int32), ('score', np.float64)])
+
+# Islands found by RECOGNICER and union islands of two libraries
+region_dtype = np.dtype([('start', np.int32), ('end', np.int32)])
+
+# Islands tested against the control library (_island_summary.npy)
+summary_dtype = np.dtype([('start', np.int32), ('end', np.int32), ('chip_count', np.int32),
+                          ('control_count', np.int32), ('pvalue', np.float64), ('fold_change', np.float64),
+                          ('alpha', np.float64)])
+
+# FDRs of the union islands that were capped at 1 (_union_island_fdr_capped.npy), next to _union_island_summary.npy
+fdr_capped_dtype = np.dtype([('fdr_A_vs_B', np.bool_), ('fdr_B_vs_A', np.bool_)])
+
+
+def df_summary_dtype(pvalue_A_vs_B_dtype, pvalue_B_vs_A_dtype):
+    """
+    dtype of the union islands compared between two libraries (_union_island_summary.npy), with the columns
+    of the summary file. The p-value columns keep the dtype of the p-values computed for the chromosome.
+    """
+    return np.dtype([('start', np.int32), ('end', np.int32), ('readcount_A', np.int64),
+                     ('normalized_readcount_A', np.float64), ('readcount_B', np.int64),
+                     ('normalized_readcount_B', np.float64), ('fc_A_vs_B', np.float64),
+                     ('pvalue_A_vs_B', pvalue_A_vs_B_dtype), ('fdr_A_vs_B', np.float64),
+                     ('fc_B_vs_A', np.float64), ('pvalue_B_vs_A', pvalue_B_vs_A_dtype), ('fdr_B_vs_A', np.float64)])
+
+
+def load(file_name, writable=False):
+    """Memory-maps a file of windows or islands. Changes to a writable array are saved to the file."""
+    return np.load(file_name, mmap_mode='r+' if writable else 'r')
+
+
+def regions(islands):
+    """Returns the start and end of the islands of any of the dtypes above"""
+    np_regions = np.empty(len(islands), dtype=region_dtype)
+    np_regions['start'] = islands['start']
+    np_regions['end'] = islands['end']
+    return np_regions
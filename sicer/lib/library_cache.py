@@ -0,0 +1,149 @@
+# Author: Jin Yong Yoo
+
+"""
+Persistent cache of libraries after redundancy removal (--library_cache), for the control libraries
+that many runs use again.
+
+An entry holds the reads of each chromosome as saved by remove_redundant_reads, and the read counts
+printed for them. It is found by the fingerprint of the input file (its size, modification time and a
+hash of its first and last blocks), the species, the redundancy threshold and whether the name and
+score columns of the reads are kept. A file that is renamed or moved keeps its entry, and a file that
+is changed gets a new one.
+
+Each entry is a directory of the cache directory, made aside and renamed so that runs sharing the
+cache never see a partial entry. The reads of an entry are linked into the temporary directory of a
+run, which only reads them. When the entries take more than the size of the cache, the least recently
+used ones are removed.
+
+As with sicer.lib.cache, the cache is only a shortcut: when it cannot be read or written, the library
+is preprocessed as if it were not cached.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Size of the blocks at the beginning and at the end of the file that are hashed into its fingerprint
+fingerprint_block_size = 1 << 20
+
+# Changed whenever the files of the entries change, so that older entries are not used
+cache_version = 1
+
+manifest_name = 'manifest.json'
+
+
+def fingerprint(path_to_file):
+    status = os.stat(path_to_file)
+    digest = hashlib.sha1()
+    with open(path_to_file, 'rb') as infile:
+        digest.update(infile.read(fingerprint_block_size))
+        if status.st_size > fingerprint_block_size:
+            infile.seek(max(status.st_size - fingerprint_block_size, fingerprint_block_size))
+            digest.update(infile.read())
+    return {'size': status.st_size, 'mtime': status.st_mtime_ns, 'hash': digest.hexdigest()}
+
+
+def library_parameters(path_to_file, species, redundancy_threshold, keep_bed_columns):
+    """Returns the parameters that the reads of a library after redundancy removal depend on"""
+    return {'file': fingerprint(path_to_file), 'species': species, 'redundancy_threshold': redundancy_threshold,
+            'keep_bed_columns': keep_bed_columns, 'version': cache_version}
+
+
+def entry_path(directory, parameters):
+    key = json.dumps(parameters, sort_keys=True)
+    return os.path.join(directory, hashlib.sha1(key.encode()).hexdigest())
+
+
+def read_file_suffixes(keep_bed_columns):
+    """Suffixes of the files of the reads of a chromosome (see remove_redundant_reads.filter_reads)"""
+    if keep_bed_columns:
+        return ['.npy', '_columns.npy']
+    return ['.npy']
+
+
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:  # e.g. on another file system
+        shutil.copyfile(source, destination)
+
+
+def lookup(directory, parameters, file_name, chroms):
+    """
+    Links the reads of each chromosome of the cached library into <file_name>_<chrom>.npy (and
+    <file_name>_<chrom>_columns.npy when the columns are kept).
+    Returns the (message, number of retained reads) of each chromosome, or None if the library is not cached.
+    """
+    entry = entry_path(directory, parameters)
+    linked_files = []
+    try:
+        with open(os.path.join(entry, manifest_name)) as infile:
+            manifest = json.load(infile)
+        if manifest.get('parameters') != parameters:
+            return None
+        filtered_result = [tuple(manifest['chroms'][chrom]) for chrom in chroms]
+        for chrom in chroms:
+            for suffix in read_file_suffixes(parameters['keep_bed_columns']):
+                link_or_copy(os.path.join(entry, chrom + suffix), file_name + '_' + chrom + suffix)
+                linked_files.append(file_name + '_' + chrom + suffix)
+        os.utime(os.path.join(entry, manifest_name))  # marks the entry as recently used
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        # The reads are filtered again and must not be saved over the files of the entry
+        for linked_file in linked_files:
+            os.remove(linked_file)
+        return None
+    return filtered_result
+
+
+def store(directory, max_size, parameters, file_name, chroms, filtered_result):
+    """
+    Stores the reads of each chromosome saved as <file_name>_<chrom>.npy after redundancy removal, and the
+    (message, number of retained reads) of each chromosome. The entries are then evicted down to max_size bytes.
+    """
+    try:
+        os.makedirs(directory, exist_ok=True)
+        temp_entry = tempfile.mkdtemp(dir=directory, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        # Copied rather than linked, so that the entry does not depend on what the run does with its files
+        for chrom in chroms:
+            for suffix in read_file_suffixes(parameters['keep_bed_columns']):
+                shutil.copyfile(file_name + '_' + chrom + suffix, os.path.join(temp_entry, chrom + suffix))
+        manifest = {'parameters': parameters,
+                    'chroms': {chrom: list(result) for (chrom, result) in zip(chroms, filtered_result)}}
+        with open(os.path.join(temp_entry, manifest_name), 'w') as outfile:
+            json.dump(manifest, outfile)
+        os.rename(temp_entry, entry_path(directory, parameters))
+    except OSError:  # e.g. stored by another run in the meantime, or no space left
+        shutil.rmtree(temp_entry, ignore_errors=True)
+        return
+    evict(directory, max_size)
+
+
+def entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+
+def evict(directory, max_size):
+    """Removes the least recently used entries until the entries fit in max_size bytes"""
+    entries = []
+    try:
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.tmp') or not entry.is_dir():
+                continue
+            try:
+                entries.append((os.path.getmtime(os.path.join(entry.path, manifest_name)), entry_size(entry.path),
+                                entry.path))
+            except FileNotFoundError:  # removed by another run
+                continue
+    except OSError:
+        return
+    total_size = sum(size for (mtime, size, path) in entries)
+    for (mtime, size, path) in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_size -= size
@@ -0,0 +1,73 @@
+# Author: Jin Yong Yoo
+
+"""
+Writing of the tab-separated output files (BED, summaries, scoreisland and WIG) from typed column arrays.
+
+The rows of a chromosome are formatted a block at a time, column by column, and each block
+is written to the file at once. The text of every field is the same as str() of the field
+of the array, so the files are the same as when they were written line by line.
+"""
+
+import numpy as np
+
+# Number of rows formatted and written at a time
+block_size = 1 << 16
+
+# Buffer size of the output files, in bytes
+buffer_size = 1 << 20
+
+
+def open_output(file_path):
+    return open(file_path, 'w', buffering=buffer_size)
+
+
+def format_column(values):
+    """Returns the texts of an array of numbers, as str() of each value"""
+    return list(map(str, values.tolist()))
+
+
+def format_integers(values):
+    """Returns the texts of a masked array of floats (see integer_column), the masked values as integers"""
+    texts = format_column(values.data)
+    for index in np.flatnonzero(np.ma.getmaskarray(values)).tolist():
+        texts[index] = str(int(values.data[index]))
+    return texts
+
+
+def integer_column(values, is_integer):
+    """
+    Returns the column of floats (see write_columns) that writes the values where is_integer as integers
+    (e.g. 1 instead of 1.0), for the values that were set to an integer, such as a cap, before they were written.
+    Values that are only equal to an integer are written as floats.
+    """
+    return (np.ma.masked_array(values, mask=is_integer), format_integers)
+
+
+def rounded_format(digits):
+    """Returns a format of a column of floats that writes each value rounded by Python's round()"""
+
+    def format_rounded(values):
+        return [str(round(value, digits)) for value in values.tolist()]
+
+    return format_rounded
+
+
+def format_text(values):
+    """Returns the texts of an array of strings or bytes"""
+    if values.dtype.kind == 'S':
+        return [value.decode() for value in values.tolist()]
+    return values.tolist()
+
+
+def write_columns(outfile, columns, prefix='', suffix='\n'):
+    """
+    Writes one line per row of the columns: prefix, the fields of the row separated by tabs, then suffix.
+    columns: arrays of equal length, or (array, format) pairs where format returns the texts of a block of the
+    array, such as the formats above. Arrays without a format are written with format_column.
+    """
+    columns = [column if isinstance(column, tuple) else (column, format_column) for column in columns]
+    row_count = len(columns[0][0]) if columns else 0
+    for block_start in range(0, row_count, block_size):
+        block_end = block_start + block_size
+        texts = [format_values(values[block_start:block_end]) for (values, format_values) in columns]
+        outfile.write(''.join([prefix + '\t'.join(row) + suffix for row in zip(*texts)]))
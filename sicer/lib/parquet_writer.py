@@ -0,0 +1,48 @@
+# Author: Jin Yong Yoo
+
+"""
+Export of the island summary tables in Parquet format, for analyses that read many runs.
+
+The columns keep the numeric types of the typed arrays of sicer.lib.island_store, with the
+chromosome as a dictionary encoded column. Each chromosome is written as its own row group,
+so that readers filtering on the chromosome or on value ranges skip the other row groups.
+
+pyarrow is an optional dependency, installed with "pip install SICER2[parquet]".
+"""
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+arrow_types = {np.dtype(np.int32): 'int32', np.dtype(np.int64): 'int64', np.dtype(np.float64): 'float64'}
+
+
+def available():
+    return pyarrow is not None
+
+
+def write_summaries(file_path, chroms, summaries, dtype):
+    """
+    chroms: the chromosomes of the genome, in the order of their row groups
+    summaries: the typed array of the islands of each chromosome
+    dtype: the dtype of the columns in the file. The columns of the arrays are converted to it, e.g. the
+    p-values of chromosomes that were all the integer 1.
+    """
+    chrom_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    schema = pyarrow.schema([pyarrow.field('chrom', chrom_type)] +
+                            [pyarrow.field(name, getattr(pyarrow, arrow_types[dtype[name]])())
+                             for name in dtype.names])
+    chrom_names = pyarrow.array(chroms, type=pyarrow.string())
+    with pyarrow.parquet.ParquetWriter(file_path, schema) as writer:
+        for (chrom_index, summary) in enumerate(summaries):
+            if len(summary) == 0:
+                continue
+            chrom_column = pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array(np.full(len(summary), chrom_index, dtype=np.int32)), chrom_names)
+            columns = [chrom_column] + [pyarrow.array(np.ascontiguousarray(summary[name], dtype=dtype[name]))
+                                        for name in dtype.names]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
@@ -0,0 +1,103 @@
+# Author: Jin Yong Yoo
+
+"""
+Compact representation of the reads of one chromosome.
+
+Every read is stored as its start and end coordinates and a strand code. The
+chromosome is implied by the file (or array) the read belongs to, and the name
+and score columns of the BED file are not needed to call islands.
+When a BED file of reads has to be written (--significant_reads), the original
+columns are kept aside in a separate array and recovered with recover_bed_columns.
+"""
+
+import numpy as np
+
+# Strand codes. Sorting by code puts the plus strand before the minus strand, like sorting by symbol.
+PLUS = 0
+MINUS = 1
+OTHER = 2  # any strand symbol other than '+' and '-'
+strand_symbols = np.array(['+', '-', '.'])
+
+read_dtype = np.dtype([('start', np.int32), ('end', np.int32), ('strand', np.int8)])
+
+
+def strand_codes(symbols):
+    """Converts an array of strand symbols (bytes) into strand codes."""
+    codes = np.full(len(symbols), OTHER, dtype=np.int8)
+    codes[symbols == b'+'] = PLUS
+    codes[symbols == b'-'] = MINUS
+    return codes
+
+
+def bed_columns_dtype(name_length, score_length):
+    """dtype of the reads stored along with the name and score columns of the BED file"""
+    return np.dtype(read_dtype.descr + [('name', 'S' + str(max(name_length, 1))),
+                                        ('score', 'S' + str(max(score_length, 1)))])
+
+
+def has_bed_columns(reads):
+    return reads.dtype.names is not None and 'name' in reads.dtype.names
+
+
+def concatenate(arrays):
+    """Concatenates arrays of reads. Name and score columns of different widths are widened to fit."""
+    if has_bed_columns(arrays[0]):
+        dtype = bed_columns_dtype(max(reads.dtype['name'].itemsize for reads in arrays),
+                                  max(reads.dtype['score'].itemsize for reads in arrays))
+        arrays = [reads.astype(dtype) for reads in arrays]
+    return np.concatenate(arrays)
+
+
+def compact(reads):
+    """Drops every field of the reads other than start, end and strand"""
+    compact_reads = np.empty(len(reads), dtype=read_dtype)
+    for field in read_dtype.names:
+        compact_reads[field] = reads[field]
+    return compact_reads
+
+
+def sort_keys(reads):
+    """
+    Returns one int64 value per read that orders the reads by (start, end).
+    Both coordinates are int32, so the key is exact.
+    """
+    return (reads['start'].astype(np.int64) << 32) + (reads['end'].astype(np.int64) - np.iinfo(np.int32).min)
+
+
+def from_sort_keys(keys, strand):
+    """Inverse of sort_keys: returns the reads of the given strand code with the given keys"""
+    reads = np.empty(len(keys), dtype=read_dtype)
+    reads['start'] = keys >> 32
+    reads['end'] = (keys & 0xffffffff) + np.iinfo(np.int32).min
+    reads['strand'] = strand
+    return reads
+
+
+def recover_bed_columns(reads, bed_columns):
+    """
+    reads: reads sorted by (strand, start, end), such as the output of redundancy removal or a subset of it
+    that keeps either all or none of the copies of each read.
+    bed_columns: every read of the chromosome, in the order of the input file, with the name and score columns.
+
+    Returns the rows of bed_columns that correspond to the given reads. When the same read appears
+    several times, its copies are matched to the rows sorted by name and then score, as the reads were
+    sorted on all their columns before redundancy removal. Rows that also share name and score are
+    matched in the order of the input file.
+    """
+    recovered = np.empty(len(reads), dtype=bed_columns.dtype)
+    order = np.lexsort((bed_columns['score'], bed_columns['name'], bed_columns['end'], bed_columns['start'],
+                        bed_columns['strand']))
+    sorted_columns = bed_columns[order]
+    for strand in (PLUS, MINUS, OTHER):
+        lo, hi = np.searchsorted(reads['strand'], [strand, strand + 1])
+        column_lo, column_hi = np.searchsorted(sorted_columns['strand'], [strand, strand + 1])
+        if hi == lo:
+            continue
+        keys = sort_keys(reads[lo:hi])
+        column_keys = sort_keys(sorted_columns[column_lo:column_hi])
+        # The copies of a read are adjacent. A copy's rank is its distance from the first copy.
+        first_copy = np.searchsorted(keys, keys, side='left')
+        rank = np.arange(hi - lo) - first_copy
+        index = np.searchsorted(column_keys, keys, side='left') + rank
+        recovered[lo:hi] = sorted_columns[column_lo + index]
+    return recovered
@@ -0,0 +1,78 @@
+# Author: Jin Yong Yoo
+
+"""
+Distribution of the tasks of each chromosome to the processes of the pool.
+
+pool.map hands out the chromosomes in chunks, in the order of the genome, so that the process
+that gets chr1 is still working long after the others are done with the small chromosomes.
+Here the tasks are handed out one at a time, starting with the ones expected to take the
+longest, and the results come back in the order of the chromosomes.
+
+The chromosomes much larger than the others are split into parts (ranges of reads, or segments
+of the chromosome starting at a window) so that every process gets some of the work of chr1.
+The results of the parts are combined so that they are the same as those of the whole chromosome.
+"""
+
+import os
+from functools import partial
+
+# Number of parts per process that the work of the genome is split into, so that the processes end together
+parts_per_process = 4
+
+# Smallest parts worth a task of their own
+min_reads_per_part = 1000000
+min_segment_length = 10000000
+
+
+def call_with_index(function, indexed_item):
+    (index, item) = indexed_item
+    return (index, function(item))
+
+
+def map_by_cost(pool, function, items, costs):
+    """
+    Returns [function(item) for item in items], computed by the processes of the pool in decreasing order of
+    the expected costs of the items.
+    """
+    order = sorted(range(len(items)), key=lambda index: costs[index], reverse=True)
+    results = [None] * len(items)
+    indexed_items = [(index, items[index]) for index in order]
+    for (index, result) in pool.imap_unordered(partial(call_with_index, function), indexed_items):
+        results[index] = result
+    return results
+
+
+def apply_arguments(function, arguments):
+    return function(*arguments)
+
+
+def starmap_by_cost(pool, function, argument_tuples, costs):
+    """Same as map_by_cost, for a function taking several arguments (like pool.starmap)"""
+    return map_by_cost(pool, partial(apply_arguments, function), argument_tuples, costs)
+
+
+def file_costs(*file_lists):
+    """
+    Expected cost of the task of each chromosome, from the size of the files it reads (e.g. its reads saved
+    by remove_redundant_reads). Each list has one file per chromosome. Missing files cost nothing.
+    """
+    costs = [0] * len(file_lists[0])
+    for file_list in file_lists:
+        for (index, file_name) in enumerate(file_list):
+            if os.path.exists(file_name):
+                costs[index] += os.path.getsize(file_name)
+    return costs
+
+
+def part_size(total_size, cpu, min_size, alignment=1):
+    """
+    Size of the parts that the work of the genome, of total_size (e.g. reads or base pairs), is split into
+    for cpu processes. The size is at least min_size, and a multiple of alignment (e.g. the window size).
+    """
+    size = max(min_size, -(-total_size // (parts_per_process * cpu)))
+    return -(-size // alignment) * alignment
+
+
+def split_range(length, size):
+    """Returns the (start, end) of the consecutive parts of range(length) of the given size, at least one part"""
+    return [(start, min(start + size, length)) for start in range(0, length, size)] or [(0, 0)]
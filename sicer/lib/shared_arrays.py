@@ -0,0 +1,134 @@
+# Author: Jin Yong Yoo
+
+"""
+Handoff of large typed arrays (reads, windows, islands) between the processes of the pool through
+shared memory, instead of pickling them or saving them in the temporary directory.
+
+A process shares an array with share(), which copies it into a new block of shared memory and returns
+a small handle. The block belongs to the process that receives the handle, not to the one that made it:
+
+    worker:  return shared_arrays.share(chrom_graph)
+    parent:  with shared_arrays.SharedArrays() as received:
+                 chrom_graph = received.receive(handle)
+                 ...
+             # the blocks are freed here, and the arrays must no longer be used
+
+The owner (SharedArrays) frees its blocks in release(). An owner can also lend a handle to other
+processes, which use the array inside a borrowed() block without freeing it.
+Blocks that are never released (e.g. when the parent stops with an error) are removed by the
+resource tracker of multiprocessing when the program ends. The tracker has to be started by
+start_tracker() before the pool is made, so that the pool's processes share it with the parent.
+
+Arrays smaller than min_shared_size, and arrays that do not fit in the free space of /dev/shm,
+are handed over as the array itself, which is pickled as usual. Every function accepts both.
+"""
+
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Arrays smaller than this (in bytes) are cheaper to pickle
+min_shared_size = 1 << 20
+
+# Directory of the shared memory blocks on Linux, whose free space is checked before making a block.
+# Writing beyond the free space of /dev/shm crashes the process instead of raising an error.
+shared_memory_directory = '/dev/shm'
+
+SharedArray = namedtuple('SharedArray', ['name', 'dtype', 'shape'])
+
+
+def start_tracker():
+    """
+    Starts the resource tracker in the parent. Otherwise every process of the pool starts its own, which
+    removes the blocks made by that process when it ends, even though the parent owns them.
+    """
+    resource_tracker.ensure_running()
+
+
+def has_room(size):
+    if not os.path.isdir(shared_memory_directory):
+        return True
+    stats = os.statvfs(shared_memory_directory)
+    return size < stats.f_bavail * stats.f_frsize // 2
+
+
+def array_of(block, handle):
+    return np.ndarray(handle.shape, dtype=handle.dtype, buffer=block.buf)
+
+
+def close(block):
+    try:
+        block.close()
+    except BufferError:
+        # Arrays still use the block, which is unmapped once they are gone
+        pass
+
+
+def share(array):
+    """
+    Copies the array into a new block of shared memory and returns its handle (SharedArray), or returns the
+    array itself when it is small or does not fit. The process receiving the handle owns the block.
+    """
+    if array.nbytes < min_shared_size or not has_room(array.nbytes):
+        return array
+    block = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    handle = SharedArray(block.name, array.dtype, array.shape)
+    array_of(block, handle)[...] = array
+    close(block)
+    return handle
+
+
+@contextmanager
+def borrowed(handle):
+    """Yields the array of a handle owned by another process, to be used inside the with block only"""
+    if not isinstance(handle, SharedArray):
+        yield handle
+        return
+    block = shared_memory.SharedMemory(name=handle.name)
+    try:
+        yield array_of(block, handle)
+    finally:
+        close(block)
+
+
+class SharedArrays:
+    """Owner of the blocks of shared memory of the handles it adopts or receives"""
+
+    def __init__(self):
+        self.handles = []
+        self.blocks = []
+
+    def adopt(self, handle):
+        """Takes the ownership of the block of the handle, without using its array. Returns the handle."""
+        if isinstance(handle, SharedArray):
+            self.handles.append(handle)
+        return handle
+
+    def receive(self, handle):
+        """Takes the ownership of the block of the handle and returns its array, valid until release()"""
+        if not isinstance(handle, SharedArray):
+            return handle
+        block = shared_memory.SharedMemory(name=handle.name)
+        self.blocks.append(block)
+        return array_of(block, handle)
+
+    def release(self):
+        """Frees the blocks owned"""
+        for handle in self.handles:
+            block = shared_memory.SharedMemory(name=handle.name)
+            self.blocks.append(block)
+        for block in self.blocks:
+            block.unlink()
+            close(block)
+        self.handles = []
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -10,7 +10,8 @@ import multiprocessing as mp
 curr_path = os.getcwd()
 
 # From SICER Package
-from sicer.lib import GenomeData
+from sicer.lib import Utility
+from sicer.lib import shared_arrays
 from sicer.src import remove_redundant_reads
 from sicer.src import run_make_graph_file_by_chrom
 from sicer.src import coarsegraining
@@ -36,21 +37,24 @@ def main(args, df_run=False):  # df_run indicates if run_RECOGNICER is being cal
             "Temporary directory required for SICER cannot be created. Check if directories can be created in %s." % curr_path)
     try:
         # Step 0: create Pool object for parallel-Processing
-        num_chroms = len(GenomeData.species_chroms[args.species])
-        pool = mp.Pool(processes=min(args.cpu, num_chroms))
+        # The processes of the pool hand large arrays to this process through shared memory
+        shared_arrays.start_tracker()
+        # Large chromosomes are split into parts, so there are tasks for more processes than chromosomes
+        pool = mp.Pool(processes=args.cpu)
 
         # Step 1: Remove redundancy reads in input file according to input threshold
-        treatment_file_name = os.path.basename(args.treatment_file)
-        print("Preprocess the", treatment_file_name, "file to remove redundancy with threshold of",
+        treatment_file_name = Utility.bed_file_name(os.path.basename(args.treatment_file))
+        print("Preprocess the", os.path.basename(args.treatment_file), "file to remove redundancy with threshold of",
               args.redundancy_threshold, "\n")
-        total_treatment_read_count = remove_redundant_reads.main(args, args.treatment_file, pool)
+        total_treatment_read_count = remove_redundant_reads.main(args, args.treatment_file, pool,
+                                                                   args.significant_reads)
         args.treatment_file = treatment_file_name
         print('\n')
 
         # Step 2: Remove redundancy reads in control library according to input threshold
         if (control_lib_exists):
-            control_file_name = os.path.basename(args.control_file)
-            print("Preprocess the", control_file_name, "file to remove redundancy with threshold of",
+            control_file_name = Utility.bed_file_name(os.path.basename(args.control_file))
+            print("Preprocess the", os.path.basename(args.control_file), "file to remove redundancy with threshold of",
                   args.redundancy_threshold, "\n")
             total_control_read_count = remove_redundant_reads.main(args, args.control_file, pool)
             args.control_file = control_file_name
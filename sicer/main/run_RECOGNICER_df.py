@@ -12,7 +12,8 @@ import multiprocessing as mp
 curr_path = os.getcwd()
 
 # From SICER Package
-from sicer.lib import GenomeData
+from sicer.lib import Utility
+from sicer.lib import shared_arrays
 from sicer.main import run_RECOGNICER
 from sicer.src import find_union_islands
 from sicer.src import compare_two_libraries_on_islands
@@ -53,13 +54,15 @@ def main(args):
             "Temporary directory required for SICER cannot be created. Check if directories can be created in %s."
             % curr_path)
     try:
-        num_chroms = len(GenomeData.species_chroms[args.species])
-        pool = mp.Pool(processes=min(args.cpu, num_chroms))
+        # The processes of the pool hand large arrays to this process through shared memory
+        shared_arrays.start_tracker()
+        # Large chromosomes are split into parts, so there are tasks for more processes than chromosomes
+        pool = mp.Pool(processes=args.cpu)
 
         # Find the union island between two treatment files. It will generate a summary file
         print("\n")
-        args.treatment_file[0] = os.path.basename(args.treatment_file[0])
-        args.treatment_file[1] = os.path.basename(args.treatment_file[1])
+        args.treatment_file[0] = Utility.bed_file_name(os.path.basename(args.treatment_file[0]))
+        args.treatment_file[1] = Utility.bed_file_name(os.path.basename(args.treatment_file[1]))
         print("Finding all the union islands of ", args.treatment_file[0], "and ", args.treatment_file[1], "...")
         find_union_islands.main(args, temp_dir_1, temp_dir_2, pool)
         print("\n")
@@ -11,7 +11,8 @@ import multiprocessing as mp
 curr_path = os.getcwd()
 
 # From SICER Package
-from sicer.lib import GenomeData
+from sicer.lib import Utility
+from sicer.lib import shared_arrays
 from sicer.src import remove_redundant_reads
 from sicer.src import run_make_graph_file_by_chrom
 from sicer.src import find_islands_in_pr
@@ -19,6 +20,7 @@ from sicer.src import associate_tags_with_chip_and_control_w_fc_q
 from sicer.src import filter_islands_by_significance
 from sicer.src import make_normalized_wig
 from sicer.src import filter_raw_tags_by_islands
+from sicer.src import fused_pipeline
 
 ''' args: ArgumentParser object formed form command line parameters
     df_run: If df_run is true, then this instance of SICER is called by SICER-DF module.
@@ -39,50 +41,74 @@ def main(args, df_run=False):
     except:
         sys.exit(
             "Temporary directory required for SICER cannot be created. Check if directories can be created in %s." % curr_path)
+    # Blocks of shared memory owned by this process across the steps (see sicer.lib.shared_arrays)
+    shared_blocks = shared_arrays.SharedArrays()
     try:
         # Step 0: create Pool object for parallel-Processing
-        num_chroms = len(GenomeData.species_chroms[args.species])
-        pool = mp.Pool(processes=min(args.cpu, num_chroms))
-
-        # Step 1: Remove redundancy reads in input file according to input threshold
-        # Output is the total number of reads retained. Represents size of library.
-        treatment_file_name = os.path.basename(args.treatment_file)
-        print("Preprocess the", treatment_file_name, "file to remove redundancy with threshold of",
-              args.redundancy_threshold, "\n")
-        total_treatment_read_count = remove_redundant_reads.main(args, args.treatment_file, pool)
-        args.treatment_file = treatment_file_name
-        print('\n')
-
-        # Step 2: Remove redundancy reads in control library according to input threshold
+        # The processes of the pool hand large arrays to this process through shared memory
+        shared_arrays.start_tracker()
+        # Large chromosomes are split into parts, so there are tasks for more processes than chromosomes
+        pool = mp.Pool(processes=args.cpu)
+
+        treatment_file_name = Utility.bed_file_name(os.path.basename(args.treatment_file))
         if (control_lib_exists):
-            control_file_name = os.path.basename(args.control_file)
-            print("Preprocess the", control_file_name, "file to remove redundancy with threshold of",
+            control_file_name = Utility.bed_file_name(os.path.basename(args.control_file))
+
+        if (args.fused):
+            # Steps 1-3 in a single pass over the chromosomes. The treatment reads are only kept for the
+            # steps that read them again.
+            (total_treatment_read_count, total_control_read_count, total_tag_in_windows,
+             tag_windows) = fused_pipeline.count_windows(args, pool, args.significant_reads or df_run, shared_blocks)
+            args.treatment_file = treatment_file_name
+            if (control_lib_exists):
+                args.control_file = control_file_name
+        else:
+            # Step 1: Remove redundancy reads in input file according to input threshold
+            # Output is the total number of reads retained. Represents size of library.
+            print("Preprocess the", os.path.basename(args.treatment_file), "file to remove redundancy with threshold of",
                   args.redundancy_threshold, "\n")
-            total_control_read_count = remove_redundant_reads.main(args, args.control_file, pool)
-            args.control_file = control_file_name
+            total_treatment_read_count = remove_redundant_reads.main(args, args.treatment_file, pool,
+                                                                       args.significant_reads)
+            args.treatment_file = treatment_file_name
             print('\n')
 
-        # Step 3: Partition the genome in windows and generate graph files for each chromsome
-        print("Partition the genome in windows and generate summary files... \n")
-        total_tag_in_windows = run_make_graph_file_by_chrom.main(args, pool)
-        print("\n")
+            # Step 2: Remove redundancy reads in control library according to input threshold
+            if (control_lib_exists):
+                print("Preprocess the", os.path.basename(args.control_file), "file to remove redundancy with threshold of",
+                      args.redundancy_threshold, "\n")
+                total_control_read_count = remove_redundant_reads.main(args, args.control_file, pool)
+                args.control_file = control_file_name
+                print('\n')
+
+            # Step 3: Partition the genome in windows and generate graph files for each chromsome
+            print("Partition the genome in windows and generate summary files... \n")
+            total_tag_in_windows = run_make_graph_file_by_chrom.main(args, pool)
+            print("\n")
 
         # Step4+5: Normalize and generate WIG file
         print("Normalizing graphs by total island filitered reads per million and generating summary WIG file...\n")
         output_WIG_name = (treatment_file_name.replace('.bed', '') + "-W" + str(args.window_size) + "-normalized.wig")
         make_normalized_wig.main(args, output_WIG_name, pool)
 
-        # Step 6: Find candidate islands exhibiting clustering
-        print("Finding candidate islands exhibiting clustering...\n")
-        find_islands_in_pr.main(args, total_tag_in_windows, pool)
-        print("\n")
+        if (args.fused):
+            # Steps 6 and 7 in a single pass over the chromosomes
+            print("Finding candidate islands exhibiting clustering...\n")
+            fused_pipeline.find_islands(args, total_tag_in_windows, total_treatment_read_count,
+                                        total_control_read_count, tag_windows, pool)
+            shared_blocks.release()
+        else:
+            # Step 6: Find candidate islands exhibiting clustering
+            print("Finding candidate islands exhibiting clustering...\n")
+            find_islands_in_pr.main(args, total_tag_in_windows, pool)
+            print("\n")
+
+            # Step 7
+            if (control_lib_exists):
+                print("Calculating significance of candidate islands using the control library... \n")
+                associate_tags_with_chip_and_control_w_fc_q.main(args, total_treatment_read_count, total_control_read_count, pool)
 
         # Running SICER with a control library
         if (control_lib_exists):
-            # Step 7
-            print("Calculating significance of candidate islands using the control library... \n")
-            associate_tags_with_chip_and_control_w_fc_q.main(args, total_treatment_read_count, total_control_read_count, pool)
-
             # Step 8: Filter out any significant islands whose pvalue is greater than the false discovery rate
             print("Identify significant islands using FDR criterion\n")
             significant_read_count = filter_islands_by_significance.main(args, 7, pool)  # 7 represents the ith column we want to filtered by
@@ -112,6 +138,7 @@ def main(args, df_run=False):
         else:
             print("End of SICER")
     finally:
+        shared_blocks.release()
         if df_run==False:
             print("Removing temporary directory and all files in it.")
             shutil.rmtree(temp_dir)
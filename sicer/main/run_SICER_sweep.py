@@ -0,0 +1,72 @@
+# Developed by Zang Lab at University of Virginia - 2018
+
+#Author: Jin Yong Yoo
+
+import os
+import shutil
+import sys
+import tempfile
+import multiprocessing as mp
+
+curr_path = os.getcwd()
+
+# From SICER Package
+from sicer.lib import Utility
+from sicer.lib import shared_arrays
+from sicer.src import remove_redundant_reads
+from sicer.src import parameter_sweep
+
+''' args: ArgumentParser object formed form command line parameters of sicer_sweep, with lists of window sizes,
+    gap sizes, E-values and false discovery rates.'''
+
+
+def main(args):
+    # Checks if there is a control library
+    control_lib_exists = True
+    if (args.control_file is None):
+        control_lib_exists = False
+
+    # Creates temporary directory to contain all intermediate files.
+    try:
+        temp_dir = tempfile.mkdtemp()
+        # Change current working directory to temp_dir
+        os.chdir(temp_dir)
+    except:
+        sys.exit(
+            "Temporary directory required for SICER cannot be created. Check if directories can be created in %s." % curr_path)
+    try:
+        # Step 0: create Pool object for parallel-Processing
+        # The processes of the pool hand large arrays to this process through shared memory
+        shared_arrays.start_tracker()
+        # Large chromosomes are split into parts, so there are tasks for more processes than chromosomes
+        pool = mp.Pool(processes=args.cpu)
+
+        treatment_file_name = Utility.bed_file_name(os.path.basename(args.treatment_file))
+        if (control_lib_exists):
+            control_file_name = Utility.bed_file_name(os.path.basename(args.control_file))
+
+        # Step 1: Remove redundancy reads in input file according to input threshold, once for all the points
+        print("Preprocess the", os.path.basename(args.treatment_file), "file to remove redundancy with threshold of",
+              args.redundancy_threshold, "\n")
+        total_treatment_read_count = remove_redundant_reads.main(args, args.treatment_file, pool)
+        args.treatment_file = treatment_file_name
+        print('\n')
+
+        # Step 2: Remove redundancy reads in control library according to input threshold
+        total_control_read_count = None
+        if (control_lib_exists):
+            print("Preprocess the", os.path.basename(args.control_file), "file to remove redundancy with threshold of",
+                  args.redundancy_threshold, "\n")
+            total_control_read_count = remove_redundant_reads.main(args, args.control_file, pool)
+            args.control_file = control_file_name
+            print('\n')
+
+        # Steps 3-8 for every point of the grid. The reads are binned once for all the window sizes.
+        parameter_sweep.sweep(args, total_treatment_read_count, total_control_read_count, pool)
+
+        pool.close()
+        pool.join()
+        print("End of SICER sweep")
+    finally:
+        print("Removing temporary directory and all files in it.")
+        shutil.rmtree(temp_dir)
@@ -13,99 +13,108 @@ import scipy.stats
 
 from sicer.lib import GenomeData;
 from sicer.lib import associate_tags_with_regions
+from sicer.lib import false_discovery_rate
+from sicer.lib import island_store
+from sicer.lib import output_writer
+from sicer.lib import parquet_writer
+from sicer.lib import scheduler
+
+
+def island_statistics(chip_readcounts, control_readcounts, island_lengths, scaling_factor, control_library_size,
+                      genomesize):
+    """
+    Computes the statistics of the islands of a chromosome from the arrays of their read counts and lengths.
+    The expected read count of an island is its control read count scaled to the ChIP library. Islands without
+    control reads expect the reads of a quarter window at most, from the density of the control library.
+
+    Returns the arrays of p-values and fold changes of the islands. Islands without enrichment have a p-value of 1.
+    """
+    background = np.minimum(0.25, island_lengths * control_library_size * 1.0 / genomesize) * scaling_factor
+    average = np.where(control_readcounts > 0, control_readcounts * scaling_factor, background)
+    fc = chip_readcounts / average
+    pvalue = np.ones(len(chip_readcounts), dtype=np.float64)
+    enriched = chip_readcounts > average
+    if enriched.any():
+        pvalue[enriched] = scipy.stats.poisson.sf(chip_readcounts[enriched], average[enriched])
+    return (pvalue, fc)
+
+
+def island_summary(island_list, chip_readcounts, control_readcounts, scaling_factor, control_library_size,
+                   genomesize):
+    '''Returns the summary of the islands (sicer.lib.island_store.summary_dtype), without their FDR'''
+    summary_list = np.zeros(len(island_list), dtype=island_store.summary_dtype)
+    summary_list['start'] = island_list['start']
+    summary_list['end'] = island_list['end']
+    summary_list['chip_count'] = chip_readcounts
+    summary_list['control_count'] = control_readcounts
+
+    island_lengths = island_list['end'].astype(np.int64) - island_list['start'] + 1
+    (summary_list['pvalue'], summary_list['fold_change']) = island_statistics(
+        summary_list['chip_count'].astype(np.int64), summary_list['control_count'].astype(np.int64), island_lengths,
+        scaling_factor, control_library_size, genomesize)
+    return summary_list
+
+
+def associate_tag_count_to_regions(args, scaling_factor, control_library_size, genomesize, chrom, chip_readcounts,
+                                   control_readcounts):
+    island_file = args.treatment_file.replace('.bed', '') + '_' + chrom + '_graph.npy'
 
+    island_list = island_store.load(island_file)
+    summary_list = island_summary(island_list, chip_readcounts, control_readcounts, scaling_factor,
+                                  control_library_size, genomesize)
 
-def associate_tag_count_to_regions(args, scaling_factor, control_library_size, genomesize, chrom):
-    island_file = args.treatment_file.replace('.bed', '') + '_' + chrom + '_graph.npy'
-    treatment_file = args.treatment_file.replace('.bed', '') + '_' + chrom + '.npy'
-    control_file = args.control_file.replace('.bed', '') + '_' + chrom + '.npy'
-
-    island_list = np.load(island_file, allow_pickle=True)
-    island_start_list = [island[1] for island in island_list]
-    island_end_list = [island[2] for island in island_list]
-    
-    pvalue_array = np.empty(len(island_list), dtype=np.float64)
-
-    total_chip_count = 0
-    island_chip_readcount_list = [0] * len(island_list)
-    treatment_reads = np.load(treatment_file, allow_pickle=True)
-    for read in treatment_reads:
-        position = associate_tags_with_regions.tag_position(read, args.fragment_size)
-        index = associate_tags_with_regions.find_readcount_on_islands(island_start_list, island_end_list, position)
-        if index >= 0:  # if the read is found in a valid island
-            island_chip_readcount_list[index] += 1
-            total_chip_count += 1
-
-    total_control_count = 0
-    island_control_readcount_list = [0] * len(island_list)
-    control_reads = np.load(control_file, allow_pickle=True)
-    for read in control_reads:
-        position = associate_tags_with_regions.tag_position(read, args.fragment_size)
-        index = associate_tags_with_regions.find_readcount_on_islands(island_start_list, island_end_list, position)
-        if index >= 0:
-            island_control_readcount_list[index] += 1
-            total_control_count += 1
-
-    summary_list = []
-    #pvalue_list = []
-    for index in range(0, len(island_list)):
-        island = island_list[index]
-        observation_count = island_chip_readcount_list[index]
-        control_count = island_control_readcount_list[index]
-        average = 0
-        if (control_count > 0):
-            average = control_count * scaling_factor
-        else:
-            length = island[2] - island[1] + 1
-            average = length * control_library_size * 1.0 / genomesize
-            average = min(0.25, average) * scaling_factor;
-        fc = float(observation_count) / float(average)
-        if (observation_count > average):
-            pvalue = scipy.stats.poisson.sf(observation_count, average)
-        else:
-            pvalue = 1
-
-        pvalue_array[index] = pvalue
-        output_line = (island[0], island[1], island[2], observation_count, control_count, pvalue, fc, 0.0)
-        summary_list.append(output_line)
-
-    np_output_lines = np.array(summary_list, dtype=object)
     file_name = args.treatment_file.replace('.bed', '') + '_' + chrom + '_' + 'island_summary.npy'
-    np.save(file_name, np_output_lines)
-    pvalue_save_name = chrom + '_pvalue.npy'
-    np.save(pvalue_save_name, pvalue_array)
-    return pvalue_save_name
+    np.save(file_name, summary_list)
+    return file_name
 
 
-def main(args, chip_library_size, control_library_size, pool):
-    chroms = GenomeData.species_chroms[args.species];
+def library_scaling(args, chip_library_size, control_library_size):
+    '''Returns the factor scaling the control library to the ChIP library and the effective genome size'''
     genomesize = sum(GenomeData.species_chrom_lengths[args.species].values());
     genomesize = args.effective_genome_fraction * genomesize;
 
     print("ChIP library read count:", chip_library_size)
     print("Control library read count:", control_library_size)
 
-    totalchip = 0;
-    totalcontrol = 0;
     scaling_factor = chip_library_size * 1.0 / control_library_size
+    return (scaling_factor, genomesize)
+
 
-    # Use multiprocessing to associate each read with an island
+def main(args, chip_library_size, control_library_size, pool):
+    chroms = GenomeData.species_chroms[args.species];
+    (scaling_factor, genomesize) = library_scaling(args, chip_library_size, control_library_size)
+
+    # Use multiprocessing to associate each read with an island. The reads of the large chromosomes are split
+    # into ranges handled by separate processes.
     #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
+    island_files = [args.treatment_file.replace('.bed', '') + '_' + chrom + '_graph.npy' for chrom in chroms]
+    treatment_files = [args.treatment_file.replace('.bed', '') + '_' + chrom + '.npy' for chrom in chroms]
+    control_files = [args.control_file.replace('.bed', '') + '_' + chrom + '.npy' for chrom in chroms]
+    file_pairs = list(zip(island_files, treatment_files)) + list(zip(island_files, control_files))
+    island_readcounts = associate_tags_with_regions.readcounts_of_islands(pool, args.cpu, args.fragment_size,
+                                                                          file_pairs)
     associate_tag_count_to_regions_partial = partial(associate_tag_count_to_regions, args, scaling_factor,
                                                      control_library_size, genomesize)
-    p_value_files = pool.map(associate_tag_count_to_regions_partial, chroms)
+    list_of_args = [(chrom, island_readcounts[i], island_readcounts[len(chroms) + i])
+                    for (i, chrom) in enumerate(chroms)]
+    island_files = scheduler.starmap_by_cost(pool, associate_tag_count_to_regions_partial, list_of_args,
+                                             [len(chip_readcounts) for (chrom, chip_readcounts, _) in list_of_args])
     #pool.close()
 
-    # Get the list of p-value from each parallel processes and concatenate them into one list of all p-values
-    p_value_list = np.array([])
-    for p_value_file in p_value_files:
-        chrom_p_value_list = np.load(p_value_file, allow_pickle=True)
-        p_value_list = np.concatenate([p_value_list, chrom_p_value_list])
-        os.remove(p_value_file)
-    p_value_rank_array = scipy.stats.rankdata(p_value_list)
-    total_num_of_pvalue = len(p_value_list)
+    write_island_summaries(args, chroms, island_files)
+
 
-    index = 0
+def write_island_summaries(args, chroms, island_files):
+    '''Corrects the p-values of the island summaries saved for each chromosome and writes the islands summary file'''
+    # Correct the p-values of the islands of all chromosomes at once and store them in the summary of each chromosome
+    islands = [island_store.load(island_file, writable=True) for island_file in island_files]
+    (alpha_arrays, alpha_capped) = false_discovery_rate.genome_wide([island['pvalue'] for island in islands])
+    for (island, alpha_stat) in zip(islands, alpha_arrays):
+        island['alpha'] = alpha_stat
+        island.flush()
+
+    totalchip = 0;
+    totalcontrol = 0;
     file_name = args.treatment_file.replace('.bed', '')
     output_file_name = file_name + '-W' + str(args.window_size)
     if (args.subcommand == "SICER"):
@@ -113,28 +122,21 @@ def main(args, chip_library_size, control_library_size, pool):
     elif (args.subcommand == "RECOGNICER"):
         output_file_name += '-islands-summary'
     outfile_path = os.path.join(args.output_directory, output_file_name)
-    with open(outfile_path, 'w') as outfile:
-        for chrom in chroms:
-            island_file_name = file_name + '_' + chrom + '_' + 'island_summary.npy'
-            island = np.load(island_file_name, allow_pickle=True)
-            #modified_island = []
-            for i in range(len(island)):
-                line = island[i]
-                totalchip += int(line[3])
-                totalcontrol += int(line[4])
-                alpha_stat = p_value_list[index] * total_num_of_pvalue / p_value_rank_array[index];
-                if alpha_stat > 1:
-                    alpha_stat = 1;
-                    
-                island[i][7] = alpha_stat
-                outputline = (line[0] + '\t' + str(line[1]) + '\t' + str(line[2]) + '\t' + str(line[3]) + '\t' + str(
-                    line[4]) + '\t' +
-                              str(line[5]) + '\t' + str(line[6]) + '\t' + str(alpha_stat)+ '\n')
-                outfile.write(outputline)
-                #modified_island.append(tuple(line))
-                index += 1
-
-            np.save(island_file_name, island)
+    with output_writer.open_output(outfile_path) as outfile:
+        for (chrom, island, capped) in zip(chroms, islands, alpha_capped):
+            totalchip += int(island['chip_count'].sum())
+            totalcontrol += int(island['control_count'].sum())
+            # Islands without enrichment are not tested and have a p-value of 1, while the p-values of the tested
+            # islands are below 1. The FDR is capped at 1.
+            output_writer.write_columns(outfile, [island['start'], island['end'], island['chip_count'],
+                                                  island['control_count'],
+                                                  output_writer.integer_column(island['pvalue'], island['pvalue'] == 1),
+                                                  island['fold_change'],
+                                                  output_writer.integer_column(island['alpha'], capped)],
+                                        prefix=chrom + '\t')
+
+    if (args.parquet):
+        parquet_writer.write_summaries(outfile_path + '.parquet', chroms, islands, island_store.summary_dtype)
 
     print("Total number of chip reads on islands is:", totalchip)
     print("Total number of control reads on islands is:", totalcontrol)
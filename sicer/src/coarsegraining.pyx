@@ -10,6 +10,8 @@ import numpy as np
 
 # From SICER package
 from sicer.lib import GenomeData
+from sicer.lib import island_store
+from sicer.lib import scheduler
 
 
 '''version 8: 3-phase coarse graining, take the phase that has most 1 to next step. '''
@@ -249,18 +251,12 @@ def traceback(List, win_min, step, level, genome_length, chrom):
 
 def filter_and_find_islands(args, min_tag_count, chrom):
 	graph_file = args.treatment_file.replace('.bed', '') + '_' + chrom + '_graph.npy'
-	chrom_windows = np.load(graph_file, allow_pickle=True)
+	chrom_windows = island_store.load(graph_file)
 	print_return = ''
 	total_count_island = 0
 	if (len(chrom_windows) > 0):
 		chrom_lengths = GenomeData.species_chrom_lengths[args.species][chrom]
-		eligible_start_list = []
-
-		for i in range(0, len(chrom_windows)):
-			window = chrom_windows[i]
-			read_count = window[3]
-			if read_count >= min_tag_count:
-				eligible_start_list.append(window[1])
+		eligible_start_list = chrom_windows['start'][chrom_windows['count'] >= min_tag_count].tolist()
 		island_list = coarsegraining(eligible_start_list, args.window_size, args.step_size, args.step_score,
 									 chrom_lengths)
 		islands = traceback(island_list, args.window_size, args.step_size, 0, chrom_lengths, chrom)
@@ -269,9 +265,9 @@ def filter_and_find_islands(args, min_tag_count, chrom):
 			print_return += chrom + " does not have any islands meeting the required significance"
 		for i in range(len(islands)):
 			island = islands[i]
-			islands[i] = (island[0], int(island[1]), int(island[2]))
+			islands[i] = (int(island[1]), int(island[2]))
 
-		np_islands = np.array(islands, dtype=object)
+		np_islands = np.array(islands, dtype=island_store.region_dtype)
 		np.save(graph_file, np_islands)
 		total_count_island = len(islands)
 
@@ -303,7 +299,9 @@ def main(args, read_count, pool):
 	# Use multiprocessing to find islands separately by chromosome
 	# pool = mp.Pool(processes=min(args.cpu, len(chroms)))
 	filter_and_find_islands_partial = partial(filter_and_find_islands, args, min_tags_in_window)
-	filtered_islands_result = pool.map(filter_and_find_islands_partial, chroms)
+	graph_files = [args.treatment_file.replace('.bed', '') + '_' + chrom + '_graph.npy' for chrom in chroms]
+	filtered_islands_result = scheduler.map_by_cost(pool, filter_and_find_islands_partial, chroms,
+													scheduler.file_costs(graph_files))
 	# pool.close()
 
 	file_name = args.treatment_file.replace('.bed', '')
@@ -312,12 +310,12 @@ def main(args, read_count, pool):
 	path_to_filtered_graph = []
 	with open(outfile_path, 'w') as outfile:
 		for i in range(0, len(filtered_islands_result)):
-			filtered_chrom_graph = np.load(file_name + '_' + chroms[i] + '_graph.npy', allow_pickle=True)
+			filtered_chrom_graph = island_store.load(file_name + '_' + chroms[i] + '_graph.npy')
 			total_number_islands += filtered_islands_result[i][0]
 			if (filtered_islands_result[i][1] != ""):
 				print(filtered_islands_result[i][1])
 			for island in filtered_chrom_graph:
-				line = (island[0] + '\t' + str(int(island[1])) + '\t' + str(int(island[2]))
+				line = (chroms[i] + '\t' + str(int(island['start'])) + '\t' + str(int(island['end']))
 						+ '\t' + '1\n')
 				outfile.write(line)
 
@@ -10,41 +10,64 @@ from math import *
 import numpy as np
 
 from sicer.lib import GenomeData
+from sicer.lib import bbi_writer
+from sicer.lib import island_store
+from sicer.lib import output_writer
+from sicer.lib import scheduler
 
 
-def filter_by_fdr_SICER(args, chrom):
-    file_name = args.treatment_file.replace('.bed', '') + '_' + chrom + '_island_summary.npy'
+def filter_by_fdr_SICER(args, island_files):
+    (file_name, filtered_file_name) = island_files
     cutoff = args.false_discovery_rate
-    summary_graph = np.load(file_name, allow_pickle=True)
-    summary_bed = []
-
-    for line in summary_graph:
-        if (line[7] <= cutoff):
-            bed_line = (line[0], line[1], line[2], line[3])
-            summary_bed.append(bed_line)
-
-    np_summary_bed = np.array(summary_bed, dtype=object)
-    np.save(file_name, np_summary_bed)
+    summary_graph = island_store.load(file_name)
+    summary_bed = summary_graph[summary_graph['alpha'] <= cutoff]
+    np.save(filtered_file_name, summary_bed)
 
 
 def filter_by_fdr_SICER_df(args, columnindex, chrom):
     file_name = chrom + '_union_island_summary.npy'
     cutoff = args.false_discovery_rate_df
-    summary_graph = np.load(file_name, allow_pickle=True)
-    summary_bed = []
-
-    for line in summary_graph:
-        if (line[columnindex] <= cutoff):
-            bed_line = (
-            line[0], line[1], line[2], line[3], line[4], line[5], line[6], line[7], line[8], line[9], line[10],
-            line[11], line[12])
-            summary_bed.append(bed_line)
+    summary_graph = island_store.load(file_name)
+    # columnindex is the column of the FDR in the summary file, which also has the chromosome
+    significant = summary_graph[summary_graph.dtype.names[columnindex - 1]] <= cutoff
     save_file_name = chrom + '_union_island_summary_filtered' + str(columnindex) + '.npy'
-    np_summary_bed = np.array(summary_bed, dtype=object)
-    np.save(save_file_name, np_summary_bed)
-
-
-def main(args, columnindex, pool):
+    np.save(save_file_name, summary_graph[significant])
+    # The FDRs capped at 1 of the significant islands (see compare_two_libraries_on_islands.main)
+    fdr_capped = island_store.load(chrom + '_union_island_fdr_capped.npy')
+    np.save(chrom + '_union_island_fdr_capped_filtered' + str(columnindex) + '.npy', fdr_capped[significant])
+
+
+# Fields of the islands in bigBed format
+island_auto_sql = '''table sicerIsland
+"Significant islands found by SICER"
+    (
+    string chrom;      "Reference sequence chromosome or scaffold"
+    uint   chromStart; "Start position in chromosome"
+    uint   chromEnd;   "End position in chromosome"
+    uint   readCount;  "Number of treatment reads in the island"
+    )
+'''
+
+
+def write_bigbed(args, outfile_path, chroms, filtered_files):
+    '''Writes the significant islands in bigBed format, next to the BED file'''
+    chrom_sizes = {chrom: GenomeData.species_chrom_lengths[args.species][chrom] for chrom in chroms}
+    island_files = dict(zip(chroms, filtered_files))
+    # The first zoom level summarizes ten windows
+    with bbi_writer.BigBedWriter(outfile_path.replace('.bed', '.bb'), chrom_sizes, 10 * args.window_size, 4,
+                                 island_auto_sql) as writer:
+        for chrom in writer.chroms:
+            island_list = island_store.load(island_files[chrom])
+            if (len(island_list) > 0):
+                writer.add_intervals(chrom, island_list['start'], island_list['end'],
+                                     output_writer.format_column(island_list['chip_count']))
+
+
+'''island_files: for SICER and RECOGNICER, the (summary file, filtered file) of the islands of each chromosome.
+    By default the summary files are replaced by the filtered islands.'''
+
+
+def main(args, columnindex, pool, island_files=None):
     chroms = GenomeData.species_chroms[args.species];
     total_island_count = 0
     total_read_count = 0
@@ -52,13 +75,20 @@ def main(args, columnindex, pool):
     df_call = args.df # Determines if this function was called by SICER or SICER-DF
 
     #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
-    filtered_output = []
     if (df_call):
         filter_by_fdr_partial = partial(filter_by_fdr_SICER_df, args, columnindex)
-        filtered_output = pool.map(filter_by_fdr_partial, chroms)
+        summary_files = [chrom + '_union_island_summary.npy' for chrom in chroms]
+        filter_tasks = chroms
     else:
         filter_by_fdr_partial = partial(filter_by_fdr_SICER, args)
-        filtered_output = pool.map(filter_by_fdr_partial, chroms)
+        if island_files is None:
+            summary_files = [args.treatment_file.replace('.bed', '') + '_' + chrom + '_island_summary.npy'
+                             for chrom in chroms]
+            island_files = list(zip(summary_files, summary_files))
+        else:
+            summary_files = [summary_file for (summary_file, filtered_file) in island_files]
+        filter_tasks = island_files
+    scheduler.map_by_cost(pool, filter_by_fdr_partial, filter_tasks, scheduler.file_costs(summary_files))
 
     outfile_name = ''
     if (df_call and args.subcommand == "SICER"):
@@ -85,22 +115,31 @@ def main(args, columnindex, pool):
             args.false_discovery_rate) + '-island.bed')
 
     outfile_path = os.path.join(args.output_directory, outfile_name)
-    with open(outfile_path, 'w') as outfile:
-        for chrom in chroms:
+    with output_writer.open_output(outfile_path) as outfile:
+        for (i, chrom) in enumerate(chroms):
             island_file_name = ''
             if (df_call):
                 island_file_name = chrom + '_union_island_summary_filtered' + str(columnindex) + '.npy'
+                count_column = 'readcount_A'
             else:
-                island_file_name = args.treatment_file.replace('.bed', '') + '_' + chrom + '_island_summary.npy'
-            island_list = np.load(island_file_name, allow_pickle=True)
-            for island in island_list:
-                output_line = ''
-                for i in range(0, len(island)):
-                    output_line += str(island[i]) + '\t'
-                output_line += '\n'
-                outfile.write(output_line)
-                total_island_count += 1
-                total_read_count += island[3]
+                island_file_name = island_files[i][1]
+                count_column = 'chip_count'
+            island_list = island_store.load(island_file_name)
+            if (df_call):
+                # The FDRs capped at 1 are written as integers
+                fdr_capped = island_store.load(chrom + '_union_island_fdr_capped_filtered' + str(columnindex)
+                                               + '.npy')
+                columns = [output_writer.integer_column(island_list[name], fdr_capped[name])
+                           if name in fdr_capped.dtype.names else island_list[name]
+                           for name in island_list.dtype.names]
+            else:
+                columns = [island_list['start'], island_list['end'], island_list['chip_count']]
+            output_writer.write_columns(outfile, columns, prefix=chrom + '\t', suffix='\t\n')
+            total_island_count += len(island_list)
+            total_read_count += int(island_list[count_column].sum())
+
+    if (args.binary_tracks and not (df_call)):
+        write_bigbed(args, outfile_path, chroms, [filtered_file for (summary_file, filtered_file) in island_files])
 
     print("Given significance", str(args.false_discovery_rate), ", there are", total_island_count,
           "significant islands")
@@ -4,7 +4,6 @@
 
 # Modified by: Jin Yong Yoo
 
-import bisect
 import multiprocessing as mp
 import os
 from functools import partial
@@ -13,37 +12,22 @@ from math import *
 import numpy as np
 
 from sicer.lib import GenomeData
-
-
-def tag_position(read, fragment_size):
-    shift = int(round(fragment_size / 2))
-    if (read[5] == '+'):
-        return read[1] + shift
-    elif (read[5] == '-'):
-        return read[2] - 1 - shift
+from sicer.lib import associate_tags_with_regions
+from sicer.lib import island_store
+from sicer.lib import output_writer
+from sicer.lib import read_store
+from sicer.lib import scheduler
 
 
 def filter_tags_by_islands(file_name, fragment_size, chrom):
-    island_list = np.load(file_name + '_' + chrom + '_island_summary.npy', allow_pickle=True)
-    read_list = np.load(file_name + '_' + chrom + '.npy', allow_pickle=True)
-    filtered_reads = []
-    if (len(island_list) > 0):
-        island_start_list = []
-        island_end_list = []
-        for island in island_list:
-            island_start_list.append(island[1])
-            island_end_list.append(island[2])
-
-        island_start_list.sort()
-        island_end_list.sort()
-
-        for read in read_list:
-            position = tag_position(read, fragment_size)
-            if bisect.bisect_right(island_start_list, position) - bisect.bisect_left(island_end_list, position) == 1:
-                filtered_reads.append(read)
+    island_list = island_store.load(file_name + '_' + chrom + '_island_summary.npy')
+    read_list = np.load(file_name + '_' + chrom + '.npy')
+    (positions, has_position) = associate_tags_with_regions.tag_positions(read_list, fragment_size)
+    island_index = associate_tags_with_regions.find_islands_of_positions(np.sort(island_list['start']),
+                                                                         np.sort(island_list['end']), positions)
+    filtered_reads = read_list[has_position & (island_index >= 0)]
 
-    np_filtered_reads = np.array(filtered_reads, dtype=object)
-    np.save(file_name + '_' + chrom + '_filtered.npy', np_filtered_reads)
+    np.save(file_name + '_' + chrom + '_filtered.npy', filtered_reads)
 
 
 def main(args, pool):
@@ -53,7 +37,8 @@ def main(args, pool):
     # Use multiprocessing to filter raw tags by islands in parallel processes
     #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
     filter_tags_by_islands_partial = partial(filter_tags_by_islands, treatment_file, args.fragment_size)
-    pool.map(filter_tags_by_islands_partial, chroms)
+    read_files = [treatment_file + '_' + chrom + '.npy' for chrom in chroms]
+    scheduler.map_by_cost(pool, filter_tags_by_islands_partial, chroms, scheduler.file_costs(read_files))
     #pool.close()
 
     output_file_name = treatment_file + '-W' + str(args.window_size)
@@ -61,11 +46,16 @@ def main(args, pool):
         output_file_name += '-G' + str(args.gap_size)
     output_file_name += '-FDR' + str(args.false_discovery_rate) + '-islandfiltered.bed'
     outfile_path = os.path.join(args.output_directory, output_file_name)
-    with open(outfile_path, 'w') as outfile:
+    with output_writer.open_output(outfile_path) as outfile:
         for chrom in chroms:
-            filtered_bed = np.load(treatment_file + '_' + chrom + '_filtered.npy', allow_pickle=True)
-            for read in filtered_bed:
-                output_line = str(read[0]) + '\t' + str(read[1]) + '\t' + str(read[2]) + '\t' + str(
-                    read[3]) + '\t' + str(read[4]) + '\t' + str(read[5]) + '\n'
-                outfile.write(output_line)
+            filtered_reads = np.load(treatment_file + '_' + chrom + '_filtered.npy')
+            # Recover the name and score columns of the reads, kept aside by remove_redundant_reads
+            bed_columns = np.load(treatment_file + '_' + chrom + '_columns.npy')
+            filtered_bed = read_store.recover_bed_columns(filtered_reads, bed_columns)
+            output_writer.write_columns(outfile, [filtered_bed['start'], filtered_bed['end'],
+                                                  (filtered_bed['name'], output_writer.format_text),
+                                                  (filtered_bed['score'], output_writer.format_text),
+                                                  (read_store.strand_symbols[filtered_bed['strand']],
+                                                   output_writer.format_text)],
+                                        prefix=chrom + '\t')
 
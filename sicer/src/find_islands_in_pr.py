@@ -11,6 +11,11 @@ import numpy as np
 
 from sicer.lib import Background_island_probscore_statistics
 from sicer.lib import GenomeData
+from sicer.lib import cache
+from sicer.lib import island_store
+from sicer.lib import output_writer
+from sicer.lib import scheduler
+from sicer.lib import shared_arrays
 
 """
 Take in coords for bed_gaph type summary files and find 'islands' of modifications.
@@ -66,98 +71,161 @@ def poisson(i, average):
         return exp(exponent);
 
 
+def segment_sums(values, segment_starts):
+    """
+    Sums the values of each segment of the array, a segment spanning from one of segment_starts to the next.
+    The values of a segment are added in order, so that the sums are exactly those of a loop
+    (np.add.reduceat adds them pairwise, which changes the last digits of the sums).
+    """
+    segment_ends = np.append(segment_starts[1:], len(values))
+    sums = values[segment_starts].copy()
+    position = segment_starts + 1
+    # Every segment is advanced by one value at a time, until the longest segment is summed
+    active = np.flatnonzero(position < segment_ends)
+    while len(active) > 0:
+        sums[active] += values[position[active]]
+        position[active] += 1
+        active = active[position[active] < segment_ends[active]]
+    return sums
+
+
 def combine_proximal_islands(islands, gap, window_size_buffer=3):
     """
-    islands: a list of tuples of following format: (chrom, start, end, score)
-    Therefore, "islands[index][1]" would mean the start position of the window at the given index
+    islands: an array of windows with their scores (sicer.lib.island_store.island_dtype)
+    Therefore, "islands['start']" would be the start positions of the windows
     Extend the regions found in the find_continuous_region function.
     If gap is not allowed, gap = 0, if one window is allowed, gap = window_size (200)
 
-    Return a list of combined regions.
+    Return an array of combined regions, with the sum of the scores of their windows.
     """
 
     proximal_island_dist = gap + window_size_buffer;
 
     if len(islands) == 0:
-        return []
-    final_islands = []
-    current_island = islands[0];
-
-    if len(islands) == 1:
-        final_islands = islands;
-    else:
-        for index in range(1, len(islands)):
-            dist = islands[index][1] - current_island[2];
-            if dist <= proximal_island_dist:
-                current_island[2] = islands[index][2];
-                current_island[3] += islands[index][3];
-            else:
-                final_islands.append(current_island);
-                current_island = islands[index];
-        # The last island:
-        final_islands.append(current_island);
-
+        return np.empty(0, dtype=island_store.island_dtype)
+    # A window further than the distance from the previous one begins a new island
+    breaks = np.flatnonzero(islands['start'][1:] - islands['end'][:-1] > proximal_island_dist) + 1
+    first_windows = np.concatenate(([0], breaks))
+    last_windows = np.append(breaks - 1, len(islands) - 1)
+
+    final_islands = np.empty(len(first_windows), dtype=island_store.island_dtype)
+    final_islands['start'] = islands['start'][first_windows]
+    final_islands['end'] = islands['end'][last_windows]
+    final_islands['score'] = segment_sums(islands['score'], first_windows)
     return final_islands;
 
 
 def find_region_above_threshold(island_list, score_threshold):
-    filtered_islands = [];
-    for island in island_list:
-        if island[3] >= (score_threshold - .0000000001):
-            filtered_islands.append(island);
-    return filtered_islands;
+    return island_list[island_list['score'] >= (score_threshold - .0000000001)];
+
+
+def window_score(read_count, min_tags_in_window, average):
+    '''Score of a window with read_count tags, s = -log(Poisson(read_count,lambda)), or -1 if the window is not eligible'''
+    score = -1
+    if (read_count >= min_tags_in_window):
+        prob = poisson(read_count, average);
+        if prob < 1e-250:
+            score = 1000;  # outside of the scale, take an arbitrary number.
+        else:
+            score = -log(prob)
+    return score
+
+
+def window_score_table(min_tags_in_window, average, table_size):
+    '''Returns the array of the scores of windows with 0 to table_size - 1 tags'''
+    return np.array([window_score(read_count, min_tags_in_window, average) for read_count in range(table_size)],
+                    dtype=np.float64)
 
 
-def filter_ineligible_windows(chrom_graph, min_tags_in_window, average):
+def filter_ineligible_windows(chrom_graph, min_tags_in_window, average, score_table):
     '''Filters windows that have tag count lower than the minimum threshold count and calculates score for windows that meet the minimum count.
-        Score is defined as s = -log(Poisson(read_count,lambda))'''
-
-    filtered_chrom_graph = []
-    for window in chrom_graph:
-        read_count = window[3]
-        score = -1
-        if (read_count >= min_tags_in_window):
-            prob = poisson(read_count, average);
-            if prob < 1e-250:
-                score = 1000;  # outside of the scale, take an arbitrary number.
-            else:
-                score = -log(prob)
-        eligible_window = (window[0], window[1], window[2], score)
-        if score > 0:
-            filtered_chrom_graph.append(eligible_window);
-
-    np_filtered_chrom_graph = np.array(filtered_chrom_graph, dtype=object)
+        Score is defined as s = -log(Poisson(read_count,lambda)) and is looked up in score_table (see window_score_table).'''
+
+    read_counts = chrom_graph['count']
+    scores = np.empty(len(read_counts), dtype=np.float64)
+    in_table = read_counts < len(score_table)
+    scores[in_table] = score_table[read_counts[in_table]]
+    # Counts beyond the table are scored one distinct count at a time
+    beyond_table = np.flatnonzero(~in_table)
+    if len(beyond_table) > 0:
+        (beyond_counts, inverse) = np.unique(read_counts[beyond_table], return_inverse=True)
+        beyond_scores = [window_score(int(read_count), min_tags_in_window, average) for read_count in beyond_counts]
+        scores[beyond_table] = np.array(beyond_scores, dtype=np.float64)[inverse]
+
+    eligible = scores > 0
+    np_filtered_chrom_graph = np.empty(np.count_nonzero(eligible), dtype=island_store.island_dtype)
+    np_filtered_chrom_graph['start'] = chrom_graph['start'][eligible]
+    np_filtered_chrom_graph['end'] = chrom_graph['end'][eligible]
+    np_filtered_chrom_graph['score'] = scores[eligible]
     return np_filtered_chrom_graph
 
 
-def filter_and_find_islands(min_tags_in_window, gap_size, score_threshold, average, verbose, graph_file):
-    '''Function for handling multiprocessing. Calls functions for filtering windows and finding islands.'''
-    number_of_islands = 0
-    print_return = ""
-    chrom_graph = np.load(graph_file, allow_pickle=True)
-
-    if (len(chrom_graph) > 0):
-        chrom = chrom_graph[0][0]
-        filtered_chrom_graph = filter_ineligible_windows(chrom_graph, min_tags_in_window, average)
-        islands = combine_proximal_islands(filtered_chrom_graph, gap_size, 2);
-        islands = find_region_above_threshold(islands, score_threshold);
-        number_of_islands += len(islands)
-        if not (len(islands) > 0):
-            if verbose:
-                print_return += chrom + " does not have any islands meeting the required significance"
-        np.save(graph_file, islands)
+def filter_and_find_islands(min_tags_in_window, gap_size, average, score_table, file, chrom, segment):
+    '''
+    Function for handling multiprocessing. Calls functions for filtering windows and finding islands, for the windows
+    of a segment of the chromosome. Large chromosomes are split into segments that begin at a window.
+    Returns the number of windows of the segment, its islands before the score threshold, and the windows of its
+    first and last islands, which are combined with those of the neighbouring segments (see stitch_islands).
+    '''
+    graph_file = file + '_' + chrom + '_graph.npy'
+    chrom_graph = island_store.load(graph_file)
+    (first_window, end_window) = np.searchsorted(chrom_graph['start'], segment)
+    segment_graph = chrom_graph[first_window:end_window]
+
+    filtered_chrom_graph = filter_ineligible_windows(segment_graph, min_tags_in_window, average, score_table)
+    islands = combine_proximal_islands(filtered_chrom_graph, gap_size, 2);
+    if len(islands) > 1:
+        first_island_end = np.searchsorted(filtered_chrom_graph['start'], islands['end'][0], side='right')
+        last_island_start = np.searchsorted(filtered_chrom_graph['start'], islands['start'][-1])
+        edge_windows = np.concatenate((filtered_chrom_graph[:first_island_end],
+                                       filtered_chrom_graph[last_island_start:]))
+    else:
+        edge_windows = filtered_chrom_graph
+    return (len(segment_graph), shared_arrays.share(islands), shared_arrays.share(edge_windows))
 
-    return (graph_file, number_of_islands, print_return)
 
+def stitch_islands(segment_islands, segment_edge_windows, gap, window_size_buffer=3):
+    """
+    Combines the islands of the consecutive segments of a chromosome into the islands of the whole chromosome,
+    as combine_proximal_islands would have combined the windows of the chromosome: the islands on either side
+    of the border between two segments are combined when they are within the gap.
+    The score of a combined island is the sum of the scores of its windows, added in order, from the windows
+    of the first and last islands of the segments.
+    """
+    proximal_island_dist = gap + window_size_buffer;
 
-def main(args, total_read_count, pool):
+    islands = np.concatenate(segment_islands)
+    if len(islands) == 0:
+        return islands
+    breaks = np.flatnonzero(islands['start'][1:] - islands['end'][:-1] > proximal_island_dist) + 1
+    if len(breaks) == len(islands) - 1:
+        return islands
+    first_islands = np.concatenate(([0], breaks))
+    last_islands = np.append(breaks - 1, len(islands) - 1)
+
+    final_islands = np.empty(len(first_islands), dtype=island_store.island_dtype)
+    final_islands['start'] = islands['start'][first_islands]
+    final_islands['end'] = islands['end'][last_islands]
+    final_islands['score'] = islands['score'][first_islands]
+    edge_windows = np.concatenate(segment_edge_windows)
+    for i in np.flatnonzero(last_islands > first_islands):
+        first_window = np.searchsorted(edge_windows['start'], final_islands['start'][i])
+        end_window = np.searchsorted(edge_windows['start'], final_islands['end'][i], side='right')
+        final_islands['score'][i] = np.cumsum(edge_windows['score'][first_window:end_window])[-1]
+    return final_islands
+
+
+def island_thresholds(args, total_read_count):
+    '''
+    Determines the thresholds of the windows and islands from the random background of the genome-wide read count.
+    Returns the minimum tag count of an eligible window, the score threshold of the islands and the average
+    read count of a window.
+    '''
     print("Species: ", args.species);
     print("Window_size: ", args.window_size);
     print("Gap size: ", args.gap_size);
     print("E value is:", args.e_value);
     print("Total read count:", total_read_count)
-    chroms = GenomeData.species_chroms[
-        args.species];  # list of chromsomes for the given species (e.g. chr1, chr2, ... , chrx)
     genome_length = sum(GenomeData.species_chrom_lengths[args.species].values());  # list of length of each chromsomes
     effective_genome_length = int(args.effective_genome_fraction * genome_length);
     average = float(total_read_count) * args.window_size / effective_genome_length;  # average read count
@@ -168,55 +236,125 @@ def main(args, total_read_count, pool):
 
     window_pvalue = 0.20;
     bin_size = 0.001;
-    background = Background_island_probscore_statistics.Background_island_probscore_statistics(total_read_count,
-                                                                                               args.window_size,
-                                                                                               args.gap_size,
-                                                                                               window_pvalue,
-                                                                                               effective_genome_length,
-                                                                                               bin_size);
-    min_tags_in_window = background.min_tags_in_window
+    # The thresholds only depend on these parameters, so they are kept in a cache across runs, unless --no_cache
+    threshold_parameters = {'total_read_count': total_read_count, 'window_size': args.window_size,
+                            'gap_size': args.gap_size, 'window_pvalue': window_pvalue,
+                            'effective_genome_length': effective_genome_length, 'bin_size': bin_size,
+                            'e_value': args.e_value}
+    cached_thresholds = None
+    if not (args.no_cache):
+        cached_thresholds = cache.get('island_threshold', threshold_parameters)
+    if cached_thresholds is not None:
+        (min_tags_in_window, score_threshold) = cached_thresholds
+    else:
+        background = Background_island_probscore_statistics.Background_island_probscore_statistics(
+            total_read_count, args.window_size, args.gap_size, window_pvalue, effective_genome_length, bin_size);
+        min_tags_in_window = background.min_tags_in_window
+        # determine threshold from random background
+        score_threshold = background.find_island_threshold(args.e_value);
+        if not (args.no_cache):
+            cache.put('island_threshold', threshold_parameters, [min_tags_in_window, score_threshold])
 
     print("Window pvalue:", window_pvalue)
     print("Minimum num of tags in a qualified window: ", min_tags_in_window)  # first threshold cutoff
 
     print("\nDetermining the score threshold from random background...");
-    # determine threshold from random background
-    score_threshold = background.find_island_threshold(args.e_value);
     print("The score threshold is:", score_threshold);
+    return (min_tags_in_window, score_threshold, average)
+
+
+def save_islands_of_chrom(islands, window_count, score_threshold, verbose, file, chrom):
+    '''
+    Keeps the islands of a chromosome above the score threshold and saves them in place of its graph, if it has
+    windows. Returns the (island file, number of islands, message) of the chromosome, as write_scoreisland takes them.
+    '''
+    islands = find_region_above_threshold(islands, score_threshold);
+    print_return = ""
+    graph_file = file + '_' + chrom + '_graph.npy'
+    if (window_count > 0):
+        if not (len(islands) > 0):
+            if verbose:
+                print_return += chrom + " does not have any islands meeting the required significance"
+        np.save(graph_file, islands)
+    return (graph_file, len(islands), print_return)
+
+
+def find_islands_of_chrom(min_tags_in_window, gap_size, score_threshold, average, score_table, verbose, file, chrom):
+    '''
+    Filters the windows of a whole chromosome and finds its islands, without splitting it into segments.
+    Saves the islands in place of the graph and returns the same as save_islands_of_chrom.
+    '''
+    chrom_graph = island_store.load(file + '_' + chrom + '_graph.npy')
+    filtered_chrom_graph = filter_ineligible_windows(chrom_graph, min_tags_in_window, average, score_table)
+    islands = combine_proximal_islands(filtered_chrom_graph, gap_size, 2);
+    return save_islands_of_chrom(islands, len(chrom_graph), score_threshold, verbose, file, chrom)
+
+
+def main(args, total_read_count, pool):
+    chroms = GenomeData.species_chroms[
+        args.species];  # list of chromsomes for the given species (e.g. chr1, chr2, ... , chrx)
+    genome_length = sum(GenomeData.species_chrom_lengths[args.species].values())
+    (min_tags_in_window, score_threshold, average) = island_thresholds(args, total_read_count)
 
     # generate the probscore summary graph file, only care about enrichment
     # filter the summary graph to get rid of windows whose scores are less than window_score_threshold
 
     file = args.treatment_file.replace('.bed', '')
-    list_of_graph_files = []
-    for chrom in chroms:
-        list_of_graph_files.append(file + '_' + chrom + '_graph.npy')
 
     # Use multiprocessing to filter windows with tag count below minimum requirement
     print(
         "Generating the enriched probscore summary graph and filtering the summary graph to eliminate ineligible windows... ");
     #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
+    # Scores of windows are looked up by tag count, for counts up to the size of the background tables
+    score_table = window_score_table(min_tags_in_window, average, max(500, int(2 * average)))
+    # The windows of large chromosomes are split into segments handled by separate processes
+    chrom_lengths = GenomeData.species_chrom_lengths[args.species]
+    segment_length = scheduler.part_size(genome_length, args.cpu, scheduler.min_segment_length, args.window_size)
+    list_of_segments = []
+    for (i, chrom) in enumerate(chroms):
+        for segment in scheduler.split_range(chrom_lengths[chrom], segment_length):
+            list_of_segments.append((i, (chrom, segment)))
     filter_and_find_islands_partial = partial(filter_and_find_islands, min_tags_in_window, args.gap_size,
-                                              score_threshold, average, args.verbose)
-    filtered_islands_result = pool.map(filter_and_find_islands_partial, list_of_graph_files)
+                                              average, score_table, file)
+    segment_results = scheduler.starmap_by_cost(pool, filter_and_find_islands_partial,
+                                                [segment[1] for segment in list_of_segments],
+                                                [segment[1][1][1] - segment[1][1][0] for segment in list_of_segments])
     #pool.close()
 
+    filtered_islands_result = []
+    for (i, chrom) in enumerate(chroms):
+        results = [result for (segment, result) in zip(list_of_segments, segment_results) if segment[0] == i]
+        with shared_arrays.SharedArrays() as received:
+            islands = stitch_islands([received.receive(result[1]) for result in results],
+                                     [received.receive(result[2]) for result in results], args.gap_size, 2)
+        filtered_islands_result.append(save_islands_of_chrom(islands, sum([result[0] for result in results]),
+                                                             score_threshold, args.verbose, file, chrom))
+
+    write_scoreisland(args, chroms, filtered_islands_result)
+
+
+def write_scoreisland(args, chroms, filtered_islands_result):
+    '''Writes the islands of each chromosome, from the (island file, number of islands, message) of each chromosome'''
     file_name = args.treatment_file.replace('.bed', '')
     outfile_path = os.path.join(args.output_directory, (file_name + '-W' + str(args.window_size)
                                                         + '-G' + str(args.gap_size) + '.scoreisland'))
     total_number_islands = 0
     path_to_filtered_graph = []
-    with open(outfile_path, 'w') as outfile:
+    with output_writer.open_output(outfile_path) as outfile:
         for i in range(0, len(filtered_islands_result)):
-            filtered_chrom_graph = np.load(filtered_islands_result[i][0],allow_pickle=True)
+            filtered_chrom_graph = island_store.load(filtered_islands_result[i][0])
             path_to_filtered_graph.append(filtered_islands_result[i][0])
             total_number_islands += filtered_islands_result[i][1]
             if (filtered_islands_result[i][2] != ""):
                 print(filtered_islands_result[i][2])
-            for window in filtered_chrom_graph:
-                chrom = window[0]
-                line = (chrom + '\t' + str(window[1]) + '\t' + str(window[2])
-                        + '\t' + str(window[3]) + '\n')
-                outfile.write(line)
+            chrom = chroms[i]
+            if (len(filtered_chrom_graph) > 0):  # chromosomes without windows keep their empty graph
+                # A score of 1000 is a window outside of the scale (see filter_ineligible_windows), and the
+                # islands of only such windows have integer scores. The other windows score at most -log(1e-250),
+                # so the scores of islands with such windows are not multiples of 1000 in practice.
+                scores = filtered_chrom_graph['score']
+                output_writer.write_columns(outfile, [filtered_chrom_graph['start'], filtered_chrom_graph['end'],
+                                                      output_writer.integer_column(scores, np.mod(scores, 1000) == 0)],
+                                            prefix=chrom + '\t')
 
     print("Total number of islands: ", total_number_islands);
@@ -11,6 +11,9 @@ from math import *
 import numpy as np
 
 from sicer.lib import GenomeData
+from sicer.lib import island_store
+from sicer.lib import output_writer
+from sicer.lib import scheduler
 
 
 # Function designed for handling multiprocessing. Executes the redundancy removal algorithm
@@ -25,32 +28,28 @@ def find_union_islands(no_control, temp_dir_1, temp_dir_2, chrom):
         file_name_1 += '_island_summary.npy'
         file_name_2 += '_island_summary.npy'
 
-    island_list_1 = np.load(file_name_1, allow_pickle=True)
-    island_list_2 = np.load(file_name_2, allow_pickle=True)
-    if (len(island_list_1) == 0):
-        island_list = island_list_2
-    elif (len(island_list_2) == 0):
-        island_list = island_list_1
-    else:
-        island_list = np.concatenate((island_list_1, island_list_2))
+    # The islands of the two libraries have different dtypes, only their start and end are needed
+    island_list_1 = island_store.regions(island_store.load(file_name_1))
+    island_list_2 = island_store.regions(island_store.load(file_name_2))
+    island_list = np.concatenate((island_list_1, island_list_2))
 
     union_island_list = []
     if (len(island_list) > 0):
-        island_list = island_list[np.argsort(island_list[:, 1])]
+        island_list = island_list[np.argsort(island_list['start'], kind='stable')]
         current = island_list[0]
         i = 1
         while i < len(island_list):
             compare = island_list[i]
-            assert current[1] <= compare[2]
-            if compare[1] > current[2]:
+            assert current['start'] <= compare['end']
+            if compare['start'] > current['end']:
                 union_island_list.append(current)
                 current = compare
                 i += 1
             else:
-                current[2] = max(current[2], compare[2])
+                current['end'] = max(current['end'], compare['end'])
                 i += 1
         union_island_list.append(current)
-    np_union_island_list = np.array(union_island_list, dtype=object)
+    np_union_island_list = np.array(union_island_list, dtype=island_store.region_dtype)
     np.save(chrom + '_union_output.npy', np_union_island_list)
 
 
@@ -66,7 +65,10 @@ def main(args, temp_dir_1, temp_dir_2, pool):
     # Use multiprocessing module to run parallel processes for each chromosome
     #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
     find_union_islands_partial = partial(find_union_islands, no_control, temp_dir_1, temp_dir_2)
-    pool.map(find_union_islands_partial, chroms)
+    island_suffix = '_graph.npy' if no_control else '_island_summary.npy'
+    island_costs = scheduler.file_costs([temp_dir_1 + '_' + chrom + island_suffix for chrom in chroms],
+                                        [temp_dir_2 + '_' + chrom + island_suffix for chrom in chroms])
+    scheduler.map_by_cost(pool, find_union_islands_partial, chroms, island_costs)
     #pool.close()
 
     outfile_name = (args.treatment_file[0].replace('.bed', '') + '-vs-' + args.treatment_file[1].replace('.bed', '') + '-W' + str(
@@ -77,10 +79,9 @@ def main(args, temp_dir_1, temp_dir_2, pool):
         outfile_name += '-union.island'
     outfile_path = os.path.join(args.output_directory, outfile_name)
 
-    with open(outfile_path, 'w') as outfile:
+    with output_writer.open_output(outfile_path) as outfile:
         for chrom in chroms:
-            union_island_list = np.load(chrom + '_union_output.npy', allow_pickle=True)
-            for island in union_island_list:
-                output_line = island[0] + '\t' + str(island[1]) + '\t' + str(island[2]) + '\n'
-                outfile.write(output_line)
+            union_island_list = island_store.load(chrom + '_union_output.npy')
+            output_writer.write_columns(outfile, [union_island_list['start'], union_island_list['end']],
+                                        prefix=chrom + '\t')
 
@@ -0,0 +1,237 @@
+# Author: Jin Yong Yoo
+
+"""
+Fused execution of the steps of SICER that handle one chromosome at a time (--fused).
+
+The staged pipeline saves the result of every step in the temporary directory and loads it back in
+the next one: the reads after redundancy removal, then the graph, then the islands. Here a process
+takes a chromosome through these steps in memory, and only the genome-wide reductions are barriers
+between the two passes over the chromosomes:
+
+    pass 1: redundancy removal of the treatment and control reads, and the tag counts of the windows
+    barrier: total read counts, for the average read count of a window and the background score threshold
+    pass 2: window scores, islands, and the read counts and statistics of the islands
+    barrier: Benjamini-Hochberg FDR of the islands of the whole genome
+
+The reads are not kept after pass 1. Islands begin and end on the borders of windows, so the read count
+of an island is the sum of the tag counts of its windows (see associate_tags_with_regions.window_tag_counts),
+which pass 1 hands to the parent in shared memory in place of the reads (see sicer.lib.shared_arrays).
+The parent owns them until the end of the run and lends them to the processes of pass 2. The treatment
+reads are only saved for the steps that read them again, --significant_reads and the differential (df)
+comparison, and the reads of both libraries for the library cache (--library_cache), which also gives the
+reads of the libraries it holds in place of redundancy removal. The graph is still saved, since the WIG
+file is written from it before pass 2.
+
+Each chromosome is one task, so the chromosomes are not split into parts as in the staged pipeline.
+"""
+
+import os
+from functools import partial
+
+import numpy as np
+
+from sicer.lib import GenomeData
+from sicer.lib import Utility
+from sicer.lib import associate_tags_with_regions
+from sicer.lib import island_store
+from sicer.lib import scheduler
+from sicer.lib import shared_arrays
+from sicer.src import associate_tags_with_chip_and_control_w_fc_q
+from sicer.src import find_islands_in_pr
+from sicer.src import remove_redundant_reads
+from sicer.src import run_make_graph_file_by_chrom
+
+
+def filter_or_load_reads(file_name, cutoff, keep_bed_columns, max_reads, parts_by_chrom, save_reads, chrom):
+    '''
+    Removes the redundant reads of a chromosome (see remove_redundant_reads.filter_reads) and saves them if
+    save_reads, or loads them when the library is taken from the library cache (parts_by_chrom is None).
+    Returns the message of the chromosome, None for a cached library, and the reads.
+    '''
+    if parts_by_chrom is None:
+        return (None, np.load(file_name + '_' + chrom + '.npy', mmap_mode='r'))
+    (message, reads, saved) = remove_redundant_reads.filter_reads(file_name, cutoff, keep_bed_columns, max_reads,
+                                                                  parts_by_chrom, chrom)
+    if save_reads and not saved:
+        np.save(file_name + '_' + chrom + '.npy', reads)
+    return (message, reads)
+
+
+def count_windows_of_chrom(args, treatment_name, treatment_parts, control_name, control_parts, max_reads,
+                           save_reads, chrom_length, chrom):
+    '''
+    Function for handling multiprocessing. Removes the redundant treatment and control reads of a chromosome,
+    saves the graph of the treatment reads and shares the tag counts of the windows of both libraries.
+    save_reads: whether to save the reads of the treatment and of the control library
+    Returns the (message, number of retained reads) of each library, the (tag count, message) of the graph
+    and the shared tag counts of the windows of each library.
+    '''
+    cutoff = args.redundancy_threshold
+    (treatment_message, treatment_reads) = filter_or_load_reads(treatment_name, cutoff, args.significant_reads,
+                                                                max_reads, treatment_parts, save_reads[0], chrom)
+
+    (tag_list, postive_tag_counts, negative_tag_counts, graph_message) = run_make_graph_file_by_chrom.get_bed_coords(
+        treatment_reads, chrom_length, args.fragment_size, chrom, args.verbose)
+    (chrom_graph, tag_count) = run_make_graph_file_by_chrom.Generate_windows_and_count_tags(
+        tag_list, chrom, chrom_length, args.window_size)
+    np.save(treatment_name + '_' + chrom + '_graph.npy', chrom_graph)
+    graph_message += run_make_graph_file_by_chrom.tag_count_message(chrom, postive_tag_counts, negative_tag_counts,
+                                                                    args.verbose)
+
+    control_result = None
+    tag_windows = None
+    if control_name is not None:
+        treatment_windows = associate_tags_with_regions.window_tag_counts(treatment_reads, args.fragment_size,
+                                                                          args.window_size)
+        (control_message, control_reads) = filter_or_load_reads(control_name, cutoff, False, max_reads,
+                                                                control_parts, save_reads[1], chrom)
+        control_windows = associate_tags_with_regions.window_tag_counts(control_reads, args.fragment_size,
+                                                                        args.window_size)
+        control_result = (control_message, len(control_reads))
+        tag_windows = (shared_arrays.share(treatment_windows), shared_arrays.share(control_windows))
+
+    return ((treatment_message, len(treatment_reads)), control_result, (tag_count, graph_message), tag_windows)
+
+
+def split_library(args, path_to_file, file_name, chroms, keep_bed_columns, pool):
+    '''
+    Splits the reads of a library by chromosome for pass 1, or links them from the library cache.
+    Returns the part files of each chromosome (None for a cached library), the (message, number of retained
+    reads) of each chromosome of a cached library (None otherwise) and the expected cost of each chromosome.
+    '''
+    print("Preprocess the", os.path.basename(path_to_file), "file to remove redundancy with threshold of",
+          args.redundancy_threshold, "\n")
+    cached_result = remove_redundant_reads.cached_library(args, path_to_file, file_name, chroms, keep_bed_columns)
+    if cached_result is not None:
+        return (None, cached_result, scheduler.file_costs([file_name + '_' + chrom + '.npy' for chrom in chroms]))
+    parts_by_chrom = remove_redundant_reads.shard_file(args, path_to_file, file_name, chroms, keep_bed_columns, pool)
+    return (parts_by_chrom, None, remove_redundant_reads.part_costs(file_name, parts_by_chrom, chroms))
+
+
+def library_read_count(args, path_to_file, file_name, chroms, keep_bed_columns, cached_result, filtered_result):
+    '''
+    Prints the read counts of the chromosomes of a library and stores the library in the library cache if it
+    was not taken from it. Returns the number of retained reads.
+    '''
+    if cached_result is not None:
+        filtered_result = cached_result
+    else:
+        remove_redundant_reads.cache_library(args, path_to_file, file_name, chroms, keep_bed_columns, filtered_result)
+    remove_redundant_reads.print_read_counts(filtered_result)
+    print('\n')
+    return sum([result[1] for result in filtered_result])
+
+
+def count_windows(args, pool, save_reads, shared_blocks):
+    '''
+    Pass 1, in place of redundancy removal (remove_redundant_reads) and graph making (run_make_graph_file_by_chrom).
+    save_reads: save the treatment reads after redundancy removal, for the steps that read them again.
+    shared_blocks: the owner (shared_arrays.SharedArrays) of the tag counts of the windows, which must not be
+    released before pass 2.
+    Returns the number of retained treatment reads, retained control reads (None without control library)
+    and tags in windows, and the tag counts of the windows of the libraries of each chromosome for pass 2.
+    '''
+    chroms = GenomeData.species_chroms[args.species]
+    chrom_lengths = GenomeData.species_chrom_lengths[args.species]
+    # The reads of a library are also saved to be stored in the library cache
+    caching = args.library_cache is not None
+
+    treatment_name = Utility.bed_file_name(os.path.basename(args.treatment_file)).replace('.bed', '')
+    (treatment_parts, treatment_cached, read_costs) = split_library(args, args.treatment_file, treatment_name,
+                                                                    chroms, args.significant_reads, pool)
+
+    control_name = None
+    control_parts = None
+    control_cached = None
+    if (args.control_file is not None):
+        control_name = Utility.bed_file_name(os.path.basename(args.control_file)).replace('.bed', '')
+        (control_parts, control_cached, control_costs) = split_library(args, args.control_file, control_name,
+                                                                       chroms, False, pool)
+        read_costs = [cost + control_cost for (cost, control_cost) in zip(read_costs, control_costs)]
+
+    count_windows_partial = partial(count_windows_of_chrom, args, treatment_name, treatment_parts, control_name,
+                                    control_parts, remove_redundant_reads.max_reads_in_memory(args, chroms),
+                                    (save_reads or caching, caching))
+    results = scheduler.starmap_by_cost(pool, count_windows_partial,
+                                        [(chrom_lengths[chrom], chrom) for chrom in chroms], read_costs)
+
+    total_treatment_read_count = library_read_count(args, args.treatment_file, treatment_name, chroms,
+                                                    args.significant_reads, treatment_cached,
+                                                    [result[0] for result in results])
+    total_control_read_count = None
+    if control_name is not None:
+        total_control_read_count = library_read_count(args, args.control_file, control_name, chroms, False,
+                                                      control_cached, [result[1] for result in results])
+
+    print("Partition the genome in windows and generate summary files... \n")
+    total_tag_in_windows = 0
+    for result in results:
+        total_tag_in_windows += result[2][0]
+        print(result[2][1])
+    print("\n")
+
+    tag_windows = []
+    for result in results:
+        if result[3] is not None:
+            tag_windows.append((shared_blocks.adopt(result[3][0]), shared_blocks.adopt(result[3][1])))
+        else:
+            tag_windows.append(None)
+
+    return (total_treatment_read_count, total_control_read_count, total_tag_in_windows, tag_windows)
+
+
+def find_and_count_islands_of_chrom(args, min_tags_in_window, score_threshold, average, score_table, scaling_factor,
+                                    control_library_size, genomesize, chrom, tag_windows):
+    '''
+    Function for handling multiprocessing. Finds the islands of a chromosome and, with a control library,
+    counts the reads on them and saves their summary.
+    Returns the result of the islands (see find_islands_in_pr.write_scoreisland) and the summary file.
+    '''
+    file = args.treatment_file.replace('.bed', '')
+    island_result = find_islands_in_pr.find_islands_of_chrom(min_tags_in_window, args.gap_size, score_threshold,
+                                                             average, score_table, args.verbose, file, chrom)
+    if (args.control_file is None):
+        return (island_result, None)
+
+    islands = island_store.load(island_result[0])
+    with shared_arrays.borrowed(tag_windows[0]) as treatment_windows:
+        chip_readcounts = associate_tags_with_regions.find_readcount_of_islands_from_windows(
+            islands['start'], islands['end'], treatment_windows)
+    with shared_arrays.borrowed(tag_windows[1]) as control_windows:
+        control_readcounts = associate_tags_with_regions.find_readcount_of_islands_from_windows(
+            islands['start'], islands['end'], control_windows)
+    summary_file = associate_tags_with_chip_and_control_w_fc_q.associate_tag_count_to_regions(
+        args, scaling_factor, control_library_size, genomesize, chrom, chip_readcounts, control_readcounts)
+    return (island_result, summary_file)
+
+
+def find_islands(args, total_tag_in_windows, chip_library_size, control_library_size, tag_windows, pool):
+    '''
+    Pass 2, in place of island finding (find_islands_in_pr) and, with a control library, of the association of
+    the reads with the islands (associate_tags_with_chip_and_control_w_fc_q).
+    tag_windows: the tag counts of the windows of each chromosome, from count_windows
+    '''
+    chroms = GenomeData.species_chroms[args.species]
+    (min_tags_in_window, score_threshold, average) = find_islands_in_pr.island_thresholds(args,
+                                                                                         total_tag_in_windows)
+    scaling_factor = None
+    genomesize = None
+    if (args.control_file is not None):
+        print("\nCalculating significance of candidate islands using the control library... \n")
+        (scaling_factor, genomesize) = associate_tags_with_chip_and_control_w_fc_q.library_scaling(
+            args, chip_library_size, control_library_size)
+
+    print("Generating the enriched probscore summary graph and filtering the summary graph to eliminate "
+          "ineligible windows... ")
+    score_table = find_islands_in_pr.window_score_table(min_tags_in_window, average, max(500, int(2 * average)))
+    find_and_count_partial = partial(find_and_count_islands_of_chrom, args, min_tags_in_window, score_threshold,
+                                     average, score_table, scaling_factor, control_library_size, genomesize)
+    graph_files = [args.treatment_file.replace('.bed', '') + '_' + chrom + '_graph.npy' for chrom in chroms]
+    results = scheduler.starmap_by_cost(pool, find_and_count_partial, list(zip(chroms, tag_windows)),
+                                        scheduler.file_costs(graph_files))
+
+    find_islands_in_pr.write_scoreisland(args, chroms, [result[0] for result in results])
+    print("\n")
+    if (args.control_file is not None):
+        associate_tags_with_chip_and_control_w_fc_q.write_island_summaries(args, chroms,
+                                                                           [result[1] for result in results])
@@ -5,17 +5,30 @@ import multiprocessing as mp
 import os
 from math import *
 
-import numpy as np
-
 from sicer.lib import GenomeData
+from sicer.lib import bbi_writer
+from sicer.lib import island_store
+from sicer.lib import output_writer
+from sicer.lib import scheduler
 
 
 def get_counts(graph_file):
-    chrom_graph = np.load(graph_file, allow_pickle=True)
-    count = 0
-    for line in chrom_graph:
-        count += line[3]
-    return count
+    chrom_graph = island_store.load(graph_file)
+    return int(chrom_graph['count'].sum())
+
+
+def write_bigwig(args, output_file_name, chroms, list_of_graph_files, scaling_factor):
+    '''Writes the normalized tag counts of the windows in bigWig format, next to the WIG file'''
+    chrom_sizes = {chrom: GenomeData.species_chrom_lengths[args.species][chrom] for chrom in chroms}
+    graph_files = dict(zip(chroms, list_of_graph_files))
+    outfile_path = os.path.join(args.output_directory, output_file_name.replace('.wig', '.bw'))
+    # The first zoom level summarizes ten windows
+    with bbi_writer.BigWigWriter(outfile_path, chrom_sizes, 10 * args.window_size) as writer:
+        for chrom in writer.chroms:
+            chrom_graph = island_store.load(graph_files[chrom])
+            if (len(chrom_graph) > 0):
+                writer.add_intervals(chrom, chrom_graph['start'], chrom_graph['start'] + args.window_size,
+                                     chrom_graph['count'] / scaling_factor)
 
 
 def main(args, output_file_name, pool):
@@ -34,7 +47,8 @@ def main(args, output_file_name, pool):
 
     # Use multiprocessing to count the number of islands
     #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
-    count_results = pool.map(get_counts, list_of_graph_files)
+    count_results = scheduler.map_by_cost(pool, get_counts, list_of_graph_files,
+                                          scheduler.file_costs(list_of_graph_files))
     #pool.close()
     for count in count_results:
         total_count += count
@@ -43,15 +57,18 @@ def main(args, output_file_name, pool):
     outfile_path = os.path.join(args.output_directory, output_file_name)
 
     # Normalize tag count using the scaling factor and generate a file in WIG format
-    with open(outfile_path, 'w') as outfile:
+    with output_writer.open_output(outfile_path) as outfile:
         if filtered_mode:
             file = file + '-islandfiltered'
         outfile.write("track type=wiggle_0 name=" + file + "\n")
         for i in range(0, len(chroms)):
-            chrom_graph = np.load(list_of_graph_files[i], allow_pickle=True)
+            chrom_graph = island_store.load(list_of_graph_files[i])
             if (len(chrom_graph) > 0):
                 outfile.write("variableStep chrom=" + chroms[i] + " span=" + str(args.window_size) + "\n")
-                for window in chrom_graph:
-                    normalized_tag_count = round(float(window[3] / scaling_factor), 2)
-                    start_coord = window[1] + 1
-                    outfile.write(str(start_coord) + "\t" + str(normalized_tag_count) + "\n")
+                normalized_tag_count = chrom_graph['count'] / scaling_factor
+                start_coord = chrom_graph['start'] + 1
+                output_writer.write_columns(outfile, [start_coord,
+                                                      (normalized_tag_count, output_writer.rounded_format(2))])
+
+    if (args.binary_tracks):
+        write_bigwig(args, output_file_name, chroms, list_of_graph_files, scaling_factor)
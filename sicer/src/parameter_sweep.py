@@ -0,0 +1,232 @@
+# Author: Jin Yong Yoo
+
+"""
+Islands of SICER for a grid of window sizes, gap sizes, E-values and FDR cutoffs (sicer_sweep).
+
+The steps that do not depend on the parameters are shared by the points of the grid:
+
+    once:                  redundancy removal of the treatment and control reads, the graphs of the treatment
+                           reads for all the window sizes (see run_make_graph_file_by_chrom.main) and, with a
+                           control library, the tag counts of the windows of both libraries
+    once per window size:  the WIG file
+    per (gap, E-value):    window scores, islands, and the read counts and statistics of the islands
+    per FDR cutoff:        the significant islands
+
+The islands of all the (gap, E-value) points of a window size, and of all chromosomes, are found in
+a single pass over the pool. Islands begin and end on the borders of windows, so their read counts are
+the sums of the tag counts of their windows (see associate_tags_with_regions.window_tag_counts), which
+the parent shares with the processes (see sicer.lib.shared_arrays) instead of reading the reads again
+for every point. The tags are counted in windows of the base of the pyramid of each window size (see
+run_make_graph_file_by_chrom.pyramid_bases), whose borders are also borders of the windows of the window size.
+
+The output files of a point are the same as those of a SICER run with its parameters, and are written
+in a directory of the output directory named after the point (see point_name).
+"""
+
+import copy
+import os
+import shutil
+from functools import partial
+
+import numpy as np
+
+from sicer.lib import GenomeData
+from sicer.lib import associate_tags_with_regions
+from sicer.lib import island_store
+from sicer.lib import scheduler
+from sicer.lib import shared_arrays
+from sicer.src import associate_tags_with_chip_and_control_w_fc_q
+from sicer.src import filter_islands_by_significance
+from sicer.src import find_islands_in_pr
+from sicer.src import make_normalized_wig
+from sicer.src import run_make_graph_file_by_chrom
+
+
+def point_name(window_size, gap_size, e_value):
+    return 'W' + str(window_size) + '-G' + str(gap_size) + '-E' + str(e_value)
+
+
+def remove_repeated_values(args):
+    '''Removes the values repeated in the parameter lists of args, keeping their order, so no point runs twice'''
+    for parameter in ('window_size', 'gap_size', 'e_value', 'false_discovery_rate'):
+        setattr(args, parameter, list(dict.fromkeys(getattr(args, parameter))))
+
+
+def grid_points(args, window_size):
+    '''Returns the (gap size, E-value) of the points of the grid of a window size. Gaps must be multiples of it.'''
+    return [(gap_size, e_value) for gap_size in args.gap_size if gap_size % window_size == 0
+            for e_value in args.e_value]
+
+
+def tag_windows_of_chrom(fragment_size, window_size, treatment_name, control_name, chrom):
+    '''Function for handling multiprocessing. Shares the tag counts of the windows of both libraries.'''
+    tag_windows = []
+    for name in (treatment_name, control_name):
+        reads = np.load(name + '_' + chrom + '.npy', mmap_mode='r')
+        tag_windows.append(shared_arrays.share(
+            associate_tags_with_regions.window_tag_counts(reads, fragment_size, window_size)))
+    return tuple(tag_windows)
+
+
+def count_tag_windows(args, window_size, pool, shared_blocks):
+    '''
+    Returns the tag counts of the windows of window_size of the treatment and control libraries of each chromosome,
+    owned by shared_blocks (shared_arrays.SharedArrays)
+    '''
+    chroms = GenomeData.species_chroms[args.species]
+    treatment_name = args.treatment_file.replace('.bed', '')
+    control_name = args.control_file.replace('.bed', '')
+    tag_windows_partial = partial(tag_windows_of_chrom, args.fragment_size, window_size, treatment_name,
+                                  control_name)
+    read_files = [[name + '_' + chrom + '.npy' for chrom in chroms] for name in (treatment_name, control_name)]
+    results = scheduler.map_by_cost(pool, tag_windows_partial, chroms, scheduler.file_costs(*read_files))
+    return [(shared_blocks.adopt(treatment_windows), shared_blocks.adopt(control_windows))
+            for (treatment_windows, control_windows) in results]
+
+
+def find_and_count_islands_of_point(args, library_scaling, point, chrom, tag_windows):
+    '''
+    Function for handling multiprocessing. Finds the islands of a chromosome for a point of the grid and, with a
+    control library, counts the reads on them and saves their summary.
+    point: the (name, gap size, minimum tag count of a window, score threshold, average tag count of a window,
+    score table) of the point
+    Returns the result of the islands (see find_islands_in_pr.write_scoreisland) and the summary file.
+    '''
+    (name, gap_size, min_tags_in_window, score_threshold, average, score_table) = point
+    file = args.treatment_file.replace('.bed', '') + '_' + chrom
+    chrom_graph = island_store.load(file + '_graph.npy')
+    filtered_chrom_graph = find_islands_in_pr.filter_ineligible_windows(chrom_graph, min_tags_in_window, average,
+                                                                        score_table)
+    islands = find_islands_in_pr.combine_proximal_islands(filtered_chrom_graph, gap_size, 2)
+    islands = find_islands_in_pr.find_region_above_threshold(islands, score_threshold)
+    island_file = file + '_' + name + '_islands.npy'
+    np.save(island_file, islands)
+    print_return = ""
+    if (len(chrom_graph) > 0 and len(islands) == 0 and args.verbose):
+        print_return += chrom + " does not have any islands meeting the required significance"
+    if (args.control_file is None):
+        return ((island_file, len(islands), print_return), None)
+
+    with shared_arrays.borrowed(tag_windows[0]) as treatment_windows:
+        chip_readcounts = associate_tags_with_regions.find_readcount_of_islands_from_windows(
+            islands['start'], islands['end'], treatment_windows)
+    with shared_arrays.borrowed(tag_windows[1]) as control_windows:
+        control_readcounts = associate_tags_with_regions.find_readcount_of_islands_from_windows(
+            islands['start'], islands['end'], control_windows)
+    (scaling_factor, control_library_size, genomesize) = library_scaling
+    summary_list = associate_tags_with_chip_and_control_w_fc_q.island_summary(
+        islands, chip_readcounts, control_readcounts, scaling_factor, control_library_size, genomesize)
+    summary_file = file + '_' + name + '_island_summary.npy'
+    np.save(summary_file, summary_list)
+    return ((island_file, len(islands), print_return), summary_file)
+
+
+def sweep(args, chip_library_size, control_library_size, pool):
+    '''Finds the islands of every point of the grid, from the reads after redundancy removal'''
+    chroms = GenomeData.species_chroms[args.species]
+    window_sizes = [window_size for window_size in args.window_size if grid_points(args, window_size)]
+
+    print("Partition the genome in windows and generate summary files... \n")
+    total_tag_counts = run_make_graph_file_by_chrom.main(args, pool, window_sizes=window_sizes)
+    print("\n")
+
+    # The tag windows of a pyramid are only kept while its window sizes are swept
+    pyramids = run_make_graph_file_by_chrom.pyramid_bases(window_sizes)
+    for base in dict.fromkeys(pyramids[window_size] for window_size in window_sizes):
+        with shared_arrays.SharedArrays() as shared_blocks:
+            if (args.control_file is not None):
+                tag_windows = count_tag_windows(args, base, pool, shared_blocks)
+            else:
+                tag_windows = [None] * len(chroms)
+            for window_size in window_sizes:
+                if pyramids[window_size] == base:
+                    sweep_window_size(args, window_size, total_tag_counts[window_size], chip_library_size,
+                                      control_library_size, tag_windows, pool)
+
+
+def point_arguments(args, window_size, gap_size, e_value):
+    '''Returns the arguments of a SICER run with the parameters of a point, writing in the directory of the point'''
+    point_args = copy.copy(args)
+    point_args.window_size = window_size
+    point_args.gap_size = gap_size
+    point_args.e_value = e_value
+    point_args.output_directory = os.path.join(args.output_directory, point_name(window_size, gap_size, e_value))
+    if not os.path.exists(point_args.output_directory):
+        os.makedirs(point_args.output_directory)
+    return point_args
+
+
+def sweep_window_size(args, window_size, total_tag_in_windows, chip_library_size, control_library_size, tag_windows,
+                      pool):
+    '''
+    Finds the islands of every point of the grid of a window size and writes their output files.
+    total_tag_in_windows: the total tag count of the graph of the window size
+    tag_windows: the tag counts of the windows of each chromosome, from count_tag_windows
+    '''
+    chroms = GenomeData.species_chroms[args.species]
+    treatment_name = args.treatment_file.replace('.bed', '')
+    points = grid_points(args, window_size)
+    list_of_point_args = [point_arguments(args, window_size, gap_size, e_value) for (gap_size, e_value) in points]
+    window_args = list_of_point_args[0]
+
+    # The graph of the window size, from the pyramid, is read from the name of the graph of a SICER run
+    for chrom in chroms:
+        os.replace(run_make_graph_file_by_chrom.graph_file_name(window_args, False, chrom, window_size),
+                   run_make_graph_file_by_chrom.graph_file_name(window_args, False, chrom))
+
+    # The WIG file only depends on the window size
+    print("Normalizing graphs by total island filitered reads per million and generating summary WIG file...\n")
+    output_WIG_name = treatment_name + "-W" + str(window_size) + "-normalized.wig"
+    make_normalized_wig.main(window_args, output_WIG_name, pool)
+    WIG_names = [output_WIG_name]
+    if (args.binary_tracks):
+        WIG_names.append(output_WIG_name.replace('.wig', '.bw'))
+    for point_args in list_of_point_args[1:]:
+        for WIG_name in WIG_names:
+            shutil.copyfile(os.path.join(window_args.output_directory, WIG_name),
+                            os.path.join(point_args.output_directory, WIG_name))
+
+    library_scaling = None
+    if (args.control_file is not None):
+        (scaling_factor, genomesize) = associate_tags_with_chip_and_control_w_fc_q.library_scaling(
+            window_args, chip_library_size, control_library_size)
+        library_scaling = (scaling_factor, control_library_size, genomesize)
+        print("\n")
+
+    grid = []
+    for point_args in list_of_point_args:
+        print("Finding candidate islands exhibiting clustering with window size", window_size, ", gap size",
+              point_args.gap_size, "and E-value", point_args.e_value, "...\n")
+        (min_tags_in_window, score_threshold, average) = find_islands_in_pr.island_thresholds(point_args,
+                                                                                             total_tag_in_windows)
+        print("\n")
+        score_table = find_islands_in_pr.window_score_table(min_tags_in_window, average, max(500, int(2 * average)))
+        grid.append((point_name(window_size, point_args.gap_size, point_args.e_value), point_args.gap_size,
+                     min_tags_in_window, score_threshold, average, score_table))
+
+    # The islands of all the points and chromosomes in one pass over the pool
+    find_and_count_partial = partial(find_and_count_islands_of_point, window_args, library_scaling)
+    graph_costs = scheduler.file_costs([treatment_name + '_' + chrom + '_graph.npy' for chrom in chroms])
+    results = scheduler.starmap_by_cost(pool, find_and_count_partial,
+                                        [(point, chrom, tag_windows[i]) for point in grid
+                                         for (i, chrom) in enumerate(chroms)],
+                                        graph_costs * len(grid))
+
+    for (point_index, point_args) in enumerate(list_of_point_args):
+        point_results = results[point_index * len(chroms):(point_index + 1) * len(chroms)]
+        print("Islands of", grid[point_index][0], "\n")
+        find_islands_in_pr.write_scoreisland(point_args, chroms, [result[0] for result in point_results])
+        print("\n")
+        if (args.control_file is None):
+            continue
+        summary_files = [result[1] for result in point_results]
+        associate_tags_with_chip_and_control_w_fc_q.write_island_summaries(point_args, chroms, summary_files)
+        print("\n")
+        for false_discovery_rate in args.false_discovery_rate:
+            fdr_args = copy.copy(point_args)
+            fdr_args.false_discovery_rate = false_discovery_rate
+            island_files = [(summary_file, summary_file.replace('.npy', '_FDR' + str(false_discovery_rate) + '.npy'))
+                            for summary_file in summary_files]
+            significant_read_count = filter_islands_by_significance.main(fdr_args, 7, pool, island_files)
+            print("Out of the ", chip_library_size, " reads in ", args.treatment_file, ", ",
+                  significant_read_count, " reads are in significant islands\n")
@@ -4,84 +4,70 @@
 
 import multiprocessing as mp
 import os
-import re
 import sys
-import subprocess
 from functools import partial
 import numpy as np
 
 from sicer.lib import GenomeData
-
-'''Filters redundant reads according to the cutoff value by taking a sorted list and comparing adjacent reads'''
-
-
-def remove_redundant_1chrom_single_strand_sorted(reads, cutoff):
-    current_start = 0
-    current_end = 0
-    current_count = 1
-    total = 0
-    retained = 0
-    mask = []
-
-    for i, read in enumerate(reads):
-        total += 1
-        start = read[1]
-        end = read[2]
-        if start != current_start:
-            retained += 1
-            current_start = start
-            current_end = end
-            current_count = 1
-        elif end != current_end:
-            retained += 1
-            current_start = start
-            current_end = end
-            current_count = 1
-        else:
-            current_count += 1
-            if current_count <= cutoff:
-                retained += 1
-            else:
-                mask.append(i)
-
-    return (total, retained, mask)
+from sicer.lib import scheduler
+from sicer.lib import Utility
+from sicer.lib import bam_reader
+from sicer.lib import bed_reader
+from sicer.lib import bgzf
+from sicer.lib import library_cache
+from sicer.lib import read_store
+
+# Memory used per read by redundancy removal: the read, its key, the sorted key and the ranks
+bytes_per_read = 48
+
+'''Filters redundant reads according to the cutoff value by taking a sorted list and comparing adjacent reads.
+    keys: sorted keys (see read_store.sort_keys) of the reads of a single strand.
+    Copies of the same read are adjacent in the sorted list and form a run. Every read is ranked within its run,
+    and up to cutoff copies (at least one) of each read are retained.
+    previous_copies: number of copies of the first read already seen, when the keys continue an earlier list.
+    Returns the number of reads, the number of retained reads and a boolean mask of the retained reads.'''
+
+
+def remove_redundant_1chrom_single_strand_sorted(keys, cutoff, previous_copies=0):
+    total = len(keys)
+    if total == 0:
+        return (0, 0, np.ones(0, dtype=bool))
+
+    new_run = np.empty(total, dtype=bool)
+    new_run[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=new_run[1:])
+    run_starts = np.flatnonzero(new_run)
+    rank = np.arange(total) - run_starts[np.cumsum(new_run) - 1]
+    if previous_copies:
+        first_run_end = run_starts[1] if len(run_starts) > 1 else total
+        rank[:first_run_end] += previous_copies
+    keep = rank < max(cutoff, 1)
+    retained = int(np.count_nonzero(keep))
+
+    return (total, retained, keep)
 
 
 '''Separates reads by positive and negative strands before filtering redudant reads.
-    Saves the filtered reads as a numpy binary file in temporary directory created in run_SICER.
-    This is because python cannot pass extremely large objects between parallel processes'''
+    Reads with any other strand symbol are counted with the negative strand.
+    Returns the message of the chromosome and the filtered reads, sorted by strand, start and end.'''
 
 
-def strand_broken_remove(chrom, cutoff, file, chrom_reads):
+def strand_broken_remove(chrom, cutoff, chrom_reads):
     # Use of multiprocessing means print statements will be out of order. Use print_return to hold them until the end
     print_return = ""
-    #plus_reads = []
-    #minus_reads = []
-    #for read in chrom_reads:
-    #    if (read[5] == '+'):
-    #        plus_reads.append(read)
-    #    elif (read[5] == '-'):
-    #        minus_reads.append(read)
-    #if (not plus_reads):
-    #    sys.stderr.write(chrom + " + reads do not exist in " + file + "\n")
-    #if (not minus_reads):
-    #    sys.stderr.write(chrom + " - reads do not exist in " + file + "\n")
-
-    #plus_reads = sorted(plus_reads, key=lambda x: (x[1], x[2]))
-    #minus_reads = sorted(minus_reads, key=lambda x: (x[1], x[2]))
-
-    sorted_reads = np.sort(chrom_reads, order=['strand','start','end'])
-    mark = 0
-    for i in range(len(sorted_reads)):
-        if sorted_reads[i][5] != '+':
-            mark = i
-            break
-
-    (p_total, p_retained, p_mask) = remove_redundant_1chrom_single_strand_sorted(sorted_reads[:mark], cutoff)
-    (m_total, m_retained, m_mask) = remove_redundant_1chrom_single_strand_sorted(sorted_reads[mark:], cutoff)
-    m_mask = [m_mask[i]+mark for i in range(len(m_mask))]
-    mask = p_mask + m_mask
-    filtered_reads = np.delete(sorted_reads, obj=mask)
+    totals = {}
+    filtered_reads = []
+    for strand in (read_store.PLUS, read_store.MINUS, read_store.OTHER):
+        # A read is fully described by its key within a strand, so the keys are sorted instead of the reads
+        keys = np.sort(read_store.sort_keys(chrom_reads[chrom_reads['strand'] == strand]))
+        (total, retained, keep) = remove_redundant_1chrom_single_strand_sorted(keys, cutoff)
+        totals[strand] = (total, retained)
+        filtered_reads.append(read_store.from_sort_keys(keys[keep], strand))
+    filtered_reads = np.concatenate(filtered_reads)
+
+    (p_total, p_retained) = totals[read_store.PLUS]
+    m_total = totals[read_store.MINUS][0] + totals[read_store.OTHER][0]
+    m_retained = totals[read_store.MINUS][1] + totals[read_store.OTHER][1]
     #print_return += (chrom + "\tPlus reads: " + str(p_total) + "\t\tRetained plus reads: " + str(
     #    p_retained) + "\tMinus reads: "
     #                 + str(m_total) + "\tRetained minus reads: " + str(m_retained))
@@ -90,69 +76,377 @@ def strand_broken_remove(chrom, cutoff, file, chrom_reads):
 
     #filtered_output = filtered_plus_reads + filtered_minus_reads
     #np_filtered_output = np.array(filtered_output, dtype=object)
-    name_for_save = file + "_" + chrom + ".npy"
-    np.save(name_for_save, filtered_reads)
+    return (print_return, filtered_reads)
+
+
+'''Merges sorted runs of keys (saved as numpy binary files) and filters redundant reads,
+    holding at most about block_length keys of each run in memory at a time.
+    Every round takes, from each run, the keys up to the smallest last key of the loaded blocks,
+    so that the keys taken in a round all come before the keys left in the runs.
+    The copies of a read can still be split between two rounds, so the count of copies of the
+    last key of a round is carried to the next one.
+    Appends the retained keys to outfile (as read_store.read_dtype reads of the given strand)
+    and returns the number of reads and the number of retained reads.'''
+
+
+def merge_runs(run_files, cutoff, strand, block_length, outfile):
+    runs = [np.load(run_file, mmap_mode='r') for run_file in run_files]
+    positions = [0] * len(runs)
+    total = 0
+    retained = 0
+    last_key = None
+    last_copies = 0
+    while True:
+        active = [i for i in range(len(runs)) if positions[i] < len(runs[i])]
+        if not active:
+            break
+        blocks = [runs[i][positions[i]:positions[i] + block_length] for i in active]
+        threshold = min(block[-1] for block in blocks)
+        taken = []
+        for i, block in zip(active, blocks):
+            count = np.searchsorted(block, threshold, side='right')
+            taken.append(np.asarray(block[:count]))
+            positions[i] += count
+        keys = np.sort(np.concatenate(taken))
+
+        previous_copies = last_copies if keys[0] == last_key else 0
+        (round_total, round_retained, keep) = remove_redundant_1chrom_single_strand_sorted(keys, cutoff,
+                                                                                         previous_copies)
+        read_store.from_sort_keys(keys[keep], strand).tofile(outfile)
+        total += round_total
+        retained += round_retained
+
+        # keys[-1] is the threshold, so its copies may continue in the next round
+        last_copies = len(keys) - np.searchsorted(keys, keys[-1], side='left')
+        if keys[0] == keys[-1]:
+            last_copies += previous_copies
+        last_key = keys[-1]
+
+    return (total, retained)
+
+
+'''Sorts the keys of the reads of each strand and saves them as a run of external_strand_broken_remove.
+    run_files: dictionary of strand -> list of the run files saved so far, to which the new runs are added.'''
+
+
+def save_runs(reads, file, chrom, run_files):
+    for strand in run_files:
+        run_file = file + '_' + chrom + '_run' + str(len(run_files[strand])) + '_' + str(strand) + '.npy'
+        np.save(run_file, np.sort(read_store.sort_keys(reads[reads['strand'] == strand])))
+        run_files[strand].append(run_file)
+
+
+'''Bounded-memory version of strand_broken_remove, used when a chromosome has more than max_reads reads.
+    The reads of the part files are read max_reads at a time. The keys of each batch are sorted by strand
+    and saved to disk as a run, and the runs of each strand are then merged by merge_runs.
+    The output is identical to that of strand_broken_remove, but saved as <file>_<chrom>.npy.'''
+
+
+def external_strand_broken_remove(chrom, cutoff, file, part_files, max_reads):
+    strands = (read_store.PLUS, read_store.MINUS, read_store.OTHER)
+    run_files = {strand: [] for strand in strands}
+    batch = []
+    batch_length = 0
+    for part_file in part_files:
+        part = np.load(part_file, mmap_mode='r')
+        for start in range(0, len(part), max_reads):
+            reads = read_store.compact(part[start:start + max_reads])
+            if batch_length + len(reads) > max_reads:
+                save_runs(np.concatenate(batch), file, chrom, run_files)
+                batch = []
+                batch_length = 0
+            batch.append(reads)
+            batch_length += len(reads)
+        del part
+    if batch:
+        save_runs(np.concatenate(batch), file, chrom, run_files)
+
+    retained_file = file + '_' + chrom + '_retained.bin'
+    totals = {}
+    with open(retained_file, 'wb') as outfile:
+        for strand in strands:
+            block_length = max(max_reads // (2 * max(len(run_files[strand]), 1)), 1024)
+            totals[strand] = merge_runs(run_files[strand], cutoff, strand, block_length, outfile)
+            for run_file in run_files[strand]:
+                os.remove(run_file)
+
+    (p_total, p_retained) = totals[read_store.PLUS]
+    m_total = totals[read_store.MINUS][0] + totals[read_store.OTHER][0]
+    m_retained = totals[read_store.MINUS][1] + totals[read_store.OTHER][1]
+    print_return = ('{:<5s}{:^25d}{:^25d}{:^25d}{:^25d}'.format(chrom, p_total, p_retained, m_total, m_retained))
+
+    # Copy the retained reads into a numpy binary file, one block at a time
     total_retained = p_retained + m_retained
+    filtered_reads = np.lib.format.open_memmap(file + "_" + chrom + ".npy", mode='w+', dtype=read_store.read_dtype,
+                                               shape=(total_retained,))
+    with open(retained_file, 'rb') as infile:
+        for start in range(0, total_retained, max_reads):
+            block = np.fromfile(infile, dtype=read_store.read_dtype, count=max_reads)
+            filtered_reads[start:start + len(block)] = block
+    filtered_reads.flush()
+    del filtered_reads
+    os.remove(retained_file)
 
     return (print_return, total_retained)
 
 
-'''Opens the given file and greps all the reads of the given chromsome and stores them in a list of tuples
-    Tuple format: (chrom,start,end,name,score,strand)'''
+'''Concatenates the reads of the part files (at least one) into a single numpy binary file
+    without holding them all in memory.'''
 
 
-def match_by_chrom(file, chrom):
-    match = chrom + "[[:space:]]"
-    matched_reads = subprocess.Popen(['grep', match, file], stdout=subprocess.PIPE) #Use Popen so that if no matches are found, it doesn't throw an exception
-    chrom_reads = str(matched_reads.communicate()[0],'utf-8').splitlines()  # generates a list of each reads, which are represented by a string value
-    file_name = os.path.basename(file)
-    read_dtype = np.dtype([('chrom', 'U6'), ('start', np.int32), ('end', np.int32), ('name', 'U20'), ('score', 'U6'), ('strand', 'U1')])
-    processed_reads = np.empty(len(chrom_reads), dtype=read_dtype)
-
-    for i, reads in enumerate(chrom_reads):
-        reads = re.split('\t', reads)
-        if (len(reads) < 6):
-            sys.stderr.write(
-                "Error: Input BED files must have the first six fields. Check " + file_name + " to see if it has the following fields: chrom, chromStart, chromEnd, name, score, and strand\n")
+def concatenate_to_file(part_files, output_file):
+    parts = [np.load(part_file, mmap_mode='r') for part_file in part_files]
+    dtype = read_store.concatenate([np.empty(0, dtype=part.dtype) for part in parts]).dtype
+    output = np.lib.format.open_memmap(output_file, mode='w+', dtype=dtype, shape=(sum(len(part) for part in parts),))
+    start = 0
+    for part in parts:
+        output[start:start + len(part)] = part.astype(dtype)
+        start += len(part)
+    output.flush()
+    del output
+
+
+'''Parses the given lines of a BED file and separates their reads by chromosome.
+    The reads of each chromosome are saved as a numpy binary file in the temporary directory
+    so that the file only has to be read once for all chromosomes.
+    keep_bed_columns: also keep the name and score columns, which are needed to write the reads back in BED format.
+    Returns the list of (chromosome, part index) of the saved files and whether a malformed line was found.'''
+
+
+def shard_lines(file_name, chroms, keep_bed_columns, piece):
+    part_index, data = piece
+    (chrom_reads, malformed) = bed_reader.parse_lines(data, chroms, keep_bed_columns)
+    for chrom in chrom_reads:
+        np.save(file_name + '_' + chrom + '_part' + str(part_index) + '.npy', chrom_reads[chrom])
+    return ([(chrom, part_index) for chrom in chrom_reads], malformed)
+
+
+'''Reads the given byte range of the file and separates its reads by chromosome (see shard_lines).
+    compressed: the file is in BGZF format and the range is a range of its blocks.'''
+
+
+def shard_chunk(path_to_file, file_name, chroms, keep_bed_columns, compressed, chunk):
+    chunk_index, (start, end) = chunk
+    if compressed:
+        data = bed_reader.read_bgzf_chunk(path_to_file, start, end)
+    else:
+        data = bed_reader.read_chunk(path_to_file, start, end)
+    return shard_lines(file_name, chroms, keep_bed_columns, (chunk_index, data))
+
+
+'''Reads the alignments of a BAM file and separates them by chromosome, like shard_chunk.
+    reference_range: range of virtual offsets (from the BAI index) holding the alignments of one chromosome,
+            or None to read the whole file.
+    threads: number of threads decompressing the file.
+    The reads are saved in parts of about bgzf.batch_size bytes of decompressed data.
+    Returns the list of (chromosome, part index) of the saved files and whether the file could not be read.'''
+
+
+def shard_bam(path_to_file, file_name, reference_chroms, keep_bed_columns, threads, reference_range):
+    (start, end) = reference_range if reference_range is not None else (None, None)
+    parts = []
+    try:
+        for part_index, chrom_reads in enumerate(
+                bam_reader.iter_reads(path_to_file, reference_chroms, keep_bed_columns, start, end, threads)):
+            for chrom in chrom_reads:
+                np.save(file_name + '_' + chrom + '_part' + str(part_index) + '.npy', chrom_reads[chrom])
+                parts.append((chrom, part_index))
+    except ValueError:
+        return (parts, True)
+    return (parts, False)
+
+
+'''Separates the reads of a BAM file by chromosome. When the file has a BAI index, each process
+    reads the alignments of its own chromosome. Otherwise the file is read once, decompressing
+    its blocks with args.cpu threads.'''
+
+
+def shard_bam_file(args, path_to_file, file_name, chroms, keep_bed_columns, pool):
+    try:
+        references = bam_reader.read_references(path_to_file)
+    except ValueError:
+        return [([], True)]
+    reference_chroms = [reference if reference in chroms else None for reference in references]
+
+    index_file = bam_reader.find_index(path_to_file)
+    if index_file is not None:
+        ranges = bam_reader.reference_ranges(index_file)
+        if len(ranges) == len(references):
+            chrom_ranges = [ranges[i] for i, chrom in enumerate(reference_chroms)
+                            if chrom is not None and ranges[i] is not None]
+            shard_bam_partial = partial(shard_bam, path_to_file, file_name, reference_chroms, keep_bed_columns, 1)
+            return pool.map(shard_bam_partial, chrom_ranges)
+
+    return [shard_bam(path_to_file, file_name, reference_chroms, keep_bed_columns, args.cpu, None)]
+
+
+'''Gathers the reads of the given chromosome from every part saved while reading the file and then filters
+    redudant reads.
+    With keep_bed_columns, the reads are saved with their name and score columns as <file>_<chrom>_columns.npy
+    and only the compact reads go through redundancy removal.
+    max_reads: largest number of reads to hold in memory, or None for no limit.
+            Chromosomes with more reads are filtered by external_strand_broken_remove.
+    Returns the message of the chromosome, the filtered reads and whether they are already saved as
+    <file>_<chrom>.npy (memory-mapped) by external_strand_broken_remove.'''
+
+
+def filter_reads(file_name, cutoff, keep_bed_columns, max_reads, parts_by_chrom, chrom):
+    if keep_bed_columns:
+        empty_reads = np.empty(0, dtype=read_store.bed_columns_dtype(1, 1))
+    else:
+        empty_reads = np.empty(0, dtype=read_store.read_dtype)
+    part_files = [file_name + '_' + chrom + '_part' + str(part_index) + '.npy'
+                  for part_index in parts_by_chrom.get(chrom, [])]
+
+    if max_reads is not None and sum(len(np.load(part_file, mmap_mode='r')) for part_file in part_files) > max_reads:
+        if keep_bed_columns:
+            concatenate_to_file(part_files, file_name + '_' + chrom + '_columns.npy')
+        (print_return, total_retained) = external_strand_broken_remove(chrom, cutoff, file_name, part_files,
+                                                                       max_reads)
+        for part_file in part_files:
+            os.remove(part_file)
+        return (print_return, np.load(file_name + "_" + chrom + ".npy", mmap_mode='r'), True)
+
+    chrom_reads = [empty_reads]
+    for part_file_name in part_files:
+        chrom_reads.append(np.load(part_file_name))
+        os.remove(part_file_name)
+    chrom_reads = read_store.concatenate(chrom_reads)
+    if keep_bed_columns:
+        np.save(file_name + '_' + chrom + '_columns.npy', chrom_reads)
+        chrom_reads = read_store.compact(chrom_reads)
+    (print_return, filtered_reads) = strand_broken_remove(chrom, cutoff, chrom_reads)
+    return (print_return, filtered_reads, False)
+
+
+'''Function designed for handling multiprocessing. Filters the redundant reads of the given chromosome (see filter_reads)
+    and saves them as a numpy binary file in temporary directory created in run_SICER.
+    The reads are read again by several later steps, each memory-mapping the part it needs, so they are saved
+    rather than handed to the parent (see sicer.lib.shared_arrays for the arrays that are).'''
+
+
+def find_and_filter_reads(file_name, cutoff, keep_bed_columns, max_reads, parts_by_chrom, chrom):
+    (print_return, filtered_reads, saved) = filter_reads(file_name, cutoff, keep_bed_columns, max_reads,
+                                                         parts_by_chrom, chrom)
+    if not saved:
+        np.save(file_name + "_" + chrom + ".npy", filtered_reads)
+    return (print_return, len(filtered_reads))
+
+
+'''Reads the file once and splits its reads by chromosome, into part files in the temporary directory.
+    Returns the lists of the indices of the part files of each chromosome.'''
+
+
+def shard_file(args, path_to_file, file_name, chroms, keep_bed_columns, pool):
+    if bam_reader.is_bam(path_to_file):
+        shard_result = shard_bam_file(args, path_to_file, file_name, chroms, keep_bed_columns, pool)
+        format_error = ("Error: Cannot read BAM file " + os.path.basename(path_to_file)
+                        + ". Check if the file is complete and not corrupted.\n")
+    else:
+        if bgzf.is_bgzf(path_to_file):
+            # Blocks are decompressed by the processes parsing them
+            chunks = bed_reader.split_into_bgzf_chunks(path_to_file, args.cpu)
+            shard_chunk_partial = partial(shard_chunk, path_to_file, file_name, chroms, keep_bed_columns, True)
+            shard_result = pool.map(shard_chunk_partial, enumerate(chunks))
+        elif bed_reader.is_gzip(path_to_file):
+            # Decompression is sequential, but the pieces are parsed in parallel as they come
+            shard_lines_partial = partial(shard_lines, file_name, chroms, keep_bed_columns)
+            shard_result = list(pool.imap(shard_lines_partial, enumerate(bed_reader.iter_gzip_pieces(path_to_file))))
+        else:
+            chunks = bed_reader.split_into_chunks(path_to_file, args.cpu)
+            shard_chunk_partial = partial(shard_chunk, path_to_file, file_name, chroms, keep_bed_columns, False)
+            shard_result = pool.map(shard_chunk_partial, enumerate(chunks))
+        format_error = ("Error: Input BED files must have the first six fields. Check " + os.path.basename(path_to_file)
+                        + " to see if it has the following fields: chrom, chromStart, chromEnd, name, score, and strand\n")
+
+    parts_by_chrom = {}
+    for (parts, malformed) in shard_result:
+        if malformed:
+            sys.stderr.write(format_error)
             sys.exit(1)
-        reads[1] = int(reads[1])
-        reads[2] = int(reads[2])
-        processed_reads[i] = tuple(reads)
+        for (chrom, part_index) in parts:
+            parts_by_chrom.setdefault(chrom, []).append(part_index)
+    for chrom in parts_by_chrom:
+        parts_by_chrom[chrom].sort()
+    return parts_by_chrom
+
+
+def part_costs(file_name, parts_by_chrom, chroms):
+    '''Size of the part files of each chromosome'''
+    return [sum(os.path.getsize(file_name + '_' + chrom + '_part' + str(part_index) + '.npy')
+                for part_index in parts_by_chrom.get(chrom, [])) for chrom in chroms]
 
-    return processed_reads
 
+def max_reads_in_memory(args, chroms):
+    '''Divides the memory budget between the processes filtering chromosomes at the same time'''
+    if args.max_memory is None:
+        return None
+    return max(args.max_memory * 1024 * 1024 // (min(args.cpu, len(chroms)) * bytes_per_read), 1024)
+
+
+def print_read_counts(filtered_result):
+    print(('-' *105))
+    print(('{:<5s}{:^25s}{:^25s}{:^25s}{:^25s}'.format("chrom", "Total plus reads", "Retained plus reads", "Total minus reads", "Retained minus reads")))
+    print(('-' *105))
+    for result in filtered_result:
+        print(result[0])
 
-'''Function designed for handling multiprocessing. Separates all reads by chromosome
-    and then filters redudant reads'''
 
+def cached_library(args, path_to_file, file_name, chroms, keep_bed_columns):
+    '''
+    Links the reads of the library from the library cache (--library_cache) into the temporary directory, as if
+    they had been filtered and saved by find_and_filter_reads.
+    Returns the (message, number of retained reads) of each chromosome, or None if the library is not cached.
+    '''
+    if args.library_cache is None:
+        return None
+    parameters = library_cache.library_parameters(path_to_file, args.species, args.redundancy_threshold,
+                                                  keep_bed_columns)
+    filtered_result = library_cache.lookup(args.library_cache, parameters, file_name, chroms)
+    if filtered_result is not None:
+        print("The reads of", os.path.basename(path_to_file),
+              "after redundancy removal are taken from the library cache")
+    return filtered_result
 
-def find_and_filter_reads(path_to_file, cutoff, chrom):
-    file_name = os.path.basename(path_to_file)
-    file_name = file_name.replace('.bed', '')
 
-    chrom_reads = match_by_chrom(path_to_file, chrom)  # Separates all reads by chromosome
-    return strand_broken_remove(chrom, cutoff, file_name, chrom_reads)
+def cache_library(args, path_to_file, file_name, chroms, keep_bed_columns, filtered_result):
+    '''Stores the reads of the library saved in the temporary directory in the library cache (--library_cache)'''
+    if args.library_cache is None:
+        return
+    parameters = library_cache.library_parameters(path_to_file, args.species, args.redundancy_threshold,
+                                                  keep_bed_columns)
+    library_cache.store(args.library_cache, args.library_cache_size * 1024 * 1024, parameters, file_name, chroms,
+                        filtered_result)
 
 
-'''path_to_file: complete path to the .bed file that needs to processed for redudant reads'''
+'''path_to_file: complete path to the .bed, .bed.gz or .bam file that needs to processed for redudant reads
+    keep_bed_columns: keep the name and score columns of the reads so that they can be written back
+            in BED format (see filter_raw_tags_by_islands). Default value is False.'''
 
 
-def main(args, path_to_file, pool):
+def main(args, path_to_file, pool, keep_bed_columns=False):
     chroms = GenomeData.species_chroms[args.species];  # list of chromsomes of the given species
     cutoff = args.redundancy_threshold
-
-    # Use multiprocessing module to run parallel processes for each chromosome
-    #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
-    find_and_filter_reads_partial = partial(find_and_filter_reads, path_to_file, cutoff)
-    filtered_result = pool.map(find_and_filter_reads_partial, chroms)
-    #pool.close()
+    file_name = Utility.bed_file_name(os.path.basename(path_to_file)).replace('.bed', '')
+
+    filtered_result = cached_library(args, path_to_file, file_name, chroms, keep_bed_columns)
+    if filtered_result is None:
+        # Read the file once and split the reads by chromosome
+        parts_by_chrom = shard_file(args, path_to_file, file_name, chroms, keep_bed_columns, pool)
+        max_reads = max_reads_in_memory(args, chroms)
+
+        # Use multiprocessing module to run parallel processes for each chromosome
+        #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
+        find_and_filter_reads_partial = partial(find_and_filter_reads, file_name, cutoff, keep_bed_columns,
+                                                max_reads, parts_by_chrom)
+        read_costs = part_costs(file_name, parts_by_chrom, chroms)
+        filtered_result = scheduler.map_by_cost(pool, find_and_filter_reads_partial, chroms, read_costs)
+        #pool.close()
+        cache_library(args, path_to_file, file_name, chroms, keep_bed_columns, filtered_result)
 
     total_read_count = 0
-    print(('-' *105))
-    print(('{:<5s}{:^25s}{:^25s}{:^25s}{:^25s}'.format("chrom", "Total plus reads", "Retained plus reads", "Total minus reads", "Retained minus reads")))
-    print(('-' *105))
+    print_read_counts(filtered_result)
     for result in filtered_result:
-        print(result[0])
         total_read_count += result[1]
 
     return total_read_count
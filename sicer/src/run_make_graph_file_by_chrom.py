@@ -5,10 +5,13 @@
 import multiprocessing as mp
 from functools import partial
 from math import *
-import sys
 import numpy as np
 
 from sicer.lib import GenomeData
+from sicer.lib import island_store
+from sicer.lib import read_store
+from sicer.lib import scheduler
+from sicer.lib import shared_arrays
 
 
 def get_bed_coords(chrom_reads, chrom_length, fragment_size, chrom, verbose):
@@ -20,147 +23,175 @@ def get_bed_coords(chrom_reads, chrom_length, fragment_size, chrom, verbose):
     The stored positions are not the midpoint rather than the start
     The interface is no longer the same as that for getBedCoords(file)
     input:
-        file:  the file that has the raw tag data from one chromosome
+        chrom_reads: the reads of one chromosome (see sicer.lib.read_store)
         fragment_size: the fragment size after CHIP experiment.
     output:
-        return: a sorted list of positions which might have redundent entries
+        return: an array of positions, in no particular order, which might have redundent entries,
+        the numbers of positive and negative tags and the messages about the ilegitimate reads
     """
 
-    postive_tag_counts = 0
-    negative_tag_counts = 0
     shift = int(round(fragment_size / 2))
-    taglist = []
     print_return = ""
-    for read in chrom_reads:
-        chrom = read[0]
-        start = read[1]
-        end = read[2]
-        name = read[3]
-        score = read[4]
-        strand = read[5]
-        if (start < 0):
-            if verbose:
-                print_return += ("Ilegitimate read with start less than zero is ignored \n"
-                                 + chrom + "\t" + str(start) + "\t" + str(
-                            end) + "\t" + name + "\t" + str(score) + "\t" + strand + "\n")
-        elif (end >= chrom_length):
-            if verbose:
-                print_return += (
-                            "Ilegitimate read with end beyond chromosome length " + str(chrom_length) + " is ignored \n"
-                            + chrom + "\t" + str(start) + "\t" + str(
-                        end) + "\t" + name + "\t" + str(score) + "\t" + strand + "\n")
-        else:
-            if (strand == '+'):
-                position = start + shift
-                # If the position is beyond limit then don't shift.
-                if (position >= chrom_length):
-                    position = chrom_length - 1
-                taglist.append(position)
-                postive_tag_counts += 1
-
-            elif (strand == '-'):
-                position = end - 1 - shift
-                # in case the shift move the positions
-                # beyond zero, use zero
-                if (position < 0):
-                    position = 0  # UCSC genome coordinate is 0-based
-                taglist.append(position)
-                negative_tag_counts += 1
-    taglist.sort()
+    starts = chrom_reads['start'].astype(np.int64)
+    ends = chrom_reads['end'].astype(np.int64)
+    strands = chrom_reads['strand']
+
+    legitimate = (starts >= 0) & (ends < chrom_length)
+    # The ignored reads are printed without their name and score, which the reads no longer carry
+    if verbose:
+        for i in np.flatnonzero(~legitimate):
+            if (starts[i] < 0):
+                print_return += "Ilegitimate read with start less than zero is ignored \n"
+            else:
+                print_return += ("Ilegitimate read with end beyond chromosome length " + str(chrom_length)
+                                 + " is ignored \n")
+            print_return += (chrom + "\t" + str(starts[i]) + "\t" + str(ends[i]) + "\t"
+                             + read_store.strand_symbols[strands[i]] + "\n")
+
+    positive = legitimate & (strands == read_store.PLUS)
+    negative = legitimate & (strands == read_store.MINUS)
+    # If the position is beyond limit then don't shift.
+    positive_positions = np.minimum(starts[positive] + shift, chrom_length - 1)
+    # in case the shift move the positions beyond zero, use zero (UCSC genome coordinate is 0-based)
+    negative_positions = np.maximum(ends[negative] - 1 - shift, 0)
+    taglist = np.concatenate((positive_positions, negative_positions))
+
+    return (taglist, len(positive_positions), len(negative_positions), print_return)
 
+
+def tag_count_message(chrom, postive_tag_counts, negative_tag_counts, verbose):
     total_tag_counts = postive_tag_counts + negative_tag_counts
-    print_return += 'Total count of ' + chrom + ' tags: ' + str(total_tag_counts)
+    print_return = 'Total count of ' + chrom + ' tags: ' + str(total_tag_counts)
     if verbose:
         print_return += ('  ('+str(postive_tag_counts) + ' positive tags, ' + str(negative_tag_counts) + ' negative tags)')
-
-    return (taglist, print_return)
+    return print_return
 
 
 def Generate_windows_and_count_tags(taglist, chrom, chrom_length, window_size):
     """
-    taglist: sorted list of positions that includes every tag on a chromosome
+    taglist: array of positions that includes every tag on a chromosome, in any order
     window_size: the artificial bin size for binning the tags
-    bed_vals: a dictionary keyed by the start of tag_containing
-        windows, with value being the tag count in the window.
 
     In this function, the bins are set up using an absolute coordinate
     system.  Namely [0, window_size-1),[window_size,
     2*window_size-1). If the last window goes beyond the limit of the chromosome,
     that window is ignored.
 
-    The result writen into the file is guaranteed to be already sorted
-    within a chromosome.
+    Returns the windows containing tags (sicer.lib.island_store.window_dtype), sorted by start,
+    and the total number of tags in these windows.
     """
-    chrom_graph = []
-    total_tag_count = 0
+    # Every position is within the chromosome, so the windows can be counted in an array
+    counts = np.bincount(taglist // window_size, minlength=(chrom_length - 1) // window_size + 1)
+    # if the window goes beyond the chromsome limit, it is discarded.
+    num_windows = chrom_length // window_size
+    window_index = np.flatnonzero(counts[:num_windows])
+    window_starts = window_index * window_size
+
+    chrom_graph = np.empty(len(window_index), dtype=island_store.window_dtype)
+    chrom_graph['start'] = window_starts
+    chrom_graph['end'] = window_starts + window_size - 1
+    chrom_graph['count'] = counts[window_index]
+    total_tag_count = int(counts[window_index].sum())
+
+    return (chrom_graph, total_tag_count)
 
-    if (len(taglist) > 0):
-        current_window_start = (taglist[0] // window_size) * window_size
-        tag_count_in_current_window = 1
 
-        for i in range(1, len(taglist)):
-            start = (taglist[i] // window_size) * window_size
+def read_file_name(args, filtered, chrom):
+    file_name = args.treatment_file.replace('.bed', '') + '_' + chrom   # name of the ChIP-seq reads
+    if filtered:
+        return file_name + '_filtered.npy'
+    return file_name + '.npy'
 
-            if start == current_window_start:
-                tag_count_in_current_window += 1
 
-            elif start > current_window_start:
-                # All the tags in the previous window have been counted
-                current_window_end = current_window_start + window_size - 1
-                # if the window goes beyond the chromsome limit, it is discarded.
+def graph_file_name(args, filtered, chrom, window_size=None):
+    '''Name of the graph of a chromosome, or of one level of the pyramid of window sizes (see main)'''
+    file_name = args.treatment_file.replace('.bed', '') + '_' + chrom
+    if window_size is not None:
+        file_name += '_W' + str(window_size)
+    if filtered:
+        return file_name + '_filtered_graph.npy'
+    return file_name + '_graph.npy'
+
+
+# Window sizes share a pyramid only if the windows its tags are counted in are at least the smallest of them divided
+# by this ratio, so that a pyramid has at most this many times the windows of a graph of one of its sizes
+max_pyramid_ratio = 4
+
+
+def pyramid_bases(window_sizes):
+    '''
+    Returns the window size that the tags are counted in for each of the window sizes, which is a multiple of it.
+    The window sizes are grouped into pyramids, from the smallest one, and each pyramid is counted in windows of
+    the greatest common divisor of its sizes. A window size joins a pyramid only if the divisor stays at least
+    1/max_pyramid_ratio of the smallest size of the pyramid, so that window sizes without a large common divisor
+    (e.g. 200 and 333) are counted directly instead of in windows of a few bp.
+    '''
+    pyramids = []  # the [base, smallest window size, window sizes] of each pyramid
+    for window_size in sorted(set(window_sizes)):
+        for pyramid in pyramids:
+            base = gcd(pyramid[0], window_size)
+            if base * max_pyramid_ratio >= pyramid[1]:
+                pyramid[0] = base
+                pyramid[2].append(window_size)
+                break
+        else:
+            pyramids.append([window_size, window_size, [window_size]])
+    return {window_size: base for (base, smallest, sizes) in pyramids for window_size in sizes}
 
-                if current_window_end < chrom_length:
-                    # write the window to file
-                    output = (chrom, current_window_start, current_window_end, tag_count_in_current_window)
-                    chrom_graph.append(output)
-                    total_tag_count += tag_count_in_current_window
 
-                current_window_start = start
-                tag_count_in_current_window = 1
+def count_tags_in_windows(args, filtered, window_size, chrom, chrom_length, read_range):
+    '''Function for handling multiprocessing. Counts the tags of a range of the reads of a chromosome in windows.'''
+    chrom_reads = np.load(read_file_name(args, filtered, chrom), mmap_mode='r')[read_range[0]:read_range[1]]
 
-            else:
-                sys.stderr.write("Error!")
-                sys.exit(1)
+    (tag_list, postive_tag_counts, negative_tag_counts, print_return) = get_bed_coords(
+        chrom_reads, chrom_length, args.fragment_size, chrom, args.verbose)
 
-        current_window_end = current_window_start + window_size - 1
-        # if the window goes beyond the chromsome limit, it is discarded.
-        if current_window_end < chrom_length:
-            output = (chrom, current_window_start, current_window_end, tag_count_in_current_window)
-            chrom_graph.append(output)
-            total_tag_count += tag_count_in_current_window
+    chrom_graph, tag_count = Generate_windows_and_count_tags(tag_list, chrom, chrom_length, window_size)
+    return (shared_arrays.share(chrom_graph), postive_tag_counts, negative_tag_counts, print_return)
 
-    return (chrom_graph, total_tag_count)
 
+def combine_window_counts(chrom_graphs, window_size):
+    '''Adds up the counts of the windows of the graphs of separate ranges of the reads of a chromosome'''
+    if len(chrom_graphs) == 1:
+        return chrom_graphs[0]
+    windows = np.concatenate(chrom_graphs)
+    (window_starts, window_index) = np.unique(windows['start'], return_inverse=True)
+    counts = np.zeros(len(window_starts), dtype=np.int64)
+    np.add.at(counts, window_index, windows['count'])
 
-def makeGraphFile(args, filtered, chrom, chrom_length):
-    file = args.treatment_file.replace('.bed', '')  # removes the .bed extension
+    chrom_graph = np.empty(len(window_starts), dtype=island_store.window_dtype)
+    chrom_graph['start'] = window_starts
+    chrom_graph['end'] = window_starts + window_size - 1
+    chrom_graph['count'] = counts
+    return chrom_graph
 
-    bed_file_name = file + '_' + chrom   # name of the ChIP-seq reads
-    if filtered:
-        bed_file_name = bed_file_name + '_filtered.npy'
-    else:
-        bed_file_name = bed_file_name + '.npy'
 
-    chrom_reads = np.load(bed_file_name, allow_pickle=True)
+def coarsen_window_counts(chrom_graph, window_size, chrom_length):
+    '''
+    Adds up the counts of the windows of a graph into the windows of window_size, a multiple of the size of the
+    windows of the graph. As in Generate_windows_and_count_tags, the last window is discarded if it goes beyond
+    the chromosome, so the result is the same as counting the tags in windows of window_size.
+    '''
+    coarse_index = chrom_graph['start'] // window_size
+    # if the window goes beyond the chromsome limit, it is discarded. The graph is sorted by start.
+    coarse_index = coarse_index[coarse_index < chrom_length // window_size]
+    (window_index, first_windows) = np.unique(coarse_index, return_index=True)
 
-    tag_list, print_return = get_bed_coords(chrom_reads, chrom_length, args.fragment_size, chrom, args.verbose)
-    
-    chrom_graph, tag_count = Generate_windows_and_count_tags(tag_list, chrom, chrom_length, args.window_size)
+    coarse_graph = np.empty(len(window_index), dtype=island_store.window_dtype)
+    coarse_graph['start'] = window_index * window_size
+    coarse_graph['end'] = coarse_graph['start'] + window_size - 1
+    coarse_graph['count'] = np.add.reduceat(chrom_graph['count'][:len(coarse_index)], first_windows)
+    return coarse_graph
 
 
-    file_save_name = file + '_' + chrom
-    if filtered:
-        file_save_name += '_filtered_graph.npy'
-    else:
-        file_save_name += '_graph.npy'
-    
-    #graph_dtype = np.dtype([('chrom', 'U6'), ('start', np.int32), ('end', np.int32), ('count', np.int32)])
-    np_chrom_graph = np.array(chrom_graph, dtype=object)
-    np.save(file_save_name, np_chrom_graph)
-    return (tag_count, print_return)
+'''window_sizes: make pyramids of graphs, one graph for each of the window sizes, instead of the graph of
+    args.window_size. The tags are counted once for each pyramid, in windows of its base (see pyramid_bases), and each
+    level is the sum of the windows of the finest level below it that divides it. The levels are saved under
+    graph_file_name(args, filtered, chrom, window_size), and the total tag count of the windows of each window size
+    is returned in a dict.'''
 
 
-def main(args, pool, filtered=False):
+def main(args, pool, filtered=False, window_sizes=None):
     chroms = GenomeData.species_chroms[args.species]
     chrom_lengths = GenomeData.species_chrom_lengths[args.species]
 
@@ -172,15 +203,51 @@ def main(args, pool, filtered=False):
             print("Can not find the length of ", chrom)
         list_of_args.append((chrom, chrom_length))
 
-    # Use multiprocessing to partition the gneome in windows and generate the summary files in parallel processes
-    #pool = mp.Pool(processes=min(args.cpu, len(chroms)))
-    makeGraphFile_partial = partial(makeGraphFile, args, filtered)
-    makeGraphFile_result = pool.starmap(makeGraphFile_partial, list_of_args)
-    #pool.close()
+    # Use multiprocessing to partition the gneome in windows and count the tags in parallel processes.
+    # The reads of large chromosomes are split into ranges counted by separate processes.
+    read_counts = [len(np.load(read_file_name(args, filtered, chrom), mmap_mode='r')) for chrom in chroms]
+    reads_per_part = scheduler.part_size(sum(read_counts), args.cpu, scheduler.min_reads_per_part)
+    if window_sizes is None:
+        bases = [args.window_size]
+    else:
+        pyramids = pyramid_bases(window_sizes)
+        bases = sorted(set(pyramids.values()))
+    list_of_parts = []
+    for base in bases:
+        for (i, (chrom, chrom_length)) in enumerate(list_of_args):
+            for read_range in scheduler.split_range(read_counts[i], reads_per_part):
+                list_of_parts.append((i, (base, chrom, chrom_length, read_range)))
+    count_tags_partial = partial(count_tags_in_windows, args, filtered)
+    count_tags_result = scheduler.starmap_by_cost(pool, count_tags_partial, [part[1] for part in list_of_parts],
+                                                  [part[1][3][1] - part[1][3][0] for part in list_of_parts])
 
     total_tag_count = 0
-    for result in makeGraphFile_result:
-        total_tag_count += result[0]
-        print(result[1])
-
+    total_tag_counts = {level: 0 for level in (window_sizes or [])}
+    for (i, (chrom, chrom_length)) in enumerate(list_of_args):
+        results_of_bases = {base: [result for (part, result) in zip(list_of_parts, count_tags_result)
+                                   if part[0] == i and part[1][0] == base] for base in bases}
+        for base in bases:
+            with shared_arrays.SharedArrays() as received:
+                chrom_graph = combine_window_counts([received.receive(result[0]) for result in results_of_bases[base]],
+                                                    base)
+                if window_sizes is None:
+                    np.save(graph_file_name(args, filtered, chrom), chrom_graph)
+                    total_tag_count += int(chrom_graph['count'].sum())
+                    continue
+                levels = {base: chrom_graph}
+                for level in sorted(size for size in set(window_sizes) if pyramids[size] == base):
+                    finer_level = max([finer for finer in levels if level % finer == 0])
+                    if level != finer_level:
+                        levels[level] = coarsen_window_counts(levels[finer_level], level, chrom_length)
+                    np.save(graph_file_name(args, filtered, chrom, level), levels[level])
+                    total_tag_counts[level] += int(levels[level]['count'].sum())
+
+        # The reads are the same for every pyramid, so are the tag counts and messages of their parts
+        results = results_of_bases[bases[0]]
+        print_return = ''.join([result[3] for result in results])
+        print(print_return + tag_count_message(chrom, sum([result[1] for result in results]),
+                                               sum([result[2] for result in results]), args.verbose))
+
+    if window_sizes is not None:
+        return total_tag_counts
     return (total_tag_count)
@@ -0,0 +1,31 @@
+"""Converts a BED file of reads to a BAM file on the chromosomes of a species, for the runs of test.sh"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'unit'))
+
+import bgzf_files
+from sicer.lib import GenomeData
+
+
+def main(bed_file, bam_file, species):
+    chroms = GenomeData.species_chroms[species]
+    chrom_lengths = GenomeData.species_chrom_lengths[species]
+    reference_ids = {chrom: reference_id for (reference_id, chrom) in enumerate(chroms)}
+    records = [[] for chrom in chroms]
+    with open(bed_file) as infile:
+        for line in infile:
+            (chrom, start, end, name, score, strand) = line.split()[:6]
+            if chrom not in reference_ids:
+                continue
+            records[reference_ids[chrom]].append(bgzf_files.bam_record(
+                reference_ids[chrom], int(start), name, min(int(score), 255), 0x10 if strand == '-' else 0,
+                [(int(end) - int(start), 'M')]))
+    header = bgzf_files.bam_header([(chrom, chrom_lengths[chrom]) for chrom in chroms])
+    with open(bam_file, 'wb') as outfile:
+        outfile.write(bgzf_files.bgzf_compress(header + b''.join(b''.join(chrom_records) for chrom_records in records)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,24 @@
+"""
+Writes a larger library made of copies of the reads of a BED file, for the run of test.sh with a memory budget.
+
+Each copy of a read is shifted by its copy number, except every third copy, which is a duplicate of the read under
+another name. With 50 copies, the biggest chromosome of test/treatment_1.bed has more reads than fit in a budget of
+1 MB on one process (about 21800), so redundancy removal sorts them in pieces on disk and merges them.
+"""
+
+import sys
+
+
+def main(bed_file, output_file, copies):
+    with open(bed_file) as infile:
+        reads = [line.split()[:6] for line in infile if line.strip()]
+    with open(output_file, 'w') as outfile:
+        for copy in range(int(copies)):
+            shift = 0 if copy % 3 == 0 else copy
+            for (chrom, start, end, name, score, strand) in reads:
+                outfile.write('\t'.join([chrom, str(int(start) + shift), str(int(end) + shift),
+                                         name + '_' + str(copy), score, strand]) + '\n')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -9,10 +9,48 @@ sicer_df -t ./test/treatment_1.bed ./test/treatment_2.bed -c ./test/control_1.be
 
 recognicer_df -t ./test/treatment_1.bed ./test/treatment_2.bed -c ./test/control_1.bed ./test/control_2.bed -s hg38 --significant_reads
 
-if python3 ./test/travisCI/compare.py; then
-	echo "Test success"
-	exit 0
-else
+if ! python3 ./test/travisCI/compare.py; then
 	echo "Test failed"
 	exit 1
 fi
+
+#Unit tests, with the extension built in place for the package of the repository
+python3 setup.py build_ext --inplace
+if ! python3 -m unittest discover -s ./test/unit; then
+	echo "Unit tests failed"
+	exit 1
+fi
+
+#The other ways of running SICER write the same files as the default run
+runs=./test/travisCI/runs
+mkdir -p $runs
+gzip -c ./test/treatment_1.bed > $runs/treatment_1.bed.gz
+gzip -c ./test/control_1.bed > $runs/control_1.bed.gz
+python3 ./test/travisCI/bed_to_bam.py ./test/treatment_1.bed $runs/treatment_1.bam hg38
+python3 ./test/travisCI/bed_to_bam.py ./test/control_1.bed $runs/control_1.bam hg38
+python3 ./test/travisCI/enlarge_library.py ./test/treatment_1.bed $runs/treatment_large.bed 50
+python3 ./test/travisCI/enlarge_library.py ./test/control_1.bed $runs/control_large.bed 50
+
+sicer -t ./test/treatment_1.bed -c ./test/control_1.bed -s hg38 -o $runs/default
+sicer -t ./test/treatment_1.bed -c ./test/control_1.bed -s hg38 --fused -o $runs/fused
+sicer -t $runs/treatment_1.bed.gz -c $runs/control_1.bed.gz -s hg38 -o $runs/bed_gz
+sicer -t $runs/treatment_1.bam -c $runs/control_1.bam -s hg38 -o $runs/bam
+sicer_sweep -t ./test/treatment_1.bed -c ./test/control_1.bed -s hg38 -w 200 -g 600 -e 1000 -o $runs/sweep
+#The large libraries do not fit in the memory budget, so their reads are sorted in pieces on disk and merged
+sicer -t $runs/treatment_large.bed -c $runs/control_large.bed -s hg38 -rt 2 --significant_reads -o $runs/large
+sicer -t $runs/treatment_large.bed -c $runs/control_large.bed -s hg38 -rt 2 --significant_reads --max_memory 1 -o $runs/max_memory
+
+for run in fused bed_gz bam sweep/W200-G600-E1000; do
+	if ! diff -r $runs/default $runs/$run; then
+		echo "Test failed: $run"
+		exit 1
+	fi
+done
+
+if ! diff -r $runs/large $runs/max_memory; then
+	echo "Test failed: max_memory"
+	exit 1
+fi
+
+echo "Test success"
+exit 0
@@ -0,0 +1,71 @@
+"""Small BGZF, BAM and BAI files for the tests, written without external tools"""
+
+import struct
+import zlib
+
+# BGZF end-of-file marker, an empty block
+eof_block = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+cigar_codes = {'M': 0, 'I': 1, 'D': 2, 'N': 3, 'S': 4, 'H': 5, 'P': 6, '=': 7, 'X': 8}
+
+
+def bgzf_block(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed_data = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, len(compressed_data) + 25)
+    return header + compressed_data + struct.pack('<2I', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+def bgzf_compress(data, block_data_size=0xff00):
+    """Returns the BGZF file of data, in blocks of block_data_size bytes of data"""
+    blocks = [bgzf_block(data[i:i + block_data_size]) for i in range(0, len(data), block_data_size)]
+    return b''.join(blocks) + eof_block
+
+
+def bam_header(references):
+    """references: list of (name, length)"""
+    text = b'@HD\tVN:1.6\n'
+    header = b'BAM\x01' + struct.pack('<i', len(text)) + text + struct.pack('<i', len(references))
+    for (name, length) in references:
+        header += struct.pack('<i', len(name) + 1) + name.encode() + b'\x00' + struct.pack('<i', length)
+    return header
+
+
+def bam_record(reference_id, position, name, mapping_quality, flag, cigar):
+    """cigar: list of (length, operation), such as [(10, 'M'), (2, 'I')]. The record has no sequence."""
+    read_name = name.encode() + b'\x00'
+    body = struct.pack('<iiBBHHHiiii', reference_id, position, len(read_name), mapping_quality, 4680, len(cigar),
+                       flag, 0, -1, -1, 0)
+    body += read_name + b''.join(struct.pack('<I', length << 4 | cigar_codes[operation])
+                                 for (length, operation) in cigar)
+    return struct.pack('<i', len(body)) + body
+
+
+def bam_file(references, records_by_reference):
+    """
+    Returns the BAM file of the records of each reference, and the (start, end) virtual offsets of the records of
+    each reference. The header and the records of each reference are in blocks of their own.
+    """
+    blocks = [bgzf_block(bam_header(references))]
+    offset = len(blocks[0])
+    ranges = []
+    for records in records_by_reference:
+        if not records:
+            ranges.append(None)
+            continue
+        blocks.append(bgzf_block(b''.join(records)))
+        ranges.append((offset << 16, (offset + len(blocks[-1])) << 16))
+        offset += len(blocks[-1])
+    return (b''.join(blocks) + eof_block, ranges)
+
+
+def bai_file(ranges):
+    """Returns a BAI index with only the pseudo-bin of each reference, holding its range of virtual offsets"""
+    index = b'BAI\x01' + struct.pack('<i', len(ranges))
+    for reference_range in ranges:
+        if reference_range is None:
+            index += struct.pack('<ii', 0, 0)
+        else:
+            index += struct.pack('<iIi', 1, 37450, 2) + struct.pack('<4Q', reference_range[0], reference_range[1], 0, 0)
+            index += struct.pack('<i', 0)
+    return index
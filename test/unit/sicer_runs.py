@@ -0,0 +1,42 @@
+"""Small libraries on the pombe genome, and runs of the SICER scripts on them, for the tests of whole runs"""
+
+import filecmp
+import os
+import subprocess
+import sys
+
+repo_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+chrom_lengths = {'chr1': 5580032, 'chr2': 4541604, 'chr3': 2453783}
+
+enriched_regions = [('chr1', 100000), ('chr1', 2000000), ('chr2', 500000), ('chr3', 1000000)]
+
+# The scripts leave one CPU for I/O, so they need at least two
+enough_cpus = os.cpu_count() >= 2
+
+
+def write_library(path, random, count, enriched_regions):
+    """Writes a BED file of reads on the chromosomes of pombe, a part of them in the enriched regions"""
+    with open(path, 'w') as outfile:
+        for i in range(count):
+            if enriched_regions and random.rand() < 0.3:
+                (chrom, region_start) = enriched_regions[random.randint(len(enriched_regions))]
+                start = region_start + random.randint(0, 3000)
+            else:
+                chrom = random.choice(sorted(chrom_lengths))
+                start = random.randint(0, chrom_lengths[chrom] - 36)
+            outfile.write('\t'.join([chrom, str(start), str(start + 36), 'read' + str(i), '0',
+                                     random.choice(['+', '-'])]) + '\n')
+
+
+def run(script, arguments, cwd):
+    """Runs a script of bin with the package of the repository, on the pombe genome"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([repo_path, os.environ.get('PYTHONPATH', '')]))
+    subprocess.run([sys.executable, os.path.join(repo_path, 'bin', script), '-s', 'pombe', '-cpu', '2',
+                    '--no_cache'] + list(arguments), check=True, env=env, stdout=subprocess.DEVNULL, cwd=cwd)
+
+
+def different_files(directory, other_directory, file_names):
+    """Returns the files that differ between the directories, or are missing from one of them"""
+    (match, mismatch, errors) = filecmp.cmpfiles(directory, other_directory, file_names, shallow=False)
+    return mismatch + errors
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+import scipy.stats
+
+from sicer.lib import island_store
+from sicer.src import associate_tags_with_chip_and_control_w_fc_q
+
+scaling_factor = 1.5
+control_library_size = 20000
+genomesize = 1.0e7
+
+
+def loop_statistics(island_list, chip_readcounts, control_readcounts):
+    '''The p-values and fold changes of the islands of the first versions, one island at a time'''
+    statistics = []
+    for index in range(len(island_list)):
+        island = island_list[index]
+        observation_count = chip_readcounts[index]
+        control_count = control_readcounts[index]
+        if (control_count > 0):
+            average = control_count * scaling_factor
+        else:
+            length = int(island['end']) - int(island['start']) + 1
+            average = length * control_library_size * 1.0 / genomesize
+            average = min(0.25, average) * scaling_factor
+        fc = float(observation_count) / float(average)
+        if (observation_count > average):
+            pvalue = scipy.stats.poisson.sf(observation_count, average)
+        else:
+            pvalue = 1
+        statistics.append((pvalue, fc))
+    return statistics
+
+
+class IslandStatisticsTest(unittest.TestCase):
+
+    def summary(self, island_list, chip_readcounts, control_readcounts):
+        summary_list = associate_tags_with_chip_and_control_w_fc_q.island_summary(
+            island_list, np.array(chip_readcounts), np.array(control_readcounts), scaling_factor,
+            control_library_size, genomesize)
+        return [(island['pvalue'], island['fold_change']) for island in summary_list]
+
+    def test_zero_control_counts(self):
+        # A short island whose background is below a quarter window, and a long one capped at a quarter window
+        island_list = np.array([(0, 199, 0), (1000, 200999, 0), (300000, 300199, 0)],
+                               dtype=island_store.island_dtype)
+        (chip_readcounts, control_readcounts) = ([3, 3, 0], [0, 0, 0])
+        statistics = self.summary(island_list, chip_readcounts, control_readcounts)
+        self.assertEqual(statistics, loop_statistics(island_list, chip_readcounts, control_readcounts))
+        self.assertEqual(statistics[1][1], 3 / (0.25 * scaling_factor))
+        # Islands without reads are not enriched
+        self.assertEqual(statistics[2], (1, 0))
+
+    def test_same_as_loop(self):
+        random = np.random.RandomState(17)
+        starts = np.cumsum(random.randint(1, 20, 3000)) * 200
+        island_list = np.zeros(len(starts), dtype=island_store.island_dtype)
+        island_list['start'] = starts
+        island_list['end'] = starts + random.randint(1, 10, len(starts)) * 200 - 1
+        chip_readcounts = random.poisson(6, len(starts))
+        control_readcounts = random.poisson(3, len(starts))
+        # Islands with exactly the scaled control read count, which are not enriched
+        control_readcounts[::7] = 2 * random.randint(1, 5, len(starts[::7]))
+        chip_readcounts[::7] = control_readcounts[::7] * 3 // 2
+        self.assertEqual(self.summary(island_list, chip_readcounts, control_readcounts),
+                         loop_statistics(island_list, chip_readcounts, control_readcounts))
+
+    def test_no_islands(self):
+        (pvalue, fc) = associate_tags_with_chip_and_control_w_fc_q.island_statistics(
+            np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), scaling_factor,
+            control_library_size, genomesize)
+        self.assertEqual((len(pvalue), len(fc)), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
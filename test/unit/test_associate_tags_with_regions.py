@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+
+from sicer.lib import associate_tags_with_regions
+from sicer.lib import island_store
+from sicer.lib import read_store
+
+fragment_size = 150
+shift = 75
+
+
+def reads_at(positions, strand):
+    '''Reads of the given strand whose tags (see associate_tags_with_regions.tag_position) are at the positions'''
+    reads = np.empty(len(positions), dtype=read_store.read_dtype)
+    if strand == read_store.PLUS:
+        reads['start'] = np.asarray(positions) - shift
+        reads['end'] = reads['start'] + 36
+    else:
+        reads['end'] = np.asarray(positions) + 1 + shift
+        reads['start'] = reads['end'] - 36
+    reads['strand'] = strand
+    return reads
+
+
+def loop_readcounts(islands, reads):
+    '''The read counts of the islands of the first versions, one read at a time'''
+    island_start_list = islands['start'].tolist()
+    island_end_list = islands['end'].tolist()
+    readcounts = [0] * len(islands)
+    for read in reads:
+        position = associate_tags_with_regions.tag_position(read, fragment_size)
+        if position is None:
+            continue
+        index = associate_tags_with_regions.find_readcount_on_islands(island_start_list, island_end_list, position)
+        if index >= 0:
+            readcounts[index] += 1
+    return readcounts
+
+
+class ReadcountTest(unittest.TestCase):
+
+    def setUp(self):
+        self.islands = np.array([(1000, 1599, 0), (2200, 2399, 0), (2400, 3199, 0), (9000, 9199, 0)],
+                                dtype=island_store.island_dtype)
+
+    def test_reads_on_borders(self):
+        # Tags on the first and last base of each island, and just outside of them
+        positions = np.concatenate((self.islands['start'], self.islands['end'], self.islands['start'] - 1,
+                                    self.islands['end'] + 1))
+        for strand in (read_store.PLUS, read_store.MINUS):
+            reads = reads_at(positions, strand)
+            island_index = associate_tags_with_regions.find_islands_of_positions(
+                self.islands['start'], self.islands['end'], associate_tags_with_regions.tag_positions(
+                    reads, fragment_size)[0])
+            # The islands at 2200 and 2400 are adjacent, so a tag just outside of one of them is on the other
+            self.assertEqual(island_index.tolist(), [0, 1, 2, 3, 0, 1, 2, 3, -1, -1, 1, -1, -1, 2, -1, -1])
+            readcounts = associate_tags_with_regions.find_readcount_of_islands(self.islands['start'],
+                                                                               self.islands['end'], reads,
+                                                                               fragment_size)
+            self.assertEqual(readcounts.tolist(), [2, 3, 3, 2])
+            self.assertEqual(readcounts.tolist(), loop_readcounts(self.islands, reads))
+
+    def test_same_as_loop(self):
+        random = np.random.RandomState(15)
+        reads = np.empty(5000, dtype=read_store.read_dtype)
+        reads['start'] = random.randint(0, 10000, len(reads))
+        reads['end'] = reads['start'] + 36
+        reads['strand'] = random.choice([read_store.PLUS, read_store.MINUS, read_store.OTHER], len(reads))
+        readcounts = associate_tags_with_regions.find_readcount_of_islands(self.islands['start'],
+                                                                           self.islands['end'], reads, fragment_size)
+        self.assertEqual(readcounts.tolist(), loop_readcounts(self.islands, reads))
+        # Reads on neither strand have no position and are not counted
+        self.assertLess(readcounts.sum(), len(reads))
+
+    def test_no_islands(self):
+        islands = np.empty(0, dtype=island_store.island_dtype)
+        readcounts = associate_tags_with_regions.find_readcount_of_islands(islands['start'], islands['end'],
+                                                                           reads_at([5, 10], read_store.PLUS),
+                                                                           fragment_size)
+        self.assertEqual(len(readcounts), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
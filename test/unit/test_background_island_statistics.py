@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+
+from sicer.lib import Background_island_probscore_statistics
+
+
+class LoopBackground(Background_island_probscore_statistics.Background_island_probscore_statistics):
+    '''The island expectations of the first versions, computed one bin at a time'''
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.island_expectation = self.island_expectation.tolist()
+
+    def background_island_expectation(self, scaled_score):
+        current_max_scaled_score = len(self.island_expectation) - 1
+        if scaled_score > current_max_scaled_score:
+            for index in range(current_max_scaled_score + 1, scaled_score + 1):
+                temp = 0.0
+                i = self.min_tags_in_window
+                while (int(round(index - self.window_score[i] / self.bin_size)) >= 0):
+                    temp += self.poisson_value[i] * self.island_expectation[
+                        int(round(index - self.window_score[i] / self.bin_size))]
+                    i += 1
+                temp *= self.gap_contribution
+                self.island_expectation.append(temp)
+        return self.island_expectation[scaled_score]
+
+    def generate_cumulative_dist(self, outfile=""):
+        self.cumulative = [0] * len(self.island_expectation)
+        partial_sum = 0.0
+        for index in range(1, len(self.island_expectation) + 1):
+            complimentary = len(self.island_expectation) - index
+            partial_sum += self.island_expectation[complimentary]
+            self.cumulative[complimentary] = partial_sum
+        self.cumulative = np.array(self.cumulative)
+
+
+class IslandThresholdTest(unittest.TestCase):
+    '''The island score thresholds are the same as those of the bin by bin recurrence'''
+
+    def test_same_as_loop(self):
+        # (total reads, window size, gap size, E-value), on a genome of 10 Mb with bins of 0.001
+        for (total_tags, window_size, gap_size, e_value) in ((20000, 200, 600, 1000), (20000, 200, 0, 1000),
+                                                             (200000, 200, 400, 100), (200000, 500, 1500, 1000),
+                                                             (5000, 100, 300, 10)):
+            parameters = (total_tags, window_size, gap_size, 0.2, 10000000, 0.001)
+            background = Background_island_probscore_statistics.Background_island_probscore_statistics(*parameters)
+            loop_background = LoopBackground(*parameters)
+            self.assertEqual(background.min_tags_in_window, loop_background.min_tags_in_window)
+            self.assertEqual(background.find_island_threshold(e_value), loop_background.find_island_threshold(e_value))
+            np.testing.assert_array_equal(background.island_expectation, loop_background.island_expectation)
+            np.testing.assert_array_equal(background.cumulative, loop_background.cumulative)
+
+    def test_expectation_beyond_computed_bins(self):
+        parameters = (20000, 200, 600, 0.2, 10000000, 0.001)
+        background = Background_island_probscore_statistics.Background_island_probscore_statistics(*parameters)
+        loop_background = LoopBackground(*parameters)
+        # Several blocks at once, then a bin within the last block
+        self.assertEqual(background.background_island_expectation(12345),
+                         loop_background.background_island_expectation(12345))
+        self.assertEqual(background.background_island_expectation(12000), loop_background.island_expectation[12000])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing.dummy import Pool
+
+import numpy as np
+
+import bgzf_files
+from sicer.lib import bam_reader
+from sicer.lib import read_store
+from sicer.src import remove_redundant_reads
+
+references = [('chr1', 5580032), ('chr2', 4541604), ('chrUn', 100000), ('chr3', 2453783)]
+
+# (reference id, position, name, mapping quality, flag, CIGAR) of the alignments of each reference
+alignments = [
+    [(0, 100, 'a', 30, 0, [(50, 'M')]),
+     (0, 100, 'b', 0, 0x10, [(10, 'M'), (2, 'I'), (5, 'M'), (3, 'D'), (4, 'N'), (2, 'S')]),
+     (0, 250, 'c', 60, 0x1 | 0x40, [(20, '='), (5, 'X')]),
+     (0, 300, 'c', 60, 0x1 | 0x80 | 0x10, [(25, 'M'), (5, 'H')]),
+     (0, 400, 'unmapped', 0, 0x4, [(50, 'M')])],
+    [(1, 0, 'd', 255, 0x10, [(36, 'M')])],
+    [(2, 10, 'e', 10, 0, [(36, 'M')])],
+    [],
+]
+
+# Reads of the alignments, as bedtools bamtobed writes them
+expected_reads = {
+    'chr1': [(100, 150, '+', 'a', '30'), (100, 122, '-', 'b', '0'), (250, 275, '+', 'c/1', '60'),
+             (300, 325, '-', 'c/2', '60')],
+    'chr2': [(0, 36, '-', 'd', '255')],
+}
+
+reference_chroms = ['chr1', 'chr2', None, 'chr3']
+
+
+def bam_records(reference_alignments):
+    return [bgzf_files.bam_record(*alignment) for alignment in reference_alignments]
+
+
+class BamReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'reads.bam')
+        (data, self.ranges) = bgzf_files.bam_file(references, [bam_records(records) for records in alignments])
+        with open(self.path, 'wb') as outfile:
+            outfile.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_all(self, keep_columns, start=None, end=None):
+        reads = {}
+        for batch in bam_reader.iter_reads(self.path, reference_chroms, keep_columns, start, end):
+            for (chrom, chrom_reads) in batch.items():
+                reads.setdefault(chrom, []).extend(chrom_reads.tolist())
+        return reads
+
+    def test_is_bam(self):
+        self.assertTrue(bam_reader.is_bam(self.path))
+        bgzf_path = os.path.join(self.temp_dir, 'reads.bed.gz')
+        with open(bgzf_path, 'wb') as outfile:
+            outfile.write(bgzf_files.bgzf_compress(b'chr1\t1\t2\ta\t0\t+\n'))
+        self.assertFalse(bam_reader.is_bam(bgzf_path))
+
+    def test_read_references(self):
+        self.assertEqual(bam_reader.read_references(self.path), [name for (name, length) in references])
+
+    def test_reads_like_bamtobed(self):
+        reads = self.read_all(keep_columns=True)
+        self.assertEqual(sorted(reads), sorted(expected_reads))
+        for (chrom, chrom_reads) in expected_reads.items():
+            self.assertEqual([(start, end, str(read_store.strand_symbols[strand]), name.decode(), score.decode())
+                              for (start, end, strand, name, score) in reads[chrom]], chrom_reads)
+
+    def test_compact_reads(self):
+        reads = self.read_all(keep_columns=False)
+        for (chrom, chrom_reads) in expected_reads.items():
+            self.assertEqual([(start, end, str(read_store.strand_symbols[strand]))
+                              for (start, end, strand) in reads[chrom]], [read[:3] for read in chrom_reads])
+
+    def test_reference_ranges(self):
+        index_path = self.path + '.bai'
+        with open(index_path, 'wb') as outfile:
+            outfile.write(bgzf_files.bai_file(self.ranges))
+        self.assertEqual(bam_reader.find_index(self.path), index_path)
+        ranges = bam_reader.reference_ranges(index_path)
+        self.assertEqual(ranges, self.ranges)
+        self.assertIsNone(ranges[3])
+        reads = self.read_all(False, *ranges[1])
+        self.assertEqual(list(reads), ['chr2'])
+        self.assertEqual(len(reads['chr2']), 1)
+
+    def test_truncated_file(self):
+        with open(self.path, 'wb') as outfile:
+            outfile.write(bgzf_files.bgzf_compress(bgzf_files.bam_header(references)
+                                                   + bgzf_files.bam_record(*alignments[0][0])[:-3]))
+        with self.assertRaises(ValueError):
+            self.read_all(False)
+
+
+class BamLibraryTest(unittest.TestCase):
+    '''A BAM file gives the same reads after redundancy removal as the BED file made from it'''
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        self.pool = Pool(2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def remove_redundant_reads(self, directory, file_name, data):
+        os.mkdir(directory)
+        os.chdir(directory)
+        with open(file_name, 'wb') as outfile:
+            outfile.write(data)
+        args = argparse.Namespace(species='pombe', redundancy_threshold=1, cpu=2, max_memory=None,
+                                  library_cache=None, library_cache_size=10240)
+        total = remove_redundant_reads.main(args, os.path.abspath(file_name), self.pool, keep_bed_columns=True)
+        os.chdir(self.temp_dir)
+        return total
+
+    def test_same_as_bed(self):
+        random = np.random.RandomState(2)
+        records = [[], [], [], []]
+        bed_lines = []
+        for i in range(3000):
+            reference_id = random.choice([0, 1, 3])
+            position = int(random.randint(0, 10000))
+            flag = int(random.choice([0, 0x10]))
+            records[reference_id].append(bgzf_files.bam_record(reference_id, position, 'r' + str(i), 20, flag,
+                                                               [(36, 'M')]))
+            bed_lines.append('\t'.join([references[reference_id][0], str(position), str(position + 36), 'r' + str(i),
+                                        '20', '-' if flag else '+']) + '\n')
+        (bam_data, ranges) = bgzf_files.bam_file(references, records)
+        bam_total = self.remove_redundant_reads('bam', 'reads.bam', bam_data)
+        # The reads of a BED file are in the order of the BAM file
+        bed_lines = [line for reference in references for line in bed_lines if line.startswith(reference[0] + '\t')]
+        bed_total = self.remove_redundant_reads('bed', 'reads.bed', ''.join(bed_lines).encode())
+        self.assertEqual(bam_total, bed_total)
+        for chrom in ('chr1', 'chr2', 'chr3', 'mat'):
+            for suffix in ('.npy', '_columns.npy'):
+                np.testing.assert_array_equal(np.load(os.path.join('bam', 'reads_' + chrom + suffix)),
+                                              np.load(os.path.join('bed', 'reads_' + chrom + suffix)))
+
+
+if __name__ == '__main__':
+    unittest.main()
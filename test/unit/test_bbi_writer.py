@@ -0,0 +1,200 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+import numpy as np
+
+from sicer.lib import bbi_writer
+
+chrom_sizes = {'chr1': 100000, 'chr2': 50000, 'chr10': 20000}
+
+
+class BBIFile:
+    '''Reader of the parts of a BBI file that the writers write, following the format of the UCSC genome browser'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self.data = infile.read()
+        (self.magic, self.version, zoom_count, chrom_tree_offset, self.data_offset, self.index_offset,
+         self.field_count, self.defined_field_count, auto_sql_offset, total_summary_offset,
+         self.uncompress_buffer_size, reserved) = struct.unpack_from('<IHHQQQHHQQIQ', self.data, 0)
+        self.zoom_headers = [struct.unpack_from('<IIQQ', self.data, 64 + 24 * level) for level in range(zoom_count)]
+        self.auto_sql = None
+        if auto_sql_offset:
+            self.auto_sql = self.data[auto_sql_offset:self.data.index(b'\0', auto_sql_offset)].decode()
+        self.total_summary = struct.unpack_from('<Qdddd', self.data, total_summary_offset)
+        self.data_count = struct.unpack_from('<Q', self.data, self.data_offset)[0]
+
+        (magic, block_size, key_size, value_size, item_count, reserved) = struct.unpack_from(
+            '<IIIIQQ', self.data, chrom_tree_offset)
+        assert magic == 0x78CA8C91
+        offset = chrom_tree_offset + 32
+        (is_leaf, reserved, count) = struct.unpack_from('<BBH', self.data, offset)
+        offset += 4
+        self.chroms = {}
+        for i in range(count):
+            chrom = self.data[offset:offset + key_size].rstrip(b'\0').decode()
+            self.chroms[chrom] = struct.unpack_from('<II', self.data, offset + key_size)
+            offset += key_size + 8
+
+    def blocks(self, index_offset):
+        '''Returns the (chrom ID, start, end, decompressed data) of the blocks of an R-tree index, in order'''
+        (magic, block_size, item_count, start_chrom, start_base, end_chrom, end_base, end_file_offset,
+         items_per_slot, reserved) = struct.unpack_from('<IIQIIIIQII', self.data, index_offset)
+        assert magic == 0x2468ACE0
+        blocks = []
+        self.read_node(index_offset + 48, blocks)
+        assert len(blocks) == item_count
+        return blocks
+
+    def read_node(self, offset, blocks):
+        (is_leaf, reserved, count) = struct.unpack_from('<BBH', self.data, offset)
+        for i in range(count):
+            if is_leaf:
+                (start_chrom, start, end_chrom, end, data_offset, size) = struct.unpack_from(
+                    '<IIIIQQ', self.data, offset + 4 + 32 * i)
+                blocks.append((start_chrom, start, end,
+                               zlib.decompress(self.data[data_offset:data_offset + size])))
+            else:
+                child_offset = struct.unpack_from('<IIIIQ', self.data, offset + 4 + 24 * i)[4]
+                self.read_node(child_offset, blocks)
+
+    def bigwig_items(self):
+        items = []
+        for (chrom_id, start, end, block) in self.blocks(self.index_offset):
+            (section_chrom, section_start, section_end, step, span, section_type, reserved, count) = \
+                struct.unpack_from('<IIIIIBBH', block, 0)
+            assert (section_chrom, section_type) == (chrom_id, 1)
+            section = np.frombuffer(block, dtype=[('start', '<u4'), ('end', '<u4'), ('value', '<f4')], count=count,
+                                    offset=24)
+            assert (section_start, section_end) == (start, end) == (section['start'][0], section['end'].max())
+            items.extend((chrom_id, int(item_start), int(item_end), float(value))
+                         for (item_start, item_end, value) in section)
+        return items
+
+    def bigbed_items(self):
+        items = []
+        for (chrom_id, start, end, block) in self.blocks(self.index_offset):
+            offset = 0
+            while offset < len(block):
+                (item_chrom, item_start, item_end) = struct.unpack_from('<III', block, offset)
+                rest_end = block.index(b'\0', offset + 12)
+                items.append((item_chrom, item_start, item_end, block[offset + 12:rest_end].decode()))
+                offset = rest_end + 1
+        return items
+
+    def zoom_summaries(self, level):
+        summaries = []
+        for (chrom_id, start, end, block) in self.blocks(self.zoom_headers[level][3]):
+            summaries.append(np.frombuffer(block, dtype=bbi_writer.summary_dtype))
+        return np.concatenate(summaries)
+
+
+class BBIWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'track')
+        random = np.random.RandomState(8)
+        self.intervals = {}
+        for chrom in ('chr1', 'chr2'):
+            starts = np.arange(30, chrom_sizes[chrom] + 100, 40)
+            starts = starts[random.rand(len(starts)) < 0.8]
+            self.intervals[chrom] = (starts, starts + 40, random.rand(len(starts)) * 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def expected_items(self, reader):
+        '''Intervals clipped to the chromosomes, in the order of the chromosome IDs'''
+        items = []
+        for chrom in sorted(self.intervals, key=lambda chrom: reader.chroms[chrom][0]):
+            (starts, ends, values) = self.intervals[chrom]
+            kept = starts < chrom_sizes[chrom]
+            items.extend(zip([reader.chroms[chrom][0]] * int(kept.sum()), starts[kept].tolist(),
+                             np.minimum(ends[kept], chrom_sizes[chrom]).tolist(),
+                             values[kept].astype(np.float32).astype(float).tolist()))
+        return items
+
+    def write_bigwig(self):
+        with bbi_writer.BigWigWriter(self.path, chrom_sizes, 2000) as writer:
+            for chrom in writer.chroms:
+                if chrom in self.intervals:
+                    writer.add_intervals(chrom, *self.intervals[chrom])
+
+    def test_bigwig(self):
+        # Small index nodes, so that the index has several levels
+        index_block_size = bbi_writer.index_block_size
+        bbi_writer.index_block_size = 2
+        try:
+            self.write_bigwig()
+        finally:
+            bbi_writer.index_block_size = index_block_size
+        reader = BBIFile(self.path)
+        self.assertEqual((reader.magic, reader.version), (0x888FFC26, 4))
+        self.assertEqual(reader.chroms, {chrom: (chrom_id, chrom_sizes[chrom])
+                                         for (chrom_id, chrom) in enumerate(sorted(chrom_sizes))})
+        items = reader.bigwig_items()
+        self.assertEqual(items, self.expected_items(reader))
+        # Sections of at most 1024 items
+        self.assertEqual(reader.data_count, len(reader.blocks(reader.index_offset)))
+        self.assertGreater(reader.data_count, 2)
+
+        lengths = np.array([end - start for (chrom_id, start, end, value) in items])
+        values = np.array([value for (chrom_id, start, end, value) in items])
+        (bases_covered, min_value, max_value, sum_data, sum_squares) = reader.total_summary
+        self.assertEqual(bases_covered, lengths.sum())
+        self.assertAlmostEqual(min_value, values.min(), places=5)
+        self.assertAlmostEqual(max_value, values.max(), places=5)
+        self.assertAlmostEqual(sum_data, (values * lengths).sum(), delta=1e-3 * sum_data)
+
+        self.assertGreater(len(reader.zoom_headers), 0)
+        for (level, (reduction, reserved, data_offset, index_offset)) in enumerate(reader.zoom_headers):
+            self.assertEqual(reduction, 2000 * 4 ** level)
+            summaries = reader.zoom_summaries(level)
+            self.assertEqual(int(summaries['valid_count'].sum()), bases_covered)
+            self.assertAlmostEqual(float(summaries['sum'].astype(np.float64).sum()), sum_data,
+                                   delta=1e-3 * sum_data)
+            self.assertTrue(np.all(summaries['end'] - summaries['start'] <= reduction))
+            self.assertTrue(np.all(summaries['start'] // reduction == (summaries['end'] - 1) // reduction))
+
+    def test_bigbed(self):
+        auto_sql = 'table test\n"Test"\n    (\n    string chrom; "Chromosome"\n    )\n'
+        with bbi_writer.BigBedWriter(self.path, chrom_sizes, 2000, 4, auto_sql) as writer:
+            for chrom in writer.chroms:
+                if chrom in self.intervals:
+                    (starts, ends, values) = self.intervals[chrom]
+                    writer.add_intervals(chrom, starts, ends, [str(i) for i in range(len(starts))])
+        reader = BBIFile(self.path)
+        self.assertEqual((reader.magic, reader.field_count, reader.defined_field_count), (0x8789F2EB, 4, 3))
+        self.assertEqual(reader.auto_sql, auto_sql)
+        items = reader.bigbed_items()
+        self.assertEqual(reader.data_count, len(items))
+        expected_items = self.expected_items(reader)
+        self.assertEqual([item[:3] for item in items], [item[:3] for item in expected_items])
+        # The text of the intervals clipped away is dropped with them
+        for chrom in ('chr1', 'chr2'):
+            chrom_id = reader.chroms[chrom][0]
+            texts = [item[3] for item in items if item[0] == chrom_id]
+            self.assertEqual(texts, [str(i) for i in range(len(texts))])
+
+    def test_empty_track(self):
+        with bbi_writer.BigWigWriter(self.path, chrom_sizes, 2000) as writer:
+            pass
+        reader = BBIFile(self.path)
+        self.assertEqual(reader.bigwig_items(), [])
+        self.assertEqual(reader.zoom_headers, [])
+        self.assertEqual(reader.total_summary[0], 0)
+
+    def test_chromosome_order(self):
+        with bbi_writer.BigWigWriter(self.path, chrom_sizes, 2000) as writer:
+            writer.add_intervals('chr2', [0], [10], [1.0])
+            with self.assertRaises(ValueError):
+                writer.add_intervals('chr10', [0], [10], [1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from sicer.lib import bed_reader
+from sicer.lib import read_store
+
+chroms = ['chr1', 'chr2', 'chr10']
+
+
+def bed_lines(count, seed=8):
+    '''Lines of a BED file with comment, track and blank lines, reads of other chromosomes and CRLF line endings'''
+    random = np.random.RandomState(seed)
+    lines = ['track name=reads\n', '# comment\n']
+    for i in range(count):
+        kind = random.rand()
+        if kind < 0.03:
+            lines.append(random.choice(['\n', '\r\n', '# chr1\t1\t2\n']))
+            continue
+        # Chromosomes missing from the species, some of them beginning with the name of one in it
+        chrom = random.choice(chroms + ['chr1_random', 'chr', 'chrUn'])
+        start = int(random.randint(0, 100000))
+        line = '\t'.join([chrom, str(start), str(start + random.randint(1, 100)), 'read' + str(i) * (i % 3 + 1),
+                          str(random.randint(0, 1000)), random.choice(['+', '-', '.'])])
+        lines.append(line + random.choice(['\n', '\r\n']))
+    return lines
+
+
+def per_line_reads(lines):
+    '''The reads of the lines, separated by chromosome like the first versions did line by line'''
+    reads = {}
+    for line in lines:
+        fields = line.rstrip('\r\n').split('\t')
+        if fields[0] not in chroms:
+            continue
+        reads.setdefault(fields[0], []).append((int(fields[1]), int(fields[2]),
+                                                {'+': read_store.PLUS, '-': read_store.MINUS}.get(fields[5],
+                                                                                                 read_store.OTHER),
+                                                fields[3].encode(), fields[4].encode()))
+    return reads
+
+
+class ParseLinesTest(unittest.TestCase):
+
+    def test_same_as_per_line(self):
+        lines = bed_lines(3000)
+        (reads, malformed) = bed_reader.parse_lines(''.join(lines).encode(), chroms, keep_columns=True)
+        self.assertFalse(malformed)
+        self.assertEqual({chrom: chrom_reads.tolist() for (chrom, chrom_reads) in reads.items()},
+                         per_line_reads(lines))
+        (compact_reads, malformed) = bed_reader.parse_lines(''.join(lines).encode(), chroms)
+        self.assertEqual(compact_reads['chr10'].dtype, read_store.read_dtype)
+        np.testing.assert_array_equal(compact_reads['chr10'], read_store.compact(reads['chr10']))
+
+    def test_last_line_without_newline(self):
+        (reads, malformed) = bed_reader.parse_lines(b'chr1\t5\t41\tr\t0\t+\r\nchr2\t7\t43\tr\t0\t-', chroms)
+        self.assertEqual(reads['chr1'].tolist(), [(5, 41, read_store.PLUS)])
+        self.assertEqual(reads['chr2'].tolist(), [(7, 43, read_store.MINUS)])
+
+    def test_malformed_lines(self):
+        self.assertEqual(bed_reader.parse_lines(b'chr1\t5\t41\tr\t0\n', chroms), ({}, True))
+        self.assertEqual(bed_reader.parse_lines(b'chr1\t5\tx\tr\t0\t+\n', chroms), ({}, True))
+        self.assertEqual(bed_reader.parse_lines(b'chr1\t5\t99999999999\tr\t0\t+\n', chroms), ({}, True))
+        # Lines of other chromosomes are not checked
+        (reads, malformed) = bed_reader.parse_lines(b'chrX\t5\n\nchr2\t-3\t43\tr\t0\t-\n', chroms)
+        self.assertFalse(malformed)
+        self.assertEqual(reads['chr2'].tolist(), [(-3, 43, read_store.MINUS)])
+        self.assertEqual(bed_reader.parse_lines(b'', chroms), ({}, False))
+
+
+class ChunkTest(unittest.TestCase):
+    '''The reads of the chunks of a file, put together, are the reads of the file line by line'''
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.lines = bed_lines(300, seed=9)
+        self.path = os.path.join(self.temp_dir, 'reads.bed')
+        with open(self.path, 'w', newline='') as outfile:
+            outfile.write(''.join(self.lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_chunks_cover_lines_once(self):
+        data = open(self.path, 'rb').read()
+        # Chunks of a few bytes, so that boundaries fall at every position of a line, including within CRLF
+        for min_chunks in (1, 2, 7, len(data) // 5, len(data)):
+            chunks = bed_reader.split_into_chunks(self.path, min_chunks)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], len(data))
+            self.assertEqual(b''.join(bed_reader.read_chunk(self.path, start, end) for (start, end) in chunks), data)
+
+    def test_same_as_per_line(self):
+        expected_reads = per_line_reads(self.lines)
+        for min_chunks in (3, 1000):
+            reads = {}
+            for (start, end) in bed_reader.split_into_chunks(self.path, min_chunks):
+                (chunk_reads, malformed) = bed_reader.parse_lines(bed_reader.read_chunk(self.path, start, end),
+                                                                  chroms, keep_columns=True)
+                self.assertFalse(malformed)
+                for (chrom, chrom_reads) in chunk_reads.items():
+                    reads.setdefault(chrom, []).extend(chrom_reads.tolist())
+            self.assertEqual(reads, expected_reads)
+
+    def test_chunk_size(self):
+        chunk_size = bed_reader.chunk_size
+        bed_reader.chunk_size = 100
+        try:
+            chunks = bed_reader.split_into_chunks(self.path)
+        finally:
+            bed_reader.chunk_size = chunk_size
+        self.assertTrue(all(end - start <= 100 for (start, end) in chunks))
+
+
+if __name__ == '__main__':
+    unittest.main()
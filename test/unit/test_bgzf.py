@@ -0,0 +1,140 @@
+import argparse
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing.dummy import Pool
+
+import numpy as np
+
+import bgzf_files
+from sicer.lib import bed_reader
+from sicer.lib import bgzf
+from sicer.src import remove_redundant_reads
+
+
+def bed_data(count, seed=3):
+    random = np.random.RandomState(seed)
+    lines = []
+    for i in range(count):
+        chrom = random.choice(['chr1', 'chr2', 'chr3', 'chrM'])
+        start = int(random.randint(0, 20000))
+        lines.append('\t'.join([chrom, str(start), str(start + 36), 'read' + str(i), str(random.randint(0, 60)),
+                                random.choice(['+', '-'])]) + '\n')
+    return ''.join(lines).encode()
+
+
+class BgzfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.data = bed_data(2000)
+        # Small blocks, so that lines run across blocks
+        self.path = self.write('reads.bed.gz', bgzf_files.bgzf_compress(self.data, 1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, file_name, data):
+        path = os.path.join(self.temp_dir, file_name)
+        with open(path, 'wb') as outfile:
+            outfile.write(data)
+        return path
+
+    def test_is_bgzf(self):
+        self.assertTrue(bgzf.is_bgzf(self.path))
+        self.assertTrue(bed_reader.is_gzip(self.path))
+        gzip_path = self.write('plain.bed.gz', gzip.compress(self.data))
+        self.assertFalse(bgzf.is_bgzf(gzip_path))
+        self.assertTrue(bed_reader.is_gzip(gzip_path))
+        self.assertFalse(bgzf.is_bgzf(self.write('reads.bed', self.data)))
+        self.assertFalse(bgzf.is_bgzf(self.write('empty.bed', b'')))
+
+    def test_block_offsets(self):
+        (offsets, file_size) = bgzf.block_offsets(self.path)
+        self.assertEqual(file_size, os.path.getsize(self.path))
+        # The data blocks and the end-of-file block
+        self.assertEqual(len(offsets), -(-len(self.data) // 1000) + 1)
+        with open(self.path, 'rb') as infile:
+            self.assertEqual([offset for (offset, block) in bgzf.iter_blocks(infile)], offsets)
+
+    def test_read_range(self):
+        self.assertEqual(b''.join(bgzf.read_range(self.path, 0)), self.data)
+        (offsets, file_size) = bgzf.block_offsets(self.path)
+        # From byte 10 of the third block to byte 500 of the sixth block
+        start = offsets[2] << 16 | 10
+        end = offsets[5] << 16 | 500
+        self.assertEqual(b''.join(bgzf.read_range(self.path, start, end)), self.data[2010:5500])
+        self.assertEqual(b''.join(bgzf.read_range(self.path, start, offsets[5] << 16)), self.data[2010:5000])
+
+    def test_read_range_in_batches(self):
+        batch_size = bgzf.batch_size
+        bgzf.batch_size = 3000
+        try:
+            pieces = list(bgzf.read_range(self.path, 0, threads=2))
+        finally:
+            bgzf.batch_size = batch_size
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(b''.join(pieces), self.data)
+
+    def test_corrupted_block(self):
+        with open(self.path, 'rb') as infile:
+            data = bytearray(infile.read())
+        data[30:40] = b'\xff' * 10
+        path = self.write('corrupted.bed.gz', bytes(data))
+        with self.assertRaises(ValueError):
+            b''.join(bgzf.read_range(path, 0))
+        with self.assertRaises(ValueError):
+            bgzf.block_offsets(self.write('not_bgzf.bed.gz', gzip.compress(self.data)))
+
+    def test_bgzf_chunks(self):
+        for min_chunks in (1, 3, 7, 100):
+            chunks = bed_reader.split_into_bgzf_chunks(self.path, min_chunks)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], os.path.getsize(self.path))
+            # Every line belongs to exactly one chunk
+            self.assertEqual(b''.join(bed_reader.read_bgzf_chunk(self.path, start, end) for (start, end) in chunks),
+                             self.data)
+
+
+class CompressedLibraryTest(unittest.TestCase):
+    '''Gzip and BGZF compressed BED files give the same reads after redundancy removal as the BED file'''
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        self.pool = Pool(3)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def remove_redundant_reads(self, directory, file_name, data):
+        os.mkdir(directory)
+        os.chdir(directory)
+        with open(file_name, 'wb') as outfile:
+            outfile.write(data)
+        args = argparse.Namespace(species='pombe', redundancy_threshold=1, cpu=3, max_memory=None,
+                                  library_cache=None, library_cache_size=10240)
+        total = remove_redundant_reads.main(args, os.path.abspath(file_name), self.pool, keep_bed_columns=True)
+        os.chdir(self.temp_dir)
+        return total
+
+    def test_same_as_bed(self):
+        data = bed_data(5000, seed=4)
+        bed_total = self.remove_redundant_reads('bed', 'reads.bed', data)
+        for (directory, compressed_data) in (('bgzf', bgzf_files.bgzf_compress(data, 5000)),
+                                             ('gzip', gzip.compress(data))):
+            self.assertEqual(self.remove_redundant_reads(directory, 'reads.bed.gz', compressed_data), bed_total)
+            for chrom in ('chr1', 'chr2', 'chr3', 'mat'):
+                for suffix in ('.npy', '_columns.npy'):
+                    np.testing.assert_array_equal(np.load(os.path.join(directory, 'reads_' + chrom + suffix)),
+                                                  np.load(os.path.join('bed', 'reads_' + chrom + suffix)))
+
+
+if __name__ == '__main__':
+    unittest.main()
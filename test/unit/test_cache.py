@@ -0,0 +1,137 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sicer.lib import cache
+from sicer.src import find_islands_in_pr
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.environ = {name: os.environ.get(name) for name in ('SICER_CACHE_DIR', 'XDG_CACHE_HOME')}
+        os.environ['SICER_CACHE_DIR'] = os.path.join(self.temp_dir, 'cache')
+
+    def tearDown(self):
+        for (name, value) in self.environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self.temp_dir)
+
+    def test_cache_directory(self):
+        self.assertEqual(cache.cache_directory(), os.path.join(self.temp_dir, 'cache'))
+        del os.environ['SICER_CACHE_DIR']
+        os.environ['XDG_CACHE_HOME'] = self.temp_dir
+        self.assertEqual(cache.cache_directory(), os.path.join(self.temp_dir, 'sicer'))
+
+    def test_get_and_put(self):
+        parameters = {'window_size': 200, 'e_value': 1000}
+        self.assertIsNone(cache.get('kind', parameters))
+        cache.put('kind', parameters, [2, 3.5])
+        self.assertEqual(cache.get('kind', parameters), [2, 3.5])
+        self.assertIsNone(cache.get('kind', {'window_size': 200, 'e_value': 100}))
+        self.assertIsNone(cache.get('other_kind', parameters))
+        # No partial entries are left
+        self.assertEqual([name for name in os.listdir(cache.cache_directory()) if name.endswith('.tmp')], [])
+
+    def test_unusable_entries(self):
+        parameters = {'window_size': 200}
+        path = cache.entry_path('kind', parameters)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as outfile:
+            outfile.write('{"parameters": ')
+        self.assertIsNone(cache.get('kind', parameters))
+        # An entry stored for other parameters under the same name
+        with open(path, 'w') as outfile:
+            json.dump({'parameters': {'window_size': 400}, 'value': 1}, outfile)
+        self.assertIsNone(cache.get('kind', parameters))
+
+    def test_unwritable_directory(self):
+        # The cache directory is a file, so nothing can be stored in it
+        with open(cache.cache_directory(), 'w') as outfile:
+            outfile.write('')
+        cache.put('kind', {'window_size': 200}, 1)
+        self.assertIsNone(cache.get('kind', {'window_size': 200}))
+
+    def test_unstorable_values(self):
+        parameters = {'window_size': 200}
+        circular = []
+        circular.append(circular)
+        # A value JSON cannot encode, a circular one, and an entry name taken by a directory
+        cache.put('kind', parameters, {1, 2})
+        cache.put('kind', parameters, circular)
+        os.makedirs(os.path.join(cache.entry_path('kind', parameters), 'entry'))
+        cache.put('kind', parameters, 1)
+        # Nothing is stored, and no partial entries are left
+        self.assertEqual(os.listdir(cache.cache_directory()), [os.path.basename(cache.entry_path('kind', parameters))])
+        self.assertIsNone(cache.get('kind', parameters))
+
+    def test_eviction(self):
+        max_size = cache.max_size
+        cache.max_size = 300
+        try:
+            for window_size in range(10):
+                cache.put('kind', {'window_size': window_size}, list(range(10)))
+                # The most recently used entry is kept
+                self.assertIsNotNone(cache.get('kind', {'window_size': 0}))
+        finally:
+            cache.max_size = max_size
+        entries = os.listdir(cache.cache_directory())
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(cache.cache_directory(), entry)) for entry in entries),
+                             300)
+        self.assertIsNotNone(cache.get('kind', {'window_size': 9}))
+
+
+class IslandThresholdCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.environ.get('SICER_CACHE_DIR')
+        os.environ['SICER_CACHE_DIR'] = self.temp_dir
+
+    def tearDown(self):
+        if self.cache_dir is None:
+            del os.environ['SICER_CACHE_DIR']
+        else:
+            os.environ['SICER_CACHE_DIR'] = self.cache_dir
+        shutil.rmtree(self.temp_dir)
+
+    def island_thresholds(self, no_cache):
+        args = argparse.Namespace(species='pombe', window_size=200, gap_size=600, e_value=1000,
+                                  effective_genome_fraction=0.74, no_cache=no_cache)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return find_islands_in_pr.island_thresholds(args, 100000)
+
+    def test_cached_thresholds(self):
+        thresholds = self.island_thresholds(no_cache=False)
+        self.assertEqual(len(os.listdir(self.temp_dir)), 1)
+        # Taken from the cache, as the same thresholds
+        self.assertEqual(self.island_thresholds(no_cache=False), thresholds)
+        with open(os.path.join(self.temp_dir, os.listdir(self.temp_dir)[0])) as infile:
+            self.assertEqual(json.load(infile)['value'], list(thresholds[:2]))
+
+    def test_no_cache(self):
+        self.island_thresholds(no_cache=True)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+        thresholds = self.island_thresholds(no_cache=False)
+        # A planted entry is only read without --no_cache
+        entry = os.path.join(self.temp_dir, os.listdir(self.temp_dir)[0])
+        with open(entry) as infile:
+            cached = json.load(infile)
+        cached['value'] = [0, 0.0]
+        with open(entry, 'w') as outfile:
+            json.dump(cached, outfile)
+        self.assertEqual(self.island_thresholds(no_cache=True), thresholds)
+        self.assertEqual(self.island_thresholds(no_cache=False)[:2], (0, 0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
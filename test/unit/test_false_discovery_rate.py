@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+import scipy.stats
+
+from sicer.lib import false_discovery_rate
+
+
+def loop_genome_wide(pvalue_arrays):
+    '''The FDR of the first versions: the p-values concatenated one chromosome at a time and adjusted in a loop'''
+    p_value_list = np.array([])
+    for pvalues in pvalue_arrays:
+        p_value_list = np.concatenate([p_value_list, pvalues])
+    p_value_rank_array = scipy.stats.rankdata(p_value_list)
+    alpha_stats = []
+    capped = []
+    for index in range(len(p_value_list)):
+        alpha_stat = p_value_list[index] * len(p_value_list) / p_value_rank_array[index]
+        capped.append(alpha_stat > 1)
+        if alpha_stat > 1:
+            alpha_stat = 1
+        alpha_stats.append(alpha_stat)
+    return (alpha_stats, capped)
+
+
+class FalseDiscoveryRateTest(unittest.TestCase):
+
+    def test_ties_and_capping(self):
+        pvalues = np.array([0.01, 0.9, 0.01, 1.0, 0.2, 0.01])
+        (adjusted_pvalues, capped) = false_discovery_rate.benjamini_hochberg(pvalues)
+        # The three tied p-values share the rank 2. An adjusted p-value of exactly 1 is not capped.
+        np.testing.assert_allclose(adjusted_pvalues, [0.03, 1, 0.03, 1, 0.3, 0.03])
+        self.assertEqual(capped.tolist(), [False, True, False, False, False, False])
+
+    def test_same_as_loop(self):
+        random = np.random.RandomState(18)
+        # Chromosomes without islands, and p-values of 1 and ties across chromosomes
+        pvalue_arrays = [np.round(random.rand(length), 3) for length in (300, 0, 50, 1000, 0, 7)]
+        pvalue_arrays[2][:20] = 1
+        (alpha_arrays, capped_arrays) = false_discovery_rate.genome_wide(pvalue_arrays)
+        self.assertEqual([len(alpha) for alpha in alpha_arrays], [len(pvalues) for pvalues in pvalue_arrays])
+        (alpha_stats, capped) = loop_genome_wide(pvalue_arrays)
+        self.assertEqual(np.concatenate(alpha_arrays).tolist(), alpha_stats)
+        self.assertEqual(np.concatenate(capped_arrays).tolist(), capped)
+        self.assertTrue(any(capped))
+
+    def test_no_islands(self):
+        (alpha_arrays, capped_arrays) = false_discovery_rate.genome_wide([np.empty(0), np.empty(0)])
+        self.assertEqual([len(alpha) for alpha in alpha_arrays], [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import io
+import math
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from multiprocessing.dummy import Pool
+
+import numpy as np
+
+from sicer.lib import GenomeData
+from sicer.lib import island_store
+from sicer.lib import scheduler
+from sicer.src import find_islands_in_pr
+
+window_size = 200
+gap_size = 600
+
+
+def random_graph(random, chrom_length):
+    '''Windows of a chromosome with tags, with dense stretches where the windows make up islands'''
+    starts = np.arange(0, chrom_length, window_size)
+    density = np.where(random.rand(len(starts) // 50 + 1) < 0.2, 0.9, 0.1).repeat(50)[:len(starts)]
+    starts = starts[random.rand(len(starts)) < density]
+    graph = np.empty(len(starts), dtype=island_store.window_dtype)
+    graph['start'] = starts
+    graph['end'] = starts + window_size - 1
+    graph['count'] = random.poisson(3, len(starts)) + 1
+    return graph
+
+
+def loop_filter_ineligible_windows(chrom_graph, min_tags_in_window, average):
+    '''The window scoring of the first versions, one window at a time'''
+    filtered_chrom_graph = []
+    for window in chrom_graph:
+        read_count = window['count']
+        score = -1
+        if (read_count >= min_tags_in_window):
+            prob = find_islands_in_pr.poisson(read_count, average)
+            if prob < 1e-250:
+                score = 1000
+            else:
+                score = -math.log(prob)
+        if score > 0:
+            filtered_chrom_graph.append(['chr1', window['start'], window['end'], score])
+    return filtered_chrom_graph
+
+
+def loop_combine_proximal_islands(islands, gap, window_size_buffer):
+    '''The merging of windows into islands of the first versions, one window at a time'''
+    if len(islands) == 0:
+        return []
+    final_islands = []
+    current_island = list(islands[0])
+    for island in islands[1:]:
+        if island[1] - current_island[2] <= gap + window_size_buffer:
+            current_island[2] = island[2]
+            current_island[3] += island[3]
+        else:
+            final_islands.append(current_island)
+            current_island = list(island)
+    final_islands.append(current_island)
+    return final_islands
+
+
+def as_lists(islands):
+    return [['chr1', island['start'], island['end'], island['score']] for island in islands]
+
+
+class WindowScoreTest(unittest.TestCase):
+    '''Scoring windows by table lookup and merging them into islands give the same islands as the window loops'''
+
+    def test_score_table(self):
+        score_table = find_islands_in_pr.window_score_table(3, 2.0, 10)
+        self.assertEqual(len(score_table), 10)
+        self.assertTrue(np.all(score_table[:3] == -1))
+        self.assertEqual(score_table[5], -math.log(find_islands_in_pr.poisson(5, 2.0)))
+
+    def test_same_as_loop(self):
+        graph = random_graph(np.random.RandomState(14), 500000)
+        # Counts beyond the table, some of them with probabilities that underflow
+        graph['count'][::20] = np.arange(len(graph[::20])) * 37 % 600 + 10
+        for (min_tags_in_window, average, table_size) in ((2, 2.0, 500), (2, 2.0, 12), (4, 0.5, 8), (1, 6.0, 1)):
+            score_table = find_islands_in_pr.window_score_table(min_tags_in_window, average, table_size)
+            filtered_graph = find_islands_in_pr.filter_ineligible_windows(graph, min_tags_in_window, average,
+                                                                          score_table)
+            expected_graph = loop_filter_ineligible_windows(graph, min_tags_in_window, average)
+            self.assertEqual(as_lists(filtered_graph), expected_graph)
+            self.assertTrue(np.any(filtered_graph['score'] == 1000))
+            for gap in (0, window_size, gap_size):
+                self.assertEqual(as_lists(find_islands_in_pr.combine_proximal_islands(filtered_graph, gap, 2)),
+                                 loop_combine_proximal_islands(expected_graph, gap, 2))
+
+    def test_underflow(self):
+        score_table = find_islands_in_pr.window_score_table(1, 0.5, 500)
+        graph = np.array([(0, 199, 300), (200, 399, 600)], dtype=island_store.window_dtype)
+        self.assertEqual(score_table[300], 1000)
+        self.assertEqual(find_islands_in_pr.filter_ineligible_windows(graph, 1, 0.5, score_table)['score'].tolist(),
+                         [1000, 1000])
+
+    def test_gap_of_exactly_gap_size(self):
+        # The second window starts gap + buffer after the end of the first, the third one more than that
+        windows = np.array([(0, 199, 1.0), (801, 1000, 2.0), (1603, 1802, 4.0)], dtype=island_store.island_dtype)
+        islands = find_islands_in_pr.combine_proximal_islands(windows, gap_size, 2)
+        self.assertEqual(islands.tolist(), [(0, 1000, 3.0), (1603, 1802, 4.0)])
+        self.assertEqual(as_lists(islands), loop_combine_proximal_islands(as_lists(windows), gap_size, 2))
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_split_range(self):
+        self.assertEqual(scheduler.split_range(0, 10), [(0, 0)])
+        self.assertEqual(scheduler.split_range(5, 10), [(0, 5)])
+        self.assertEqual(scheduler.split_range(20, 10), [(0, 10), (10, 20)])
+        self.assertEqual(scheduler.split_range(25, 10), [(0, 10), (10, 20), (20, 25)])
+
+    def test_part_size(self):
+        # Four parts per process, unless the parts would be smaller than min_size
+        self.assertEqual(scheduler.part_size(8000, 2, 100), 1000)
+        self.assertEqual(scheduler.part_size(8000, 2, 1500), 1500)
+        self.assertEqual(scheduler.part_size(8001, 2, 100), 1001)
+        # Rounded up to a multiple of the alignment
+        self.assertEqual(scheduler.part_size(8001, 2, 100, 200), 1200)
+        self.assertEqual(scheduler.part_size(0, 4, 0, 200), 0)
+
+    def test_map_by_cost(self):
+        with Pool(2) as pool:
+            self.assertEqual(scheduler.map_by_cost(pool, abs, [-1, 2, -3, 4], [1, 4, 2, 3]), [1, 2, 3, 4])
+            self.assertEqual(scheduler.starmap_by_cost(pool, pow, [(2, 3), (3, 2)], [0, 1]), [8, 9])
+
+    def test_largest_first_in_input_order(self):
+        started = []
+
+        def task(item):
+            started.append(item)
+            # The largest tasks take the longest, so they end after the small ones started after them
+            time.sleep(item / 100.0)
+            return -item
+
+        items = [1, 5, 2, 4, 0, 3]
+        with Pool(1) as pool:
+            self.assertEqual(scheduler.map_by_cost(pool, task, items, items), [-1, -5, -2, -4, 0, -3])
+        self.assertEqual(started, [5, 4, 3, 2, 1, 0])
+        with Pool(3) as pool:
+            self.assertEqual(scheduler.map_by_cost(pool, task, items, items), [-1, -5, -2, -4, 0, -3])
+            self.assertEqual(scheduler.starmap_by_cost(pool, lambda item, power: task(item) ** power,
+                                                       [(item, 3) for item in items], items),
+                             [-1, -125, -8, -64, 0, -27])
+
+
+class StitchIslandsTest(unittest.TestCase):
+    '''The islands of the segments of a chromosome stitched together are the islands of the whole chromosome'''
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        self.graph = random_graph(np.random.RandomState(9), 2000000)
+        np.save('reads_chr1_graph.npy', self.graph)
+        self.score_table = find_islands_in_pr.window_score_table(2, 2.0, 500)
+
+    def tearDown(self):
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def stitched_islands(self, segment_length):
+        results = [find_islands_in_pr.filter_and_find_islands(2, gap_size, 2.0, self.score_table, 'reads', 'chr1',
+                                                              segment)
+                   for segment in scheduler.split_range(2000000, segment_length)]
+        self.assertEqual(sum(result[0] for result in results), len(np.load('reads_chr1_graph.npy')))
+        return find_islands_in_pr.stitch_islands([result[1] for result in results], [result[2] for result in results],
+                                                 gap_size, 2)
+
+    def test_same_as_whole_chromosome(self):
+        filtered_graph = find_islands_in_pr.filter_ineligible_windows(self.graph, 2, 2.0, self.score_table)
+        islands = find_islands_in_pr.combine_proximal_islands(filtered_graph, gap_size, 2)
+        self.assertGreater(len(islands), 100)
+        # Segments of a few windows, so that islands span several segments
+        for segment_length in (2000000, 100000, 3000, 600, 200):
+            np.testing.assert_array_equal(self.stitched_islands(segment_length), islands)
+
+    def test_windows_within_gap_of_border(self):
+        # Two windows on either side of the border of the segments, within the gap of each other
+        graph = np.array([(0, 199, 5), (200, 399, 5), (1000, 1199, 5), (5000, 5199, 5)],
+                         dtype=island_store.window_dtype)
+        np.save('reads_chr1_graph.npy', graph)
+        islands = self.stitched_islands(800)
+        self.assertEqual(islands[['start', 'end']].tolist(), [(0, 1199), (5000, 5199)])
+        self.assertEqual(islands['score'][0], self.score_table[5] * 3)
+
+    def test_no_windows(self):
+        np.save('reads_chr1_graph.npy', np.empty(0, dtype=island_store.window_dtype))
+        self.assertEqual(len(self.stitched_islands(1000)), 0)
+
+
+class FindIslandsTest(unittest.TestCase):
+    '''Islands found from the segments of the chromosomes are the same as those found from whole chromosomes'''
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        self.pool = Pool(4)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def save_graphs(self):
+        random = np.random.RandomState(10)
+        for (chrom, chrom_length) in GenomeData.species_chrom_lengths['pombe'].items():
+            np.save('reads_' + chrom + '_graph.npy', random_graph(random, chrom_length))
+
+    def test_same_as_whole_chromosomes(self):
+        args = argparse.Namespace(species='pombe', treatment_file='reads.bed', window_size=window_size,
+                                  gap_size=gap_size, e_value=1000, effective_genome_fraction=0.74, no_cache=True,
+                                  cpu=4, verbose=False, output_directory=self.temp_dir)
+        chroms = GenomeData.species_chroms['pombe']
+        with contextlib.redirect_stdout(io.StringIO()):
+            (min_tags_in_window, score_threshold, average) = find_islands_in_pr.island_thresholds(args, 200000)
+        score_table = find_islands_in_pr.window_score_table(min_tags_in_window, average, 500)
+        self.save_graphs()
+        expected_islands = {}
+        for chrom in chroms:
+            find_islands_in_pr.find_islands_of_chrom(min_tags_in_window, gap_size, score_threshold, average,
+                                                     score_table, False, 'reads', chrom)
+            expected_islands[chrom] = np.load('reads_' + chrom + '_graph.npy')
+        # The graphs are saved again, as the islands are saved in place of them
+        self.save_graphs()
+
+        min_segment_length = scheduler.min_segment_length
+        scheduler.min_segment_length = 100000
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                find_islands_in_pr.main(args, 200000, self.pool)
+        finally:
+            scheduler.min_segment_length = min_segment_length
+        self.assertGreater(len(expected_islands['chr1']), 10)
+        for chrom in chroms:
+            np.testing.assert_array_equal(np.load('reads_' + chrom + '_graph.npy'), expected_islands[chrom])
+        self.assertTrue(os.path.exists('reads-W200-G600.scoreisland'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import sicer_runs
+from sicer.lib import associate_tags_with_regions
+from sicer.lib import read_store
+
+
+@unittest.skipUnless(sicer_runs.enough_cpus, 'sicer leaves one CPU for I/O, so it needs at least two')
+class FusedPipelineTest(unittest.TestCase):
+    '''A fused run (--fused) writes the same files as the staged run'''
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        random = np.random.RandomState(11)
+        self.treatment_file = os.path.join(self.temp_dir, 'treatment.bed')
+        self.control_file = os.path.join(self.temp_dir, 'control.bed')
+        sicer_runs.write_library(self.treatment_file, random, 20000, sicer_runs.enriched_regions)
+        sicer_runs.write_library(self.control_file, random, 20000, [])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_sicer(self, output_directory, *options):
+        sicer_runs.run('sicer', ['-t', self.treatment_file, '-c', self.control_file, '--significant_reads',
+                                 '-o', output_directory] + list(options), self.temp_dir)
+        return os.path.join(self.temp_dir, output_directory)
+
+    def test_same_as_staged(self):
+        staged_directory = self.run_sicer('staged')
+        fused_directory = self.run_sicer('fused', '--fused')
+        output_files = sorted(os.listdir(staged_directory))
+        self.assertIn('treatment-W200-G600-islands-summary', output_files)
+        self.assertEqual(sorted(os.listdir(fused_directory)), output_files)
+        self.assertEqual(sicer_runs.different_files(staged_directory, fused_directory, output_files), [])
+        with open(os.path.join(staged_directory, 'treatment-W200-G600-FDR0.01-island.bed')) as infile:
+            self.assertGreater(len(infile.readlines()), 0)
+
+
+class WindowTagCountsTest(unittest.TestCase):
+    '''The read counts of islands made of windows are the sums of the tag counts of their windows'''
+
+    def test_readcounts_from_windows(self):
+        random = np.random.RandomState(12)
+        reads = np.empty(5000, dtype=read_store.read_dtype)
+        reads['start'] = random.randint(0, 20000, len(reads))
+        reads['end'] = reads['start'] + 36
+        reads['strand'] = random.choice([read_store.PLUS, read_store.MINUS, read_store.OTHER], len(reads))
+        windows = associate_tags_with_regions.window_tag_counts(reads, 150, 200)
+        self.assertTrue(np.all(np.diff(windows['start']) > 0))
+        self.assertEqual(windows['count'].sum(), np.count_nonzero(reads['strand'] != read_store.OTHER))
+
+        island_starts = np.array([0, 1000, 5000, 19800, 30000])
+        island_ends = np.array([599, 1199, 9999, 20199, 30199])
+        np.testing.assert_array_equal(
+            associate_tags_with_regions.find_readcount_of_islands_from_windows(island_starts, island_ends, windows),
+            associate_tags_with_regions.find_readcount_of_islands(island_starts, island_ends, reads, 150))
+
+
+if __name__ == '__main__':
+    unittest.main()
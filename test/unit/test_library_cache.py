@@ -0,0 +1,201 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing.dummy import Pool
+
+import numpy as np
+
+from sicer.lib import library_cache
+from sicer.src import remove_redundant_reads
+
+chroms = ['chr1', 'chr2']
+
+
+class LibraryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+        with open('reads.bed', 'w') as outfile:
+            outfile.write('chr1\t0\t36\tread\t0\t+\n' * 100)
+
+    def tearDown(self):
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def save_reads(self, file_name, keep_bed_columns=False):
+        '''Saves the reads of the chromosomes as remove_redundant_reads does, and returns their results'''
+        filtered_result = []
+        for (i, chrom) in enumerate(chroms):
+            np.save(file_name + '_' + chrom + '.npy', np.arange(10 * (i + 1)))
+            if keep_bed_columns:
+                np.save(file_name + '_' + chrom + '_columns.npy', np.arange(5 * (i + 1)))
+            filtered_result.append((chrom + ' message', 10 * (i + 1)))
+        return filtered_result
+
+    def test_fingerprint(self):
+        fingerprint = library_cache.fingerprint('reads.bed')
+        self.assertEqual(fingerprint['size'], os.path.getsize('reads.bed'))
+        # A renamed file keeps its fingerprint
+        os.rename('reads.bed', 'renamed.bed')
+        self.assertEqual(library_cache.fingerprint('renamed.bed'), fingerprint)
+        # The end of a large file is hashed too
+        fingerprint_block_size = library_cache.fingerprint_block_size
+        library_cache.fingerprint_block_size = 64
+        try:
+            fingerprint = library_cache.fingerprint('renamed.bed')
+            with open('renamed.bed', 'r+') as outfile:
+                outfile.seek(os.path.getsize('renamed.bed') - 2)
+                outfile.write('-')
+            os.utime('renamed.bed', ns=(0, fingerprint['mtime']))
+            changed_fingerprint = library_cache.fingerprint('renamed.bed')
+        finally:
+            library_cache.fingerprint_block_size = fingerprint_block_size
+        self.assertEqual((changed_fingerprint['size'], changed_fingerprint['mtime']),
+                         (fingerprint['size'], fingerprint['mtime']))
+        self.assertNotEqual(changed_fingerprint['hash'], fingerprint['hash'])
+
+    def test_store_and_lookup(self):
+        for keep_bed_columns in (False, True):
+            parameters = library_cache.library_parameters('reads.bed', 'pombe', 1, keep_bed_columns)
+            self.assertIsNone(library_cache.lookup(self.cache_dir, parameters, 'cached', chroms))
+            filtered_result = self.save_reads('reads', keep_bed_columns)
+            library_cache.store(self.cache_dir, 1 << 20, parameters, 'reads', chroms, filtered_result)
+            self.assertEqual(library_cache.lookup(self.cache_dir, parameters, 'cached', chroms), filtered_result)
+            for chrom in chroms:
+                for suffix in library_cache.read_file_suffixes(keep_bed_columns):
+                    np.testing.assert_array_equal(np.load('cached_' + chrom + suffix),
+                                                  np.load('reads_' + chrom + suffix))
+                    os.remove('cached_' + chrom + suffix)
+        # An entry for each setting of the columns, and no partial entries
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(self.cache_dir)))
+
+    def test_other_parameters(self):
+        parameters = library_cache.library_parameters('reads.bed', 'pombe', 1, False)
+        library_cache.store(self.cache_dir, 1 << 20, parameters, 'reads', chroms, self.save_reads('reads'))
+        for other_parameters in (library_cache.library_parameters('reads.bed', 'pombe', 2, False),
+                                 library_cache.library_parameters('reads.bed', 'hg38', 1, False)):
+            self.assertIsNone(library_cache.lookup(self.cache_dir, other_parameters, 'cached', chroms))
+        # Chromosomes missing from the entry
+        self.assertIsNone(library_cache.lookup(self.cache_dir, parameters, 'cached', chroms + ['chr3']))
+        self.assertEqual([name for name in os.listdir('.') if name.startswith('cached')], [])
+
+    def test_unusable_entries(self):
+        parameters = library_cache.library_parameters('reads.bed', 'pombe', 1, False)
+        library_cache.store(self.cache_dir, 1 << 20, parameters, 'reads', chroms, self.save_reads('reads'))
+        entry = library_cache.entry_path(self.cache_dir, parameters)
+        manifest_path = os.path.join(entry, library_cache.manifest_name)
+        with open(manifest_path) as infile:
+            manifest = json.load(infile)
+
+        # A manifest of other parameters under the same name
+        with open(manifest_path, 'w') as outfile:
+            json.dump(dict(manifest, parameters=dict(parameters, species='hg38')), outfile)
+        self.assertIsNone(library_cache.lookup(self.cache_dir, parameters, 'cached', chroms))
+        # A corrupted manifest
+        with open(manifest_path, 'w') as outfile:
+            outfile.write('{"parameters": ')
+        self.assertIsNone(library_cache.lookup(self.cache_dir, parameters, 'cached', chroms))
+        # A missing file of reads, after the reads of the first chromosome are linked
+        with open(manifest_path, 'w') as outfile:
+            json.dump(manifest, outfile)
+        os.remove(os.path.join(entry, 'chr2.npy'))
+        self.assertIsNone(library_cache.lookup(self.cache_dir, parameters, 'cached', chroms))
+        self.assertEqual([name for name in os.listdir('.') if name.startswith('cached')], [])
+
+    def test_eviction(self):
+        entries = []
+        for i in range(4):
+            with open('reads.bed', 'a') as outfile:
+                outfile.write('chr2\t0\t36\tread\t0\t-\n')
+            parameters = library_cache.library_parameters('reads.bed', 'pombe', 1, False)
+            library_cache.store(self.cache_dir, 1 << 20, parameters, 'reads', chroms, self.save_reads('reads'))
+            entries.append((parameters, library_cache.entry_path(self.cache_dir, parameters)))
+            os.utime(os.path.join(entries[-1][1], library_cache.manifest_name), (i, i))
+        # The oldest entry is used, and so becomes the most recently used one
+        self.assertIsNotNone(library_cache.lookup(self.cache_dir, entries[0][0], 'cached', chroms))
+        entry_size = library_cache.entry_size(entries[0][1])
+        library_cache.evict(self.cache_dir, 2 * entry_size)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         sorted(os.path.basename(entries[i][1]) for i in (0, 3)))
+        library_cache.evict(self.cache_dir, 0)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_link_or_copy(self):
+        np.save('reads.npy', np.arange(10))
+        library_cache.link_or_copy('reads.npy', 'linked.npy')
+        self.assertTrue(os.path.samefile('reads.npy', 'linked.npy'))
+
+        def link(source, destination):
+            raise OSError('Invalid cross-device link')
+        os_link = os.link
+        os.link = link
+        try:
+            library_cache.link_or_copy('reads.npy', 'copied.npy')
+        finally:
+            os.link = os_link
+        self.assertFalse(os.path.samefile('reads.npy', 'copied.npy'))
+        np.testing.assert_array_equal(np.load('copied.npy'), np.arange(10))
+
+    def test_unwritable_directory(self):
+        # The cache directory is a file, so nothing can be stored in it
+        with open(self.cache_dir, 'w') as outfile:
+            outfile.write('')
+        parameters = library_cache.library_parameters('reads.bed', 'pombe', 1, False)
+        library_cache.store(self.cache_dir, 1 << 20, parameters, 'reads', chroms, self.save_reads('reads'))
+        self.assertIsNone(library_cache.lookup(self.cache_dir, parameters, 'cached', chroms))
+
+
+class CachedLibraryTest(unittest.TestCase):
+    '''A library taken from the library cache gives the same reads as redundancy removal'''
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        self.pool = Pool(2)
+        random = np.random.RandomState(14)
+        with open('reads.bed', 'w') as outfile:
+            for i in range(3000):
+                start = random.randint(0, 5000)
+                outfile.write('\t'.join([random.choice(['chr1', 'chr2', 'chr3']), str(start), str(start + 36),
+                                         'read' + str(i), '0', random.choice(['+', '-'])]) + '\n')
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def remove_redundant_reads(self, directory):
+        os.mkdir(directory)
+        os.chdir(directory)
+        args = argparse.Namespace(species='pombe', redundancy_threshold=1, cpu=2, max_memory=None,
+                                  library_cache=os.path.join(self.temp_dir, 'cache'), library_cache_size=10240)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            total = remove_redundant_reads.main(args, os.path.join(self.temp_dir, 'reads.bed'), self.pool,
+                                                keep_bed_columns=True)
+        os.chdir(self.temp_dir)
+        return (total, 'taken from the library cache' in output.getvalue())
+
+    def test_same_as_redundancy_removal(self):
+        self.assertEqual(self.remove_redundant_reads('first')[1], False)
+        (total, cached) = self.remove_redundant_reads('second')
+        self.assertTrue(cached)
+        self.assertEqual(total, self.remove_redundant_reads('third')[0])
+        for chrom in ('chr1', 'chr2', 'chr3', 'mat'):
+            for suffix in ('.npy', '_columns.npy'):
+                np.testing.assert_array_equal(np.load(os.path.join('second', 'reads_' + chrom + suffix)),
+                                              np.load(os.path.join('first', 'reads_' + chrom + suffix)))
+
+
+if __name__ == '__main__':
+    unittest.main()
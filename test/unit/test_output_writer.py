@@ -0,0 +1,82 @@
+import io
+import unittest
+
+import numpy as np
+
+from sicer.lib import output_writer
+
+
+def written(columns, **kwargs):
+    outfile = io.StringIO()
+    output_writer.write_columns(outfile, columns, **kwargs)
+    return outfile.getvalue()
+
+
+class FormatTest(unittest.TestCase):
+    '''The fields are written as the str() of the values the lines were made of, one line at a time'''
+
+    def test_integers(self):
+        for dtype in (np.int32, np.int64, np.uint32):
+            values = np.array([0, 7, 2147483647], dtype=dtype)
+            self.assertEqual(output_writer.format_column(values), ['0', '7', '2147483647'])
+        self.assertEqual(output_writer.format_column(np.array([-1, -250], dtype=np.int32)), ['-1', '-250'])
+
+    def test_floats(self):
+        values = np.array([0.0, 1.0, 0.1 + 0.2, 1e-05, 2.5e-300, 1.2345678901234567e+20, 123456.789, np.nan,
+                           np.inf])
+        expected = ['0.0', '1.0', '0.30000000000000004', '1e-05', '2.5e-300', '1.2345678901234567e+20', '123456.789',
+                    'nan', 'inf']
+        self.assertEqual(output_writer.format_column(values), expected)
+        self.assertEqual(output_writer.format_column(values), [str(float(value)) for value in values])
+        self.assertEqual(output_writer.format_column(values), ['%s' % value for value in values.tolist()])
+
+    def test_integer_column(self):
+        # P-values of 1 and FDRs capped at 1 were the integer 1, and scores of 1000 the integer 1000
+        values = np.array([1.0, 1.0, 0.5, 1000.0, 3e-08])
+        (masked_values, format_values) = output_writer.integer_column(values, np.array([True, False, False, True,
+                                                                                        False]))
+        self.assertEqual(format_values(masked_values), ['1', '1.0', '0.5', '1000', '3e-08'])
+
+    def test_rounded_format(self):
+        # The normalized WIG values, round(float(count / scaling_factor), 2)
+        values = np.array([3 / 0.7, 0.125, 0.135, 2.0, 1 / 3.0, 1e-07])
+        self.assertEqual(output_writer.rounded_format(2)(values), ['4.29', '0.12', '0.14', '2.0', '0.33', '0.0'])
+        self.assertEqual(output_writer.rounded_format(2)(values), [str(round(float(value), 2)) for value in values])
+
+    def test_text(self):
+        self.assertEqual(output_writer.format_text(np.array([b'read1', b'', b'.'])), ['read1', '', '.'])
+        self.assertEqual(output_writer.format_text(np.array(['+', '-'])), ['+', '-'])
+
+
+class WriteColumnsTest(unittest.TestCase):
+
+    def test_lines(self):
+        columns = [np.array([10, 2000], dtype=np.int32), np.array([1199, 2199], dtype=np.int32),
+                   np.array([5.5, 1e-12]), output_writer.integer_column(np.array([1.0, 0.25]), np.array([True, False])),
+                   (np.array([b'r1', b'r2']), output_writer.format_text)]
+        self.assertEqual(written(columns, prefix='chr1\t'),
+                         'chr1\t10\t1199\t5.5\t1\tr1\nchr1\t2000\t2199\t1e-12\t0.25\tr2\n')
+        self.assertEqual(written(columns[:2], prefix='', suffix='\t\n'), '10\t1199\t\n2000\t2199\t\n')
+        self.assertEqual(written([np.empty(0, dtype=np.int32)], prefix='chr1\t'), '')
+        self.assertEqual(written([]), '')
+
+    def test_same_as_line_by_line(self):
+        random = np.random.RandomState(19)
+        starts = np.sort(random.randint(0, 10 ** 8, 1000)).astype(np.int32)
+        scores = random.exponential(50, 1000)
+        capped = random.rand(1000) < 0.2
+        scores[capped] = 1
+        expected = ''.join('chr2\t' + str(start) + '\t' + str(start + 199) + '\t' + str(1 if is_capped else score)
+                           + '\n' for (start, score, is_capped) in zip(starts.tolist(), scores.tolist(), capped))
+        block_size = output_writer.block_size
+        # Blocks of a few rows, and a last block that is not full
+        output_writer.block_size = 64
+        try:
+            self.assertEqual(written([starts, starts + 199, output_writer.integer_column(scores, capped)],
+                                     prefix='chr2\t'), expected)
+        finally:
+            output_writer.block_size = block_size
+
+
+if __name__ == '__main__':
+    unittest.main()
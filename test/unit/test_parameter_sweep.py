@@ -0,0 +1,83 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import sicer_runs
+from sicer.src import parameter_sweep
+
+
+class GridTest(unittest.TestCase):
+
+    def test_point_name(self):
+        self.assertEqual(parameter_sweep.point_name(200, 600, 1000), 'W200-G600-E1000')
+        self.assertEqual(parameter_sweep.point_name(300, 900, 0.5), 'W300-G900-E0.5')
+
+    def test_grid_points(self):
+        args = argparse.Namespace(gap_size=[600, 900], e_value=[100, 1000])
+        self.assertEqual(parameter_sweep.grid_points(args, 200), [(600, 100), (600, 1000)])
+        self.assertEqual(parameter_sweep.grid_points(args, 300), [(600, 100), (600, 1000), (900, 100), (900, 1000)])
+        # No gap is a multiple of the window size
+        self.assertEqual(parameter_sweep.grid_points(args, 400), [])
+
+    def test_remove_repeated_values(self):
+        args = argparse.Namespace(window_size=[300, 200, 300], gap_size=[600, 600], e_value=[1000, 100, 1000, 100],
+                                  false_discovery_rate=[0.1, 0.01, 0.1])
+        parameter_sweep.remove_repeated_values(args)
+        self.assertEqual(args.window_size, [300, 200])
+        self.assertEqual(args.gap_size, [600])
+        self.assertEqual(args.e_value, [1000, 100])
+        self.assertEqual(args.false_discovery_rate, [0.1, 0.01])
+        self.assertEqual(parameter_sweep.grid_points(args, 300), [(600, 1000), (600, 100)])
+
+
+@unittest.skipUnless(sicer_runs.enough_cpus, 'sicer leaves one CPU for I/O, so it needs at least two')
+class SweepTest(unittest.TestCase):
+    '''Every point of a sweep writes the same files as a SICER run with its parameters'''
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        random = np.random.RandomState(13)
+        self.treatment_file = os.path.join(self.temp_dir, 'treatment.bed')
+        self.control_file = os.path.join(self.temp_dir, 'control.bed')
+        sicer_runs.write_library(self.treatment_file, random, 20000, sicer_runs.enriched_regions)
+        sicer_runs.write_library(self.control_file, random, 20000, [])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_same_as_single_runs(self):
+        # Repeated values only run their points once
+        sicer_runs.run('sicer_sweep', ['-t', self.treatment_file, '-c', self.control_file, '-w', '200', '300', '200',
+                                       '-g', '600', '900', '600', '-fdr', '0.01', '0.1', '0.01', '-o', 'sweep'],
+                       self.temp_dir)
+        sweep_directory = os.path.join(self.temp_dir, 'sweep')
+        # 900 is not a multiple of 200
+        points = [(200, 600), (300, 600), (300, 900)]
+        self.assertEqual(sorted(os.listdir(sweep_directory)),
+                         sorted(parameter_sweep.point_name(window_size, gap_size, 1000)
+                                for (window_size, gap_size) in points))
+        for (window_size, gap_size) in points:
+            point_directory = os.path.join(sweep_directory, parameter_sweep.point_name(window_size, gap_size, 1000))
+            point_files = set(os.listdir(point_directory))
+            unmatched_files = set(point_files)
+            for false_discovery_rate in ('0.01', '0.1'):
+                output_directory = 'W' + str(window_size) + '-G' + str(gap_size) + '-FDR' + false_discovery_rate
+                sicer_runs.run('sicer', ['-t', self.treatment_file, '-c', self.control_file, '-w', str(window_size),
+                                         '-g', str(gap_size), '-fdr', false_discovery_rate, '-o', output_directory],
+                               self.temp_dir)
+                output_files = os.listdir(os.path.join(self.temp_dir, output_directory))
+                self.assertTrue(point_files.issuperset(output_files))
+                self.assertEqual(sicer_runs.different_files(point_directory,
+                                                            os.path.join(self.temp_dir, output_directory),
+                                                            output_files), [])
+                unmatched_files.difference_update(output_files)
+            # Every file of the point is written by one of the runs
+            self.assertEqual(unmatched_files, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from sicer.lib import island_store
+from sicer.lib import parquet_writer
+
+if parquet_writer.available():
+    import pyarrow
+    import pyarrow.parquet
+
+chroms = ['chr1', 'chr2', 'chr3']
+
+
+def random_summary(random, dtype, count):
+    summary = np.zeros(count, dtype=dtype)
+    summary['start'] = np.arange(count) * 1000
+    summary['end'] = summary['start'] + 599
+    for name in dtype.names[2:]:
+        summary[name] = random.randint(0, 50, count) if dtype[name].kind == 'i' else random.rand(count)
+    return summary
+
+
+@unittest.skipUnless(parquet_writer.available(), 'Parquet export requires pyarrow')
+class ParquetWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.random = np.random.RandomState(20)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def check_file(self, file_path, summaries, dtype):
+        parquet_file = pyarrow.parquet.ParquetFile(file_path)
+        # One row group per chromosome with islands, in the order of the chromosomes
+        chroms_with_islands = [chrom for (chrom, summary) in zip(chroms, summaries) if len(summary) > 0]
+        self.assertEqual(parquet_file.num_row_groups, len(chroms_with_islands))
+        for (i, chrom) in enumerate(chroms_with_islands):
+            row_group = parquet_file.read_row_group(i)
+            summary = summaries[chroms.index(chrom)]
+            self.assertEqual(row_group.num_rows, len(summary))
+            self.assertEqual(set(row_group.column('chrom').to_pylist()), {chrom})
+            for name in dtype.names:
+                values = row_group.column(name).to_numpy()
+                self.assertEqual(values.dtype, dtype[name])
+                np.testing.assert_array_equal(values, summary[name])
+        table = parquet_file.read()
+        self.assertEqual(table.schema.field('chrom').type, pyarrow.dictionary(pyarrow.int32(), pyarrow.string()))
+        self.assertEqual(table.column_names, ['chrom'] + list(dtype.names))
+
+    def test_summary(self):
+        summaries = [random_summary(self.random, island_store.summary_dtype, count) for count in (30, 0, 5)]
+        file_path = os.path.join(self.temp_dir, 'islands-summary.parquet')
+        parquet_writer.write_summaries(file_path, chroms, summaries, island_store.summary_dtype)
+        self.check_file(file_path, summaries, island_store.summary_dtype)
+
+    def test_df_summary(self):
+        # The p-values of a chromosome that were all the integer 1 are written as floats
+        summaries = [random_summary(self.random, island_store.df_summary_dtype(np.float64, np.float64), 20),
+                     random_summary(self.random, island_store.df_summary_dtype(np.int64, np.float64), 8),
+                     random_summary(self.random, island_store.df_summary_dtype(np.float64, np.int64), 3)]
+        summaries[1]['pvalue_A_vs_B'] = 1
+        dtype = island_store.df_summary_dtype(np.float64, np.float64)
+        file_path = os.path.join(self.temp_dir, 'summary.parquet')
+        parquet_writer.write_summaries(file_path, chroms, summaries, dtype)
+        self.check_file(file_path, summaries, dtype)
+
+    def test_no_islands(self):
+        file_path = os.path.join(self.temp_dir, 'islands-summary.parquet')
+        parquet_writer.write_summaries(file_path, chroms, [np.empty(0, dtype=island_store.summary_dtype)] * 3,
+                                       island_store.summary_dtype)
+        table = pyarrow.parquet.read_table(file_path)
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.column_names, ['chrom'] + list(island_store.summary_dtype.names))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from sicer.lib import read_store
+from sicer.src import remove_redundant_reads
+
+
+def sorted_bed_reads(bed_reads, cutoff):
+    '''The reads kept by the redundancy removal of the first versions, which sorted the reads on all their columns'''
+    rows = np.empty(len(bed_reads), dtype=[('start', np.int32), ('end', np.int32), ('name', 'S20'), ('score', 'S6'),
+                                           ('strand', np.int8)])
+    for field in rows.dtype.names:
+        rows[field] = bed_reads[field]
+    rows = np.sort(rows, order=['strand', 'start', 'end'])
+    kept = []
+    copies = {}
+    for row in rows:
+        read = (row['strand'], row['start'], row['end'])
+        copies[read] = copies.get(read, 0) + 1
+        if copies[read] <= max(cutoff, 1):
+            kept.append(row)
+    return [(row['start'], row['end'], row['strand'], row['name'], row['score']) for row in kept]
+
+
+class RecoverBedColumnsTest(unittest.TestCase):
+
+    def bed_reads(self, rows):
+        bed_reads = np.empty(len(rows), dtype=read_store.bed_columns_dtype(8, 2))
+        for (i, row) in enumerate(rows):
+            bed_reads[i] = row
+        return bed_reads
+
+    def recovered(self, bed_reads, cutoff):
+        (message, filtered_reads) = remove_redundant_reads.strand_broken_remove('chr1', cutoff,
+                                                                               read_store.compact(bed_reads))
+        recovered = read_store.recover_bed_columns(filtered_reads, bed_reads)
+        return [(row['start'], row['end'], row['strand'], row['name'], row['score']) for row in recovered]
+
+    def test_copies_sorted_by_name_and_score(self):
+        # Copies of a read with different names and scores, not in sorted order in the file
+        bed_reads = self.bed_reads([(100, 136, read_store.PLUS, b'readC', b'0'),
+                                    (100, 136, read_store.PLUS, b'readA', b'5'),
+                                    (50, 86, read_store.MINUS, b'readD', b'0'),
+                                    (100, 136, read_store.PLUS, b'readA', b'1'),
+                                    (100, 136, read_store.PLUS, b'readB', b'0'),
+                                    (50, 86, read_store.MINUS, b'readB', b'0')])
+        self.assertEqual(self.recovered(bed_reads, 2), [(100, 136, read_store.PLUS, b'readA', b'1'),
+                                                        (100, 136, read_store.PLUS, b'readA', b'5'),
+                                                        (50, 86, read_store.MINUS, b'readB', b'0'),
+                                                        (50, 86, read_store.MINUS, b'readD', b'0')])
+
+    def test_same_as_sorting_all_columns(self):
+        random = np.random.RandomState(11)
+        count = 2000
+        bed_reads = np.empty(count, dtype=read_store.bed_columns_dtype(8, 2))
+        bed_reads['start'] = random.randint(0, 100, count)
+        bed_reads['end'] = bed_reads['start'] + 36
+        bed_reads['strand'] = random.choice([read_store.PLUS, read_store.MINUS, read_store.OTHER], count)
+        bed_reads['name'] = np.char.add(b'read', random.randint(0, 30, count).astype('S4'))
+        bed_reads['score'] = random.randint(0, 3, count).astype('S2')
+        for cutoff in (1, 2, 5):
+            self.assertEqual(self.recovered(bed_reads, cutoff), sorted_bed_reads(bed_reads, cutoff))
+
+
+if __name__ == '__main__':
+    unittest.main()
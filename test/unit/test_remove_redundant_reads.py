@@ -0,0 +1,166 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from sicer.lib import read_store
+from sicer.src import remove_redundant_reads
+
+
+def random_reads(random, count, max_start):
+    '''Reads with many copies, on both strands and a few other strand symbols'''
+    reads = np.empty(count, dtype=read_store.read_dtype)
+    reads['start'] = random.randint(0, max_start, count)
+    reads['end'] = reads['start'] + random.choice([36, 50], count)
+    reads['strand'] = random.choice([read_store.PLUS, read_store.MINUS, read_store.OTHER], count, p=[0.45, 0.45, 0.1])
+    return reads
+
+
+def loop_remove(reads, cutoff):
+    '''The redundancy removal of the first versions, one read at a time over reads sorted by (start, end)'''
+    current_start = 0
+    current_end = 0
+    current_count = 1
+    retained = 0
+    mask = []
+    for i, read in enumerate(reads):
+        start = read[1]
+        end = read[2]
+        if start != current_start or end != current_end:
+            retained += 1
+            current_start = start
+            current_end = end
+            current_count = 1
+        else:
+            current_count += 1
+            if current_count <= cutoff:
+                retained += 1
+            else:
+                mask.append(i)
+    return (len(reads), retained, mask)
+
+
+class RedundancyRemovalTest(unittest.TestCase):
+
+    def test_copies_within_cutoff(self):
+        keys = np.array([1, 1, 1, 2, 3, 3], dtype=np.int64)
+        self.assertEqual(remove_redundant_reads.remove_redundant_1chrom_single_strand_sorted(keys, 2)[:2], (6, 5))
+        # At least one copy of each read is retained
+        (total, retained, keep) = remove_redundant_reads.remove_redundant_1chrom_single_strand_sorted(keys, 0)
+        self.assertEqual(keep.tolist(), [True, False, False, True, True, False])
+        # Copies of the first read already seen in an earlier list
+        (total, retained, keep) = remove_redundant_reads.remove_redundant_1chrom_single_strand_sorted(keys, 2, 1)
+        self.assertEqual(keep.tolist(), [True, False, False, True, True, True])
+
+    def test_same_as_loop(self):
+        random = np.random.RandomState(4)
+        reads = random_reads(random, 3000, 200)
+        # The loop starts with a read at (0, 0)
+        reads['start'] += 1
+        keys = np.sort(read_store.sort_keys(reads))
+        sorted_reads = read_store.from_sort_keys(keys, read_store.PLUS)
+        loop_reads = [('chr1', read['start'], read['end']) for read in sorted_reads]
+        for cutoff in (0, 1, 2, 3, 10):
+            (total, retained, mask) = loop_remove(loop_reads, cutoff)
+            expected_keep = np.ones(total, dtype=bool)
+            expected_keep[mask] = False
+            (vector_total, vector_retained, keep) = \
+                remove_redundant_reads.remove_redundant_1chrom_single_strand_sorted(keys, cutoff)
+            self.assertEqual((vector_total, vector_retained), (total, retained))
+            np.testing.assert_array_equal(keep, expected_keep)
+            # The keys split into two parts, with the copies of the read at the split counted in the second part
+            for split in (1, 100, 1500, total - 1):
+                previous_copies = split - np.searchsorted(keys, keys[split], side='left')
+                first = remove_redundant_reads.remove_redundant_1chrom_single_strand_sorted(keys[:split], cutoff)
+                second = remove_redundant_reads.remove_redundant_1chrom_single_strand_sorted(keys[split:], cutoff,
+                                                                                             previous_copies)
+                self.assertEqual(first[1] + second[1], retained)
+                np.testing.assert_array_equal(np.concatenate((first[2], second[2])), expected_keep)
+
+    def test_strands_same_as_loop(self):
+        reads = random_reads(np.random.RandomState(12), 2000, 100)
+        reads['start'] += 1
+        for cutoff in (1, 2, 4):
+            (message, filtered_reads) = remove_redundant_reads.strand_broken_remove('chr1', cutoff, reads)
+            for strand in (read_store.PLUS, read_store.MINUS, read_store.OTHER):
+                strand_reads = np.sort(reads[reads['strand'] == strand], order=['start', 'end'])
+                loop_reads = [('chr1', read['start'], read['end']) for read in strand_reads]
+                (total, retained, mask) = loop_remove(loop_reads, cutoff)
+                np.testing.assert_array_equal(filtered_reads[filtered_reads['strand'] == strand],
+                                              np.delete(strand_reads, mask))
+
+    def test_filtered_reads_are_sorted(self):
+        reads = random_reads(np.random.RandomState(5), 1000, 300)
+        (message, filtered_reads) = remove_redundant_reads.strand_broken_remove('chr1', 1, reads)
+        self.assertEqual(len(np.unique(filtered_reads)), len(filtered_reads))
+        order = np.lexsort((filtered_reads['end'], filtered_reads['start'], filtered_reads['strand']))
+        np.testing.assert_array_equal(order, np.arange(len(filtered_reads)))
+
+
+class ExternalRedundancyRemovalTest(unittest.TestCase):
+    '''The bounded-memory redundancy removal gives the same reads as the in-memory one'''
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+
+    def tearDown(self):
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def save_parts(self, reads, num_parts):
+        part_files = []
+        for (i, part) in enumerate(np.array_split(reads, num_parts)):
+            part_files.append('reads_chr1_part' + str(i) + '.npy')
+            np.save(part_files[-1], part)
+        return part_files
+
+    def test_same_as_in_memory(self):
+        random = np.random.RandomState(6)
+        # Enough reads for several runs per strand and several rounds of merging per run
+        reads = random_reads(random, 30000, 2000)
+        for cutoff in (1, 3):
+            (message, filtered_reads) = remove_redundant_reads.strand_broken_remove('chr1', cutoff, reads)
+            part_files = self.save_parts(reads, 4)
+            (external_message, total_retained) = remove_redundant_reads.external_strand_broken_remove(
+                'chr1', cutoff, 'reads', part_files, 4000)
+            self.assertEqual(external_message, message)
+            self.assertEqual(total_retained, len(filtered_reads))
+            np.testing.assert_array_equal(np.load('reads_chr1.npy'), filtered_reads)
+            # Only the filtered reads and the part files are left
+            self.assertEqual(sorted(os.listdir('.')), sorted(part_files + ['reads_chr1.npy']))
+
+    def test_copies_across_rounds(self):
+        # One read with more copies than a block of a run
+        reads = np.zeros(5000, dtype=read_store.read_dtype)
+        reads['end'] = 36
+        part_files = self.save_parts(reads, 3)
+        (message, total_retained) = remove_redundant_reads.external_strand_broken_remove('chr1', 2, 'reads',
+                                                                                         part_files, 1500)
+        self.assertEqual(total_retained, 2)
+        self.assertEqual(np.load('reads_chr1.npy').tolist(), [(0, 36, read_store.PLUS)] * 2)
+
+    def test_filter_reads_with_bed_columns(self):
+        random = np.random.RandomState(7)
+        reads = random_reads(random, 6000, 1000)
+        bed_reads = np.empty(len(reads), dtype=read_store.bed_columns_dtype(8, 2))
+        for field in read_store.read_dtype.names:
+            bed_reads[field] = reads[field]
+        bed_reads['name'] = np.char.add(b'read', np.arange(len(reads)).astype('S4'))
+        bed_reads['score'] = b'0'
+        for (i, part) in enumerate(np.array_split(bed_reads, 3)):
+            np.save('reads_chr1_part' + str(i) + '.npy', part)
+        (message, filtered_reads, saved) = remove_redundant_reads.filter_reads('reads', 1, True, 2000,
+                                                                               {'chr1': [0, 1, 2]}, 'chr1')
+        self.assertTrue(saved)
+        np.testing.assert_array_equal(filtered_reads, remove_redundant_reads.strand_broken_remove('chr1', 1,
+                                                                                                  reads)[1])
+        np.testing.assert_array_equal(np.load('reads_chr1_columns.npy'), bed_reads)
+        self.assertFalse(any(file_name.startswith('reads_chr1_part') for file_name in os.listdir('.')))
+
+
+if __name__ == '__main__':
+    unittest.main()
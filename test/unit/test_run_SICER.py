@@ -0,0 +1,74 @@
+import argparse
+import contextlib
+import io
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import sicer_runs
+from sicer.lib import scheduler
+from sicer.main import run_SICER
+
+
+class ProcessesTest(unittest.TestCase):
+    '''A run with more processes than chromosomes splits them into parts and writes the same files'''
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        random = np.random.RandomState(21)
+        self.treatment_file = os.path.join(self.temp_dir, 'treatment.bed')
+        self.control_file = os.path.join(self.temp_dir, 'control.bed')
+        sicer_runs.write_library(self.treatment_file, random, 20000, sicer_runs.enriched_regions)
+        sicer_runs.write_library(self.control_file, random, 20000, [])
+
+    def tearDown(self):
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def run_sicer(self, output_directory, cpu):
+        args = argparse.Namespace(treatment_file=self.treatment_file, control_file=self.control_file, species='pombe',
+                                  redundancy_threshold=1, window_size=200, fragment_size=150,
+                                  effective_genome_fraction=0.74, false_discovery_rate=0.01,
+                                  output_directory=os.path.join(self.temp_dir, output_directory), gap_size=600,
+                                  e_value=1000, cpu=cpu, max_memory=None, library_cache=None,
+                                  library_cache_size=10240, no_cache=True, significant_reads=True,
+                                  binary_tracks=False, parquet=False, fused=False, verbose=False,
+                                  subcommand='SICER', df=False)
+        os.makedirs(args.output_directory)
+        pool_sizes = []
+
+        def pool(processes):
+            pool_sizes.append(processes)
+            return mp_pool(processes=processes)
+
+        mp_pool = mp.Pool
+        (min_reads_per_part, min_segment_length) = (scheduler.min_reads_per_part, scheduler.min_segment_length)
+        # Parts small enough for the chromosomes of pombe to be split between the processes
+        (scheduler.min_reads_per_part, scheduler.min_segment_length) = (1000, 100000)
+        mp.Pool = pool
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_SICER.main(args)
+        finally:
+            mp.Pool = mp_pool
+            (scheduler.min_reads_per_part, scheduler.min_segment_length) = (min_reads_per_part, min_segment_length)
+            os.chdir(self.curr_path)
+        self.assertEqual(pool_sizes, [cpu])
+        return args.output_directory
+
+    def test_more_processes_than_chromosomes(self):
+        one_process_directory = self.run_sicer('one_process', 1)
+        directory = self.run_sicer('six_processes', 6)
+        output_files = sorted(os.listdir(one_process_directory))
+        self.assertIn('treatment-W200-G600-FDR0.01-islandfiltered.bed', output_files)
+        self.assertEqual(sorted(os.listdir(directory)), output_files)
+        self.assertEqual(sicer_runs.different_files(one_process_directory, directory, output_files), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import argparse
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+from multiprocessing.dummy import Pool
+
+import numpy as np
+
+from sicer.lib import GenomeData
+from sicer.lib import read_store
+from sicer.src import run_make_graph_file_by_chrom
+
+
+def random_reads(random, count, chrom_length):
+    reads = np.empty(count, dtype=read_store.read_dtype)
+    reads['start'] = np.sort(random.randint(0, chrom_length - 100, count))
+    reads['end'] = reads['start'] + 50
+    reads['strand'] = random.randint(0, 2, count)
+    return reads
+
+
+class CoarsenWindowCountsTest(unittest.TestCase):
+
+    def test_same_as_counting_the_tags(self):
+        random = np.random.RandomState(0)
+        chrom_length = 100003
+        tags = random.randint(0, chrom_length, 5000)
+        (fine_graph, total) = run_make_graph_file_by_chrom.Generate_windows_and_count_tags(tags, 'chr1', chrom_length,
+                                                                                            50)
+        for window_size in (100, 200, 1000):
+            (graph, total) = run_make_graph_file_by_chrom.Generate_windows_and_count_tags(tags, 'chr1',
+                                                                                         chrom_length, window_size)
+            coarse_graph = run_make_graph_file_by_chrom.coarsen_window_counts(fine_graph, window_size, chrom_length)
+            np.testing.assert_array_equal(coarse_graph, graph)
+
+    def test_empty_graph(self):
+        (graph, total) = run_make_graph_file_by_chrom.Generate_windows_and_count_tags(
+            np.empty(0, dtype=np.int64), 'chr1', 1000, 100)
+        self.assertEqual(len(run_make_graph_file_by_chrom.coarsen_window_counts(graph, 200, 1000)), 0)
+
+
+class PyramidBasesTest(unittest.TestCase):
+
+    def test_common_divisor(self):
+        self.assertEqual(run_make_graph_file_by_chrom.pyramid_bases([200, 400, 600]), {200: 200, 400: 200, 600: 200})
+        self.assertEqual(run_make_graph_file_by_chrom.pyramid_bases([300, 200]), {200: 100, 300: 100})
+
+    def test_co_prime_window_sizes_are_counted_directly(self):
+        self.assertEqual(run_make_graph_file_by_chrom.pyramid_bases([200, 333]), {200: 200, 333: 333})
+        self.assertEqual(run_make_graph_file_by_chrom.pyramid_bases([200, 400, 333, 666]),
+                         {200: 200, 400: 200, 333: 333, 666: 333})
+
+    def test_base_is_not_below_the_ratio(self):
+        for window_sizes in ([200, 210], [150, 200, 250], [500, 700, 1100]):
+            bases = run_make_graph_file_by_chrom.pyramid_bases(window_sizes)
+            for (window_size, base) in bases.items():
+                self.assertEqual(window_size % base, 0)
+                smallest = min(size for size in bases if bases[size] == base)
+                self.assertGreaterEqual(base * run_make_graph_file_by_chrom.max_pyramid_ratio, smallest)
+
+
+class GraphPyramidTest(unittest.TestCase):
+
+    def setUp(self):
+        self.curr_path = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        self.args = argparse.Namespace(treatment_file='reads.bed', species='pombe', fragment_size=150, cpu=2,
+                                       verbose=False, window_size=200)
+        random = np.random.RandomState(1)
+        self.chrom_lengths = GenomeData.species_chrom_lengths['pombe']
+        for chrom in GenomeData.species_chroms['pombe']:
+            np.save('reads_' + chrom + '.npy', random_reads(random, 2000, self.chrom_lengths[chrom]))
+        self.pool = Pool(2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        os.chdir(self.curr_path)
+        shutil.rmtree(self.temp_dir)
+
+    def graphs_of_window_size(self, window_size):
+        self.args.window_size = window_size
+        total = run_make_graph_file_by_chrom.main(self.args, self.pool)
+        graphs = {chrom: np.load(run_make_graph_file_by_chrom.graph_file_name(self.args, False, chrom))
+                  for chrom in GenomeData.species_chroms['pombe']}
+        return (graphs, total)
+
+    def test_co_prime_window_sizes(self):
+        window_sizes = [200, 333]
+        tracemalloc.start()
+        try:
+            totals = run_make_graph_file_by_chrom.main(self.args, self.pool, window_sizes=window_sizes)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # Counting the tags of the largest chromosome in windows of 1 bp takes 8 bytes per bp
+        self.assertLess(peak, max(self.chrom_lengths.values()))
+
+        for window_size in window_sizes:
+            (graphs, total) = self.graphs_of_window_size(window_size)
+            self.assertEqual(totals[window_size], total)
+            for chrom in GenomeData.species_chroms['pombe']:
+                level = np.load(run_make_graph_file_by_chrom.graph_file_name(self.args, False, chrom, window_size))
+                np.testing.assert_array_equal(level, graphs[chrom])
+                self.assertLessEqual(len(level), self.chrom_lengths[chrom] // window_size)
+                self.assertTrue(np.all(level['end'] - level['start'] == window_size - 1))
+                self.assertTrue(np.all(level['end'] < self.chrom_lengths[chrom]))
+
+    def test_pyramid(self):
+        window_sizes = [200, 400, 600]
+        totals = run_make_graph_file_by_chrom.main(self.args, self.pool, window_sizes=window_sizes)
+        for window_size in window_sizes:
+            (graphs, total) = self.graphs_of_window_size(window_size)
+            self.assertEqual(totals[window_size], total)
+            for chrom in GenomeData.species_chroms['pombe']:
+                level = np.load(run_make_graph_file_by_chrom.graph_file_name(self.args, False, chrom, window_size))
+                np.testing.assert_array_equal(level, graphs[chrom])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import multiprocessing as mp
+import os
+import unittest
+
+import numpy as np
+
+from sicer.lib import shared_arrays
+
+
+def shared_range(length):
+    return shared_arrays.share(np.arange(length, dtype=np.int64))
+
+
+def block_exists(handle):
+    return os.path.exists(os.path.join(shared_arrays.shared_memory_directory, handle.name))
+
+
+class SharedArraysTest(unittest.TestCase):
+
+    def setUp(self):
+        # Every array is shared, however small
+        self.min_shared_size = shared_arrays.min_shared_size
+        shared_arrays.min_shared_size = 1
+
+    def tearDown(self):
+        shared_arrays.min_shared_size = self.min_shared_size
+
+    def test_small_arrays(self):
+        shared_arrays.min_shared_size = self.min_shared_size
+        array = np.arange(10)
+        self.assertIs(shared_arrays.share(array), array)
+        with shared_arrays.SharedArrays() as received:
+            self.assertIs(received.adopt(array), array)
+            self.assertIs(received.receive(array), array)
+        with shared_arrays.borrowed(array) as borrowed_array:
+            self.assertIs(borrowed_array, array)
+
+    def test_receive(self):
+        array = np.array([(1, 2, 3), (4, 5, 6)], dtype=[('start', np.int32), ('end', np.int32), ('count', np.int32)])
+        handle = shared_arrays.share(array)
+        self.assertIsInstance(handle, shared_arrays.SharedArray)
+        self.assertEqual((handle.dtype, handle.shape), (array.dtype, array.shape))
+        with shared_arrays.SharedArrays() as received:
+            np.testing.assert_array_equal(received.receive(handle), array)
+            self.assertTrue(block_exists(handle))
+        self.assertFalse(block_exists(handle))
+
+    def test_borrowed_and_adopted(self):
+        handle = shared_arrays.share(np.arange(100))
+        owner = shared_arrays.SharedArrays()
+        self.assertIs(owner.adopt(handle), handle)
+        with shared_arrays.borrowed(handle) as array:
+            self.assertEqual(array.sum(), 4950)
+        # Borrowing does not free the block, its owner does
+        self.assertTrue(block_exists(handle))
+        owner.release()
+        self.assertFalse(block_exists(handle))
+        # Released once only
+        owner.release()
+
+    def test_no_room(self):
+        has_room = shared_arrays.has_room
+        shared_arrays.has_room = lambda size: False
+        try:
+            array = np.arange(100)
+            self.assertIs(shared_arrays.share(array), array)
+        finally:
+            shared_arrays.has_room = has_room
+
+    def test_arrays_of_pool(self):
+        shared_arrays.start_tracker()
+        with mp.Pool(2) as pool:
+            handles = pool.map(shared_range, [10, 1000, 100000])
+        # The blocks outlive the processes that made them, until the parent releases them
+        self.assertTrue(all(block_exists(handle) for handle in handles))
+        with shared_arrays.SharedArrays() as received:
+            for (length, handle) in zip([10, 1000, 100000], handles):
+                np.testing.assert_array_equal(received.receive(handle), np.arange(length))
+        self.assertFalse(any(block_exists(handle) for handle in handles))
+
+
+if __name__ == '__main__':
+    unittest.main()